@@ -1,53 +1,293 @@
 import asyncio
 import argparse
-from typing import Any, Dict
+import copy
+import fcntl
+import os
+import re
+import socket
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
 
-from flash_embed.config import load_config
-from flash_embed.core.pipeline import AsyncPipeline
+from flash_embed.config import Config, load_config
+from flash_embed.core.io.reader import ParallelShardReader, TextShardReader, expand_shards
+from flash_embed.core.pipeline import AsyncPipeline, LeasedShardSource, ShardOrchestrator
+from flash_embed.core.pipeline.scheduler import FAILED_NAME, load_failures
+from flash_embed.core.pipeline.workers import build_stager
+from flash_embed.core.telemetry.logging import get_logger
+from flash_embed.core.writer import MANIFEST_NAME, RETRY_DIR, merge_manifests
 
+COMMANDS = ("run", "seed", "retry", "build-index", "quantize")
 
-def parse_args() -> argparse.Namespace:
-    parser = argparse.ArgumentParser(description="Flash Embed pipeline runner")
+
+def _add_common_args(parser: argparse.ArgumentParser) -> None:
     parser.add_argument("--config", type=str, help="Path to YAML config file", default=None)
     parser.add_argument("--data-path", action="append", help="Data path or shard pattern (repeatable)")
-    parser.add_argument("--backend", type=str, help="Model backend (torch|onnx|tensorrt|triton)")
-    parser.add_argument("--model-name", type=str, help="Model name/identifier")
-    parser.add_argument("--device", type=str, help="Device for model (cuda|cpu)")
-    parser.add_argument("--batch-size", type=int, help="Batch size")
-    parser.add_argument("--output-dir", type=str, help="Output directory")
-    parser.add_argument("--triton-url", type=str, help="Triton server URL (host:port)")
-    parser.add_argument("--triton-version", type=str, help="Triton model version")
-    parser.add_argument("--decode-backend", type=str, help="Decode backend (cpu|dali)")
-    return parser.parse_args()
+    parser.add_argument("--orchestrator-db", type=str, help="SQLite shard queue shared by local workers")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # `run` is the default command so existing invocations keep working.
+    if not argv or argv[0] not in COMMANDS + ("-h", "--help"):
+        argv.insert(0, "run")
+
+    parser = argparse.ArgumentParser(description="Flash Embed pipeline runner")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run = subparsers.add_parser("run", help="Run the embedding pipeline (default)")
+    _add_common_args(run)
+    run.add_argument("--backend", type=str, help="Model backend (torch|onnx|tensorrt|triton)")
+    run.add_argument("--model-name", type=str, help="Model name/identifier")
+    run.add_argument("--device", type=str, help="Device for model (cuda|cpu)")
+    run.add_argument("--batch-size", type=int, help="Batch size")
+    run.add_argument("--output-dir", type=str, help="Output directory")
+    run.add_argument("--triton-url", type=str, help="Triton server URL (host:port)")
+    run.add_argument("--triton-version", type=str, help="Triton model version")
+    run.add_argument("--decode-backend", type=str, help="Decode backend (cpu|process|dali)")
+    run.add_argument("--worker-id", type=str, help="Worker id recorded on orchestrator leases")
+    run.add_argument("--metrics-port", type=int, help="Serve Prometheus /metrics on this local port")
+    run.add_argument("--num-procs", type=int, help="Run this many pipeline processes on this node")
+    run.add_argument("--devices", type=str, help="Comma-separated GPU ids dealt to processes, e.g. 0,1,2,3")
+    run.add_argument("--cores-per-proc", type=int, help="CPU cores pinned to each process")
+    run.add_argument("--shard-queue", action="store_true", help="Processes pull shards from a shared queue")
+
+    seed = subparsers.add_parser("seed", help="Seed the orchestrator shard queue from --data-path patterns")
+    _add_common_args(seed)
+
+    retry = subparsers.add_parser("retry", help="Re-embed samples listed in failed.jsonl into <output-dir>/retry")
+    _add_common_args(retry)
+    retry.add_argument("--output-dir", type=str, help="Output directory of the run to retry")
+
+    index = subparsers.add_parser("build-index", help="Build a FAISS index from committed outputs")
+    _add_common_args(index)
+    index.add_argument("--output-dir", type=str, help="Pipeline output directory to index")
+    index.add_argument("--index-dir", type=str, help="Where to write the index (default <output-dir>/index)")
+    index.add_argument("--kind", type=str, help="Embedding kind to index (e.g. image|text)")
+    index.add_argument("--factory", type=str, help="faiss.index_factory string, e.g. IVF4096,PQ64")
+    index.add_argument("--num-parts", type=int, help="Build this many sub-indexes in parallel, then merge")
+    index.add_argument("--train-samples", type=int, help="Vectors reservoir-sampled for training")
+
+    quantize = subparsers.add_parser("quantize", help="Write a dynamically int8-quantized copy of an ONNX model")
+    _add_common_args(quantize)
+    quantize.add_argument("--model-path", type=str, help="ONNX model to quantize (default model.path)")
+    quantize.add_argument("--quantized-path", type=str, required=True, help="Where to write the quantized model")
+    quantize.add_argument("--per-channel", action="store_true", help="Quantize weights per output channel")
+
+    return parser.parse_args(argv)
 
 
 def build_overrides(args: argparse.Namespace) -> Dict[str, Any]:
     overrides: Dict[str, Any] = {}
     if args.data_path:
         overrides.setdefault("io", {})["data_paths"] = args.data_path
-    if args.backend:
+    if args.orchestrator_db:
+        overrides.setdefault("orchestrator", {})["db_path"] = args.orchestrator_db
+    if getattr(args, "worker_id", None):
+        overrides.setdefault("orchestrator", {})["worker_id"] = args.worker_id
+    if getattr(args, "backend", None):
         overrides.setdefault("model", {})["backend"] = args.backend
-    if args.model_name:
+    if getattr(args, "model_name", None):
         overrides.setdefault("model", {})["name"] = args.model_name
-    if args.device:
+    if getattr(args, "device", None):
         overrides.setdefault("model", {})["device"] = args.device
-    if args.batch_size:
+    if getattr(args, "batch_size", None):
         overrides.setdefault("batch", {})["size"] = args.batch_size
-    if args.output_dir:
+    if getattr(args, "output_dir", None):
         overrides.setdefault("output", {})["out_dir"] = args.output_dir
-    if args.triton_url:
+    if getattr(args, "triton_url", None):
         overrides.setdefault("model", {})["triton_url"] = args.triton_url
-    if args.triton_version:
+    if getattr(args, "triton_version", None):
         overrides.setdefault("model", {})["triton_version"] = args.triton_version
-    if args.decode_backend:
+    if getattr(args, "model_path", None):
+        overrides.setdefault("model", {})["path"] = args.model_path
+    if getattr(args, "metrics_port", None) is not None:
+        overrides.setdefault("telemetry", {})["metrics_port"] = args.metrics_port
+    if getattr(args, "num_procs", None):
+        overrides.setdefault("launcher", {})["num_procs"] = args.num_procs
+    if getattr(args, "devices", None):
+        overrides.setdefault("launcher", {})["devices"] = [d.strip() for d in args.devices.split(",") if d.strip()]
+    if getattr(args, "cores_per_proc", None):
+        overrides.setdefault("launcher", {})["cores_per_proc"] = args.cores_per_proc
+    if getattr(args, "shard_queue", False):
+        overrides.setdefault("launcher", {})["queue"] = True
+    if getattr(args, "decode_backend", None):
         overrides.setdefault("io", {})["decode_backend"] = args.decode_backend
+    for name in ("index_dir", "kind", "factory", "num_parts", "train_samples"):
+        if getattr(args, name, None):
+            overrides.setdefault("index", {})[name] = getattr(args, name)
     return overrides
 
 
+def open_orchestrator(cfg: Config) -> ShardOrchestrator:
+    if not cfg.orchestrator.db_path:
+        raise ValueError("--orchestrator-db (orchestrator.db_path) is required")
+    return ShardOrchestrator(
+        cfg.orchestrator.db_path,
+        max_retries=cfg.retry.max_retries,
+        backoff_ms=cfg.retry.backoff_ms,
+        lease_s=cfg.orchestrator.lease_s,
+    )
+
+
+def seed(cfg: Config) -> None:
+    orchestrator = open_orchestrator(cfg)
+    try:
+        added = orchestrator.add_shards(expand_shards(cfg.io.data_paths))
+        get_logger().info(f"Seeded {added} new shard(s); queue state: {orchestrator.counts()}")
+    finally:
+        orchestrator.close()
+
+
+def _worker_id(cfg: Config) -> str:
+    return cfg.orchestrator.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def worker_dir(worker_id: str) -> str:
+    return "worker-" + re.sub(r"[^A-Za-z0-9_.-]", "_", worker_id)
+
+
+def merge_worker_manifests(out_dir: str) -> List[Dict[str, Any]]:
+    """Merge every ``worker-*`` manifest into ``out_dir``'s; workers finishing together take turns."""
+    path = Path(out_dir)
+    path.mkdir(parents=True, exist_ok=True)
+    with open(path / ".merge.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return merge_manifests(out_dir, sorted(p.name for p in path.glob("worker-*") if p.is_dir()))
+
+
+def run_orchestrated(cfg: Config) -> None:
+    """Drain the shard queue into ``<out_dir>/worker-<id>``, then merge into ``out_dir``'s manifest.
+
+    Workers never share output files: memmap stores, ``failed.jsonl`` and
+    ``metrics.json`` each live in the worker's own directory.
+    """
+    from flash_embed.core.pipeline.launcher import require_projection
+
+    # Workers start together, so none may fit (and overwrite) the shared projection itself.
+    require_projection(cfg)
+    worker_id = _worker_id(cfg)
+    # Also picks up what workers that died before merging had committed.
+    committed = {entry["shard"] for entry in merge_worker_manifests(cfg.output.out_dir)}
+    worker_cfg = copy.deepcopy(cfg)
+    worker_cfg.output.out_dir = str(Path(cfg.output.out_dir) / worker_dir(worker_id))
+    # Every worker must project into the same space.
+    worker_cfg.postprocess.projection_path = cfg.postprocess.projection_path or str(
+        Path(cfg.output.out_dir) / "projection.npz"
+    )
+    try:
+        run_worker(worker_cfg, worker_id, committed)
+    finally:
+        entries = merge_worker_manifests(cfg.output.out_dir)
+        get_logger().info(f"Merged {len(entries)} committed shard(s) into {cfg.output.out_dir}")
+
+
+def run_worker(cfg: Config, worker_id: Optional[str] = None, committed: Optional[Set[str]] = None) -> None:
+    """Run one pipeline on shards leased from the queue, writing to ``cfg.output.out_dir``."""
+    worker_id = worker_id or _worker_id(cfg)
+    manifest_path = str(Path(cfg.output.out_dir) / MANIFEST_NAME)
+    orchestrator = open_orchestrator(cfg)
+    try:
+        # One pipeline for the worker's whole life: the model loads once and leased shards stream through it.
+        source = LeasedShardSource(
+            orchestrator, worker_id, manifest_path, heartbeat_s=cfg.orchestrator.heartbeat_s, committed=committed
+        )
+        try:
+            pipeline = AsyncPipeline(cfg, source=source)
+            asyncio.run(pipeline.run())
+        finally:
+            source.close()
+        get_logger().info(
+            f"Worker {worker_id} completed {source.completed} shard(s); queue state: {orchestrator.counts()}"
+        )
+    finally:
+        orchestrator.close()
+
+
+def retry_failed(cfg: Config) -> None:
+    out_dir = Path(cfg.output.out_dir)
+    paths = [out_dir / FAILED_NAME, *sorted(out_dir.glob(f"rank-*/{FAILED_NAME}"))]
+    paths += sorted(out_dir.glob(f"worker-*/{FAILED_NAME}"))
+    failures = load_failures(str(path) for path in paths if path.is_file())
+    if not failures:
+        get_logger().info(f"No failed samples recorded under {out_dir}")
+        return
+    get_logger().info(f"Retrying {sum(map(len, failures.values()))} sample(s) from {len(failures)} shard(s)")
+
+    retry_cfg = copy.deepcopy(cfg)
+    retry_cfg.output.out_dir = str(out_dir / RETRY_DIR)
+    # Retried rows must land in the same space as the original run's.
+    retry_cfg.postprocess.projection_path = cfg.postprocess.projection_path or str(out_dir / "projection.npz")
+    reader_cls = TextShardReader if cfg.io.mode == "text" else ParallelShardReader
+    reader = reader_cls(
+        shards=list(failures),
+        num_readers=cfg.workers.reader_threads,
+        decode=cfg.io.decode,
+        manifest_path=str(Path(retry_cfg.output.out_dir) / MANIFEST_NAME),
+        prefetch_bytes=cfg.io.prefetch_mb << 20,
+        stager=build_stager(cfg),
+        keys=failures,
+        build_index=cfg.io.shard_index,
+        index_dir=cfg.io.shard_index_dir,
+    )
+    pipeline = AsyncPipeline(retry_cfg, reader=reader)
+    asyncio.run(pipeline.run())
+    pipeline.close()
+
+
+def build_index(cfg: Config) -> None:
+    from flash_embed.core.index import IndexBuilder
+
+    builder = IndexBuilder(
+        cfg.output.out_dir,
+        index_dir=cfg.index.index_dir,
+        kind=cfg.index.kind,
+        factory=cfg.index.factory,
+        metric=cfg.index.metric,
+        normalize=cfg.index.normalize,
+        train_samples=cfg.index.train_samples,
+        add_chunk_rows=cfg.index.add_chunk_rows,
+        num_parts=cfg.index.num_parts,
+        threads=cfg.index.threads,
+        on_disk=cfg.index.on_disk,
+        seed=cfg.index.seed,
+    )
+    builder.build()
+
+
+def quantize(cfg: Config, output_path: str, per_channel: bool = False) -> None:
+    from flash_embed.core.models.onnx_runner import quantize_onnx
+
+    if not cfg.model.path:
+        raise ValueError("--model-path (model.path) is required")
+    quantize_onnx(cfg.model.path, output_path, per_channel=per_channel)
+    get_logger().info(f"Wrote quantized model to {output_path}; point model.path at it to use it")
+
+
 def main() -> None:
     args = parse_args()
     overrides = build_overrides(args)
     cfg = load_config(args.config, overrides=overrides)
+    if args.command == "seed":
+        seed(cfg)
+        return
+    if args.command == "retry":
+        retry_failed(cfg)
+        return
+    if args.command == "build-index":
+        build_index(cfg)
+        return
+    if args.command == "quantize":
+        quantize(cfg, args.quantized_path, per_channel=args.per_channel)
+        return
+    if cfg.launcher.num_procs > 1:
+        from flash_embed.core.pipeline.launcher import launch
+
+        launch(cfg)
+        return
+    if cfg.orchestrator.db_path:
+        run_orchestrated(cfg)
+        return
     pipeline = AsyncPipeline(cfg)
     asyncio.run(pipeline.run())
     pipeline.close()
@@ -9,22 +9,53 @@ class ModelConfig:
     path: Optional[str] = None
     device: str = "cuda"
     max_batch: Optional[int] = None
+    triton_url: Optional[str] = None
+    triton_version: Optional[str] = None
+    image_size: int = 224  # resize target for exported models; torch reads its own transform
+    image_mean: Optional[List[float]] = None  # defaults to CLIP statistics
+    image_std: Optional[List[float]] = None
+    intra_op_threads: Optional[int] = None  # onnx: threads inside one op
+    inter_op_threads: Optional[int] = None  # onnx: parallel independent ops
+    cache_dir: Optional[str] = None  # onnx: optimized graphs, torch: compiled artifacts, kept between startups
+    batch_buckets: List[int] = field(default_factory=list)  # pad batches up to one of these sizes
+    transfer_slots: int = 2  # torch: pinned host buffers in the transfer ring (batches overlapped)
+    compile: bool = False  # torch: torch.compile both towers, warmed up over batch_buckets at startup
+    compile_mode: Optional[str] = None  # torch.compile mode, e.g. max-autotune
+    channels_last: bool = False  # torch: NHWC memory format for the image tower
+    precision: str = "fp32"  # torch: fp32 | bf16 (autocast)
+    inference_mode: bool = True  # torch: torch.inference_mode instead of no_grad
+    eager_tolerance: Optional[float] = None  # torch: fail warmup if optimized outputs drift further from eager
 
 
 @dataclass
 class IOConfig:
     data_paths: List[str] = field(default_factory=list)  # webdataset shards or directories
-    decode: str = "pil"
-    decode_backend: str = "cpu"
-    decode_device: str = "gpu"  
+    decode: str = "raw"  # raw (encoded bytes, decoded by decode_backend) | webdataset decoder, e.g. pil
+    decode_backend: str = "cpu"  # cpu | process | dali
+    decode_slot_mb: int = 32  # shared-memory slot size per in-flight image (process backend)
+    decode_timeout_s: float = 60.0  # process backend: fail an image and restart the workers after this long
+    decode_device: str = "gpu"  # dali backend: gpu (nvJPEG) | cpu
+    decode_output: str = "numpy"  # dali backend: numpy | torch (device tensors, no host round trip)
     shuffle: bool = False
     prefetch: int = 2
+    prefetch_mb: int = 64  # bytes of samples buffered ahead by the parallel reader
+    mode: str = "image"  # image | text (caption-only: embeds .txt fields, image bytes are never read)
+    stage_dir: Optional[str] = None  # copy shards to this local scratch dir before reading
+    stage_cache_gb: float = 50.0  # staged shards kept on disk, least recently used evicted first
+    stage_read_ahead: int = 4  # shards downloaded ahead of the readers
+    stage_checksums: Optional[str] = None  # sha256sum-style file to verify staged shards against
+    shard_index: bool = False  # save a sidecar index (key -> offset, length) per local shard for random access
+    shard_index_dir: Optional[str] = None  # where sidecars go (default: <shard>.idx next to unstaged shards)
 
 
 @dataclass
 class BatchConfig:
     size: int = 32
     max_delay_ms: int = 10
+    mode: str = "fixed"  # fixed | adaptive (tunes size within model.batch_buckets from infer latency)
+    target: str = "throughput"  # adaptive: throughput | latency
+    latency_target_ms: float = 100.0  # adaptive latency target per batch
+    length_bucket_width: int = 8  # text mode: batch captions whose token counts fall in the same range
 
 
 @dataclass
@@ -34,9 +65,10 @@ class QueueConfig:
 
 @dataclass
 class WorkerConfig:
-    reader_threads: int = 2
+    reader_threads: int = 2  # shards read concurrently; 1 streams them through a single reader
     decode_workers: int = 2
-    infer_workers: int = 1  # per GPU process
+    infer_workers: int = 1  # concurrent infer loops, each with its own model instance
+    max_inflight: int = 1  # outstanding encode_async requests per infer loop (torch: at least model.transfer_slots)
 
 
 @dataclass
@@ -45,10 +77,84 @@ class RetryConfig:
     backoff_ms: int = 100
 
 
+@dataclass
+class OrchestratorConfig:
+    db_path: Optional[str] = None  # SQLite shard queue; unset runs data_paths directly
+    worker_id: Optional[str] = None
+    lease_s: float = 600.0
+    heartbeat_s: float = 30.0
+
+
 @dataclass
 class OutputConfig:
     out_dir: str = "outputs"
-    format: str = "npy"  # parquet | arrow | npz | zarr
+    format: str = "npy"  # npy | npz | parquet | arrow | memmap
+    store_text: bool = False  # write captions next to uids
+    store_meta: bool = False  # write sample meta as JSON next to uids
+    dtype: str = "float32"  # float32 | float16 storage
+    row_group_size: int = 8192  # rows per parquet row group / arrow record batch
+    store_rows: int = 1 << 20  # rows per memmap store file
+    store_chunk_rows: int = 1 << 16  # memmap store files grow by this many rows
+
+
+@dataclass
+class IndexConfig:
+    index_dir: Optional[str] = None  # defaults to <out_dir>/index
+    kind: str = "image"
+    factory: str = "IVF4096,PQ64"  # faiss.index_factory string
+    metric: str = "ip"  # ip | l2
+    normalize: bool = True
+    train_samples: int = 262144
+    add_chunk_rows: int = 65536
+    num_parts: int = 1  # >1 builds sub-indexes in parallel processes, then merges
+    threads: Optional[int] = None
+    on_disk: bool = False
+    seed: int = 0
+
+
+@dataclass
+class LauncherConfig:
+    num_procs: int = 1  # >1 runs one pipeline per process, outputs under <out_dir>/rank-NNN
+    devices: List[str] = field(default_factory=list)  # CUDA_VISIBLE_DEVICES per rank, round-robin
+    pin_cores: bool = True  # give each rank a disjoint set of CPU cores
+    cores_per_proc: Optional[int] = None  # defaults to available cores / num_procs
+    queue: bool = False  # pull shards from a shared SQLite queue instead of a fixed round-robin split
+
+
+@dataclass
+class CacheConfig:
+    path: Optional[str] = None  # SQLite file of embeddings keyed by content hash; disabled when unset
+    model_version: str = ""  # bump to invalidate entries when weights/preprocessing change under the same name
+    caption_items: int = 65536  # text mode: in-memory LRU of caption embeddings; 0 disables
+
+
+@dataclass
+class DedupConfig:
+    threshold: Optional[float] = None  # cosine similarity at or above which a sample is a near-duplicate; off when unset
+    kind: str = "image"  # embedding kind compared
+    action: str = "drop"  # drop | flag (keep the row, only list it in the duplicates map)
+    window: int = 65536  # recent kept vectors compared against (numpy backend)
+    backend: str = "numpy"  # numpy (blocked cosine over the window) | faiss (exact index over the whole run)
+
+
+@dataclass
+class PostprocessConfig:
+    normalize: bool = False  # L2-normalize (again after any reduction)
+    reduce: Optional[str] = None  # pca (fit on the first fit_samples rows) | random (seeded Gaussian projection)
+    dim: Optional[int] = None  # output dimensions when reducing
+    quantize: Optional[str] = None  # float16 | int8 (per-row scale stored as <kind>_scale)
+    projection_path: Optional[str] = None  # defaults to <out_dir>/projection.npz; reused when present
+    fit_samples: int = 16384
+    seed: int = 0
+
+
+@dataclass
+class TelemetryConfig:
+    metrics_port: Optional[int] = None  # serve /metrics (Prometheus) and /metrics.json when set
+    metrics_host: str = "127.0.0.1"
+    sample_interval_s: float = 1.0  # queue-depth and throughput sampling period
+    write_summary: bool = True
+    summary_path: Optional[str] = None  # defaults to <out_dir>/metrics.json
 
 
 @dataclass
@@ -59,7 +165,14 @@ class Config:
     queues: QueueConfig = field(default_factory=QueueConfig)
     workers: WorkerConfig = field(default_factory=WorkerConfig)
     retry: RetryConfig = field(default_factory=RetryConfig)
+    orchestrator: OrchestratorConfig = field(default_factory=OrchestratorConfig)
     output: OutputConfig = field(default_factory=OutputConfig)
+    index: IndexConfig = field(default_factory=IndexConfig)
+    telemetry: TelemetryConfig = field(default_factory=TelemetryConfig)
+    launcher: LauncherConfig = field(default_factory=LauncherConfig)
+    cache: CacheConfig = field(default_factory=CacheConfig)
+    dedup: DedupConfig = field(default_factory=DedupConfig)
+    postprocess: PostprocessConfig = field(default_factory=PostprocessConfig)
 
 
 def _update_dataclass(obj: Any, updates: Dict[str, Any]) -> None:
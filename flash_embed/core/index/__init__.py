@@ -0,0 +1,3 @@
+from flash_embed.core.index.builder import IndexBuilder, reservoir_sample
+
+__all__ = ["IndexBuilder", "reservoir_sample"]
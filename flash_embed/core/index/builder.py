@@ -0,0 +1,255 @@
+import json
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from flash_embed.core.telemetry.logging import get_logger
+from flash_embed.core.writer.manifest import load_outputs
+from flash_embed.core.writer.writer import iter_outputs
+
+
+def _faiss():
+    try:
+        import faiss
+    except Exception as exc:
+        raise RuntimeError("faiss is required for index building") from exc
+    return faiss
+
+
+def _is_ivf(index: Any) -> bool:
+    try:
+        _faiss().extract_index_ivf(index)
+    except RuntimeError:
+        return False
+    return True
+
+
+def reservoir_sample(chunks: Iterable[np.ndarray], k: int, seed: int = 0) -> np.ndarray:
+    """Uniformly sample ``k`` rows from a stream of row chunks (Algorithm R, vectorized per chunk)."""
+    rng = np.random.default_rng(seed)
+    reservoir: Optional[np.ndarray] = None
+    seen = 0
+    for chunk in chunks:
+        if reservoir is None:
+            reservoir = np.empty((k, *chunk.shape[1:]), dtype=np.float32)
+        fill = min(max(k - seen, 0), len(chunk))
+        if fill:
+            reservoir[seen : seen + fill] = chunk[:fill]
+        rest = chunk[fill:]
+        if len(rest):
+            positions = seen + fill + np.arange(len(rest))
+            slots = rng.integers(0, positions + 1)
+            keep = slots < k
+            reservoir[slots[keep]] = rest[keep]
+        seen += len(chunk)
+    if reservoir is None:
+        raise ValueError("No embeddings to sample from")
+    return reservoir[: min(k, seen)]
+
+
+def _iter_chunks(
+    output_dir: str,
+    kind: str,
+    entries: List[Dict[str, Any]],
+    id_starts: List[int],
+    chunk_rows: int,
+    normalize: bool,
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Yield ``(ids, uids, vectors)`` chunks of at most ``chunk_rows`` rows."""
+    for (entry, columns), id_start in zip(iter_outputs(output_dir, kind, entries), id_starts):
+        embeddings = columns["embedding"]
+        uids = columns.get("uid", np.asarray([""] * len(embeddings)))
+        for offset in range(0, len(embeddings), chunk_rows):
+            vectors = np.ascontiguousarray(embeddings[offset : offset + chunk_rows], dtype=np.float32)
+            vectors = vectors.reshape(len(vectors), -1)
+            if normalize:
+                _faiss().normalize_L2(vectors)
+            ids = np.arange(id_start + offset, id_start + offset + len(vectors), dtype=np.int64)
+            yield ids, uids[offset : offset + chunk_rows], vectors
+
+
+def _build_part(
+    output_dir: str,
+    kind: str,
+    trained_path: str,
+    entries: List[Dict[str, Any]],
+    id_starts: List[int],
+    part_path: str,
+    uid_path: str,
+    chunk_rows: int,
+    normalize: bool,
+    threads: int,
+) -> int:
+    """Add one group of shards to a copy of the trained index; runs in a worker process."""
+    faiss = _faiss()
+    faiss.omp_set_num_threads(threads)
+    index = faiss.read_index(trained_path)
+    with open(uid_path, "w") as uid_file:
+        for ids, uids, vectors in _iter_chunks(output_dir, kind, entries, id_starts, chunk_rows, normalize):
+            index.add_with_ids(vectors, ids)
+            uid_file.writelines(f"{i}\t{u}\n" for i, u in zip(ids.tolist(), uids.tolist()))
+    faiss.write_index(index, part_path)
+    return int(index.ntotal)
+
+
+class IndexBuilder:
+    """Trains and fills a FAISS index from writer outputs in bounded memory.
+
+    Training vectors are reservoir-sampled from the manifest in one streaming
+    pass; vectors are then added in ``add_chunk_rows`` chunks. With
+    ``num_parts > 1`` the shards are split across worker processes that each
+    fill a copy of the trained index, and the parts are merged at the end
+    (on disk when ``on_disk`` is set). Ids are global row numbers in manifest
+    order, retried samples last; ``uids.tsv`` maps them back to sample uids. Factories without an
+    IVF stage (``Flat``, ``HNSW32``, ``PQ64``...) are wrapped in an
+    ``IndexIDMap2`` to carry those ids and are always filled in one process,
+    since only IVF parts can be merged.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        index_dir: Optional[str] = None,
+        kind: str = "image",
+        factory: str = "IVF4096,PQ64",
+        metric: str = "ip",
+        normalize: bool = True,
+        train_samples: int = 262144,
+        add_chunk_rows: int = 65536,
+        num_parts: int = 1,
+        threads: Optional[int] = None,
+        on_disk: bool = False,
+        seed: int = 0,
+    ):
+        if metric not in {"ip", "l2"}:
+            raise ValueError(f"Unsupported index metric: {metric}")
+        self.output_dir = output_dir
+        self.index_dir = Path(index_dir or Path(output_dir) / "index")
+        self.kind = kind
+        self.factory = factory
+        self.metric = metric
+        self.normalize = normalize
+        self.train_samples = train_samples
+        self.add_chunk_rows = add_chunk_rows
+        self.num_parts = max(1, num_parts)
+        self.threads = threads or os.cpu_count() or 1
+        self.on_disk = on_disk
+        self.seed = seed
+        self.logger = get_logger()
+
+    def build(self) -> Path:
+        faiss = _faiss()
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        entries = [e for e in load_outputs(self.output_dir) if self.kind in e.get("files", {})]
+        if not entries:
+            raise ValueError(f"No committed '{self.kind}' outputs in {self.output_dir}")
+        id_starts = np.concatenate([[0], np.cumsum([e["count"] for e in entries])[:-1]]).astype(int).tolist()
+
+        faiss.omp_set_num_threads(self.threads)
+        trained_path = self.index_dir / "trained.faiss"
+        trained = self.train(entries)
+        ivf = _is_ivf(trained)
+        if self.on_disk and not ivf:
+            raise ValueError(f"on_disk needs an IVF index; {self.factory!r} has no IVF stage")
+        if not ivf and self.num_parts > 1:
+            self.logger.info(f"{self.factory} has no IVF stage to merge parts into; adding vectors in one process")
+        faiss.write_index(trained, str(trained_path))
+
+        index_path = self.index_dir / "index.faiss"
+        uid_path = self.index_dir / "uids.tsv"
+        if self.num_parts == 1 or not ivf:
+            ntotal = _build_part(
+                self.output_dir, self.kind, str(trained_path), entries, id_starts,
+                str(index_path), str(uid_path), self.add_chunk_rows, self.normalize, self.threads,
+            )
+        else:
+            ntotal = self._build_parallel(str(trained_path), entries, id_starts, index_path, uid_path)
+
+        (self.index_dir / "index.json").write_text(
+            json.dumps(
+                {
+                    "kind": self.kind,
+                    "factory": self.factory,
+                    "metric": self.metric,
+                    "normalize": self.normalize,
+                    "ntotal": ntotal,
+                    "on_disk": self.on_disk,
+                }
+            )
+        )
+        self.logger.info(f"Built {self.factory} index with {ntotal} vectors at {index_path}")
+        return index_path
+
+    def train(self, entries: List[Dict[str, Any]]):
+        faiss = _faiss()
+        chunks = (
+            vectors
+            for _, _, vectors in _iter_chunks(
+                self.output_dir, self.kind, entries, [0] * len(entries), self.add_chunk_rows, self.normalize
+            )
+        )
+        sample = np.ascontiguousarray(reservoir_sample(chunks, self.train_samples, seed=self.seed))
+        metric = faiss.METRIC_INNER_PRODUCT if self.metric == "ip" else faiss.METRIC_L2
+        index = faiss.index_factory(sample.shape[1], self.factory, metric)
+        self.logger.info(f"Training {self.factory} on {len(sample)} sampled vectors")
+        index.train(sample)
+        if not _is_ivf(index) and not isinstance(
+            faiss.downcast_index(index), (faiss.IndexIDMap, faiss.IndexIDMap2)
+        ):
+            # Only IVF indexes store ids themselves.
+            index = faiss.IndexIDMap2(index)
+        return index
+
+    def _build_parallel(
+        self,
+        trained_path: str,
+        entries: List[Dict[str, Any]],
+        id_starts: List[int],
+        index_path: Path,
+        uid_path: Path,
+    ) -> int:
+        faiss = _faiss()
+        parts_dir = self.index_dir / "parts"
+        parts_dir.mkdir(exist_ok=True)
+        threads = max(1, self.threads // self.num_parts)
+        part_paths = [str(parts_dir / f"part-{k:03d}.faiss") for k in range(self.num_parts)]
+        part_uids = [str(parts_dir / f"part-{k:03d}.uids.tsv") for k in range(self.num_parts)]
+        # Spawn rather than fork: the parent has already run OpenMP regions during training.
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.num_parts, mp_context=context) as pool:
+            futures = [
+                pool.submit(
+                    _build_part, self.output_dir, self.kind, trained_path,
+                    entries[k :: self.num_parts], id_starts[k :: self.num_parts],
+                    part_paths[k], part_uids[k], self.add_chunk_rows, self.normalize, threads,
+                )
+                for k in range(self.num_parts)
+            ]
+            for future in futures:
+                future.result()
+
+        index = faiss.read_index(trained_path)
+        if self.on_disk:
+            from faiss.contrib.ondisk import merge_ondisk
+
+            merge_ondisk(index, part_paths, str(self.index_dir / "index.ivfdata"))
+        else:
+            ivf = faiss.extract_index_ivf(index)
+            for path in part_paths:
+                # Keep the part alive while its IVF view is merged; SWIG does not.
+                part = faiss.read_index(path)
+                ivf.merge_from(faiss.extract_index_ivf(part), 0)
+            index.ntotal = ivf.ntotal
+        faiss.write_index(index, str(index_path))
+
+        with open(uid_path, "wb") as out:
+            for path in part_uids:
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, out)
+        shutil.rmtree(parts_dir)
+        return int(index.ntotal)
@@ -1,5 +1,34 @@
-from flash_embed.core.io.reader import Sample, Reader, WebDatasetReader, PrefetchReader
+from flash_embed.core.io.reader import (
+    Sample,
+    ShardDone,
+    Reader,
+    ShardSource,
+    WebDatasetReader,
+    ParallelShardReader,
+    TextShardReader,
+    PrefetchReader,
+    expand_shards,
+)
+from flash_embed.core.io.downloader import Fetcher, LocalFetcher, ShardStager, register_fetcher
 from flash_embed.core.io.decoder import Decoder
 from flash_embed.core.io.dali_decoder import DaliDecoder
+from flash_embed.core.io.process_decoder import ProcessDecoder
 
-__all__ = ["Sample", "Reader", "WebDatasetReader", "PrefetchReader", "Decoder", "DaliDecoder"]
+__all__ = [
+    "Sample",
+    "ShardDone",
+    "Reader",
+    "ShardSource",
+    "WebDatasetReader",
+    "ParallelShardReader",
+    "TextShardReader",
+    "PrefetchReader",
+    "expand_shards",
+    "Fetcher",
+    "LocalFetcher",
+    "ShardStager",
+    "register_fetcher",
+    "Decoder",
+    "DaliDecoder",
+    "ProcessDecoder",
+]
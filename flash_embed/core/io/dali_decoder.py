@@ -1,4 +1,4 @@
-from typing import Any
+from typing import Any, List, Optional
 
 import numpy as np
 
@@ -6,48 +6,101 @@ from flash_embed.core.io.reader import Sample
 
 
 class DaliDecoder:
-    """Minimal DALI-based decoder (bytes -> RGB uint8)."""
+    """DALI decoder that decodes (and optionally resizes) a whole batch per pipeline run.
 
-    def __init__(self, device_id: int = 0, decode_device: str = "mixed", batch_size: int = 1):
+    ``decode_device`` is ``"gpu"``/``"mixed"`` for nvJPEG decoding or ``"cpu"``
+    for a CPU-only pipeline that needs no GPU. With ``resize`` set, images are
+    resized on their shorter side and, with ``crop``, center cropped, so the
+    batch comes back as one uniform ``(B, H, W, 3)`` uint8 tensor. ``output``
+    selects how decoded images are handed off: ``"numpy"`` copies to host
+    arrays, ``"torch"`` copies into torch tensors on the pipeline's device
+    without going through NumPy.
+    """
+
+    def __init__(
+        self,
+        device_id: Optional[int] = 0,
+        decode_device: str = "mixed",
+        batch_size: int = 32,
+        num_threads: int = 2,
+        resize: Optional[int] = None,
+        crop: Optional[int] = None,
+        output: str = "numpy",
+    ):
         try:
+            from nvidia.dali import fn, types
             from nvidia.dali.pipeline import Pipeline
-            import nvidia.dali.fn as fn
-            import nvidia.dali.types as types
         except Exception as exc:
             raise RuntimeError("nvidia-dali is required for DaliDecoder") from exc
 
-        self.fn = fn
-        self.types = types
-
-        class _Pipe(Pipeline):
-            def __init__(self, batch_size: int, num_threads: int, device_id: int, decode_device: str):
-                super().__init__(batch_size=batch_size, num_threads=num_threads, device_id=device_id, seed=12)
-                self.decode_device = decode_device
-                self._input = fn.external_source(name="images", device="cpu")
-                output = fn.decoders.image(
-                    self._input,
-                    device=self.decode_device,
-                    output_type=types.RGB,
-                )
-                self.output = output
-                self._data = None
-                self.build()
-
-            def iter_setup(self):
-                if self._data is None:
-                    raise RuntimeError("No data fed to DALI pipeline")
-                self.feed_input("images", self._data)
-
-            def feed(self, data: Any):
-                self._data = data
-
-        self._pipe = _Pipe(batch_size=batch_size, num_threads=2, device_id=device_id, decode_device=decode_device)
+        if output not in {"numpy", "torch"}:
+            raise ValueError(f"Unsupported DALI output: {output}")
+        if output == "torch":
+            try:
+                import torch
+                from nvidia.dali.plugin.pytorch import feed_ndarray
+            except Exception as exc:
+                raise RuntimeError("torch is required for DaliDecoder(output='torch')") from exc
+            self._torch = torch
+            self._feed_ndarray = feed_ndarray
+
+        self.cpu_only = decode_device == "cpu" or device_id is None or device_id < 0
+        self.output = output
+        self.batch_size = batch_size
+        self.uniform = bool(resize and crop)
+
+        self._pipe = Pipeline(
+            batch_size=batch_size,
+            num_threads=num_threads,
+            device_id=None if self.cpu_only else device_id,
+            seed=12,
+            prefetch_queue_depth=1,
+        )
+        with self._pipe:
+            encoded = fn.external_source(name="images", device="cpu")
+            images = fn.decoders.image(encoded, device="cpu" if self.cpu_only else "mixed", output_type=types.RGB)
+            if resize:
+                images = fn.resize(images, resize_shorter=resize, interp_type=types.INTERP_CUBIC, antialias=True)
+            if resize and crop:
+                images = fn.crop(images, crop=(crop, crop), out_of_bounds_policy="pad")
+            self._pipe.set_outputs(images)
+        self._pipe.build()
 
     def decode(self, sample: Sample) -> Sample:
-        if not isinstance(sample.image, (bytes, bytearray)):
-            return sample
-        self._pipe.feed([sample.image])
-        outputs = self._pipe.run()
-        decoded = outputs[0][0]
-        decoded_cpu = decoded.as_cpu().as_array()
-        return Sample(uid=sample.uid, image=decoded_cpu, text=sample.text, meta=sample.meta)
+        return self.decode_batch([sample])[0]
+
+    def decode_batch(self, samples: List[Sample]) -> List[Sample]:
+        """Decode every encoded image in ``samples`` in as few pipeline runs as possible."""
+        pending = [i for i, s in enumerate(samples) if isinstance(s.image, (bytes, bytearray, memoryview))]
+        decoded = list(samples)
+        for start in range(0, len(pending), self.batch_size):
+            chunk = pending[start : start + self.batch_size]
+            self._pipe.feed_input("images", [np.frombuffer(samples[i].image, dtype=np.uint8) for i in chunk])
+            (images,) = self._pipe.run()
+            for i, image in zip(chunk, self._unpack(images)):
+                s = samples[i]
+                decoded[i] = Sample(uid=s.uid, image=image, text=s.text, meta=s.meta)
+        return decoded
+
+    def _unpack(self, images: Any) -> List[Any]:
+        # DALI reuses its output buffers on the next run, so everything handed out is a copy.
+        if self.output == "torch":
+            torch = self._torch
+            device = torch.device("cpu") if self.cpu_only else torch.device("cuda", self._pipe.device_id)
+            if self.uniform:
+                dense = images.as_tensor()
+                out = torch.empty(dense.shape(), dtype=torch.uint8, device=device)
+                self._feed_ndarray(dense, out)
+                return list(out)
+            out = []
+            for i in range(len(images)):
+                tensor = images[i]
+                dst = torch.empty(tensor.shape(), dtype=torch.uint8, device=device)
+                self._feed_ndarray(tensor, dst)
+                out.append(dst)
+            return out
+        if not self.cpu_only:
+            images = images.as_cpu()
+        if self.uniform:
+            return list(np.array(images.as_array()))
+        return [np.array(images.at(i)) for i in range(len(images))]
@@ -1,4 +1,5 @@
-from typing import Any
+import io
+from typing import Optional
 
 from PIL import Image
 
@@ -6,10 +7,18 @@ from .reader import Sample
 
 
 class Decoder:
-    """Minimal decoder; replace with CPU/GPU codecs."""
+    """PIL decoder. With ``draft_size`` JPEGs are decoded at a reduced scale
+    (still at least ``draft_size`` on each side), which is much cheaper for
+    images far larger than the model input."""
+
+    def __init__(self, draft_size: Optional[int] = None):
+        self.draft_size = draft_size
 
     def decode(self, sample: Sample) -> Sample:
-        if isinstance(sample.image, (bytes, bytearray)):
-            img = Image.open(sample.image).convert("RGB")
+        if isinstance(sample.image, (bytes, bytearray, memoryview)):
+            img = Image.open(io.BytesIO(sample.image))
+            if self.draft_size:
+                img.draft("RGB", (self.draft_size, self.draft_size))
+            img = img.convert("RGB")
             return Sample(uid=sample.uid, image=img, text=sample.text, meta=sample.meta)
         return sample
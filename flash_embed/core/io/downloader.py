@@ -1,7 +1,274 @@
-from typing import Iterable
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Protocol, Set
+from urllib.parse import unquote, urlparse
+
+from flash_embed.core.telemetry.logging import get_logger
+
+
+class Fetcher(Protocol):
+    """Copies one remote object to a local path. Object-store adapters implement this too."""
+
+    def size(self, url: str) -> Optional[int]:
+        ...
+
+    def fetch(self, url: str, dest: Path) -> None:
+        ...
+
+
+class LocalFetcher:
+    """Fetcher for plain filesystem paths and ``file://`` urls (e.g. a network mount)."""
+
+    @staticmethod
+    def _path(url: str) -> str:
+        parsed = urlparse(url)
+        return unquote(parsed.path) if parsed.scheme == "file" else url
+
+    def size(self, url: str) -> Optional[int]:
+        return os.path.getsize(self._path(url))
+
+    def fetch(self, url: str, dest: Path) -> None:
+        shutil.copyfile(self._path(url), dest)
+
+
+FETCHERS: Dict[str, Fetcher] = {"": LocalFetcher(), "file": LocalFetcher()}
+
+
+def register_fetcher(scheme: str, fetcher: Fetcher) -> None:
+    """Route urls with ``scheme`` (e.g. ``s3``) through ``fetcher``."""
+    FETCHERS[scheme] = fetcher
+
+
+def fetcher_for(url: str) -> Fetcher:
+    scheme = urlparse(url).scheme
+    # Single letters are Windows drive letters, not schemes.
+    fetcher = FETCHERS.get("" if len(scheme) <= 1 else scheme)
+    if fetcher is None:
+        raise ValueError(f"No fetcher registered for {scheme}:// urls")
+    return fetcher
+
+
+def sha256_file(path: Path, chunk_bytes: int = 8 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+
+def load_checksums(path: str) -> Dict[str, str]:
+    """Read a ``sha256sum``-style file (``<hex>  <name or url>`` per line)."""
+    checksums = {}
+    with open(path) as f:
+        for line in f:
+            parts = line.strip().split(maxsplit=1)
+            if len(parts) == 2:
+                checksums[parts[1].lstrip("*")] = parts[0].lower()
+    return checksums
+
+
+class ShardCache:
+    """LRU cache of staged shard files under ``cache_dir`` with a byte budget.
+
+    Pinned entries (being downloaded or read) are never evicted; the budget
+    can therefore be exceeded temporarily when everything is pinned.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._pins: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        for tmp in self.cache_dir.glob("*.part"):
+            tmp.unlink()
+        # Rebuild the LRU order from the previous run's access times.
+        for path in sorted(self.cache_dir.iterdir(), key=lambda p: p.stat().st_atime):
+            if path.is_file():
+                self._entries[path.name] = path.stat().st_size
+
+    @property
+    def used_bytes(self) -> int:
+        with self._lock:
+            return sum(self._entries.values())
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def lookup(self, key: str) -> Optional[Path]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self.cache_dir / key
+
+    def pin(self, key: str) -> None:
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+
+    def unpin(self, key: str) -> None:
+        with self._lock:
+            count = self._pins.get(key, 0) - 1
+            if count > 0:
+                self._pins[key] = count
+            else:
+                self._pins.pop(key, None)
+            self._evict(0)
+
+    def reserve(self, nbytes: int) -> None:
+        """Evict unpinned entries until ``nbytes`` more would fit."""
+        with self._lock:
+            self._evict(nbytes)
+
+    def add(self, key: str, nbytes: int) -> None:
+        with self._lock:
+            self._entries[key] = nbytes
+            self._entries.move_to_end(key)
+            self._evict(0)
+
+    def _evict(self, incoming: int) -> None:
+        used = sum(self._entries.values())
+        for key in list(self._entries):
+            if used + incoming <= self.max_bytes:
+                return
+            if key in self._pins:
+                continue
+            used -= self._entries.pop(key)
+            (self.cache_dir / key).unlink(missing_ok=True)
+
+
+class ShardStager:
+    """Stages remote shards onto local scratch space ahead of the readers.
+
+    ``get(url)`` returns the local path of a shard, downloading it if needed,
+    and queues read-ahead of the next ``read_ahead`` shards of the ``plan``.
+    Shards stay pinned in the cache until ``release(url)``. Downloads land in
+    a ``.part`` file, are checked against ``checksums`` (url or file name ->
+    sha256 hex) when given, and are retried with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int = 50 << 30,
+        read_ahead: int = 4,
+        max_retries: int = 3,
+        backoff_ms: int = 100,
+        checksums: Optional[Dict[str, str]] = None,
+    ):
+        self.cache = ShardCache(cache_dir, max_bytes)
+        self.read_ahead = max(0, read_ahead)
+        self.max_retries = max_retries
+        self.backoff_ms = backoff_ms
+        self.checksums = checksums or {}
+        self.logger = get_logger()
+        self._order: List[str] = []
+        self._position: Dict[str, int] = {}
+        self._futures: Dict[str, Future] = {}
+        self._unclaimed: Set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, self.read_ahead), thread_name_prefix="stager")
+
+    @staticmethod
+    def cache_key(url: str) -> str:
+        name = Path(urlparse(url).path).name or "shard"
+        return f"{hashlib.sha1(url.encode()).hexdigest()[:12]}-{name}"
+
+    def plan(self, urls: Iterable[str]) -> None:
+        """Set the order shards will be read in, which read-ahead follows."""
+        self._order = list(urls)
+        self._position = {url: i for i, url in enumerate(self._order)}
+
+    def get(self, url: str) -> str:
+        """Local path of ``url``; blocks until it is staged. Pins it until ``release``."""
+        future = self._schedule(url, pin=True)
+        position = self._position.get(url)
+        if position is not None:
+            for nxt in self._order[position + 1 : position + 1 + self.read_ahead]:
+                self._schedule(nxt, pin=False)
+        return future.result()
+
+    def release(self, url: str) -> None:
+        key = self.cache_key(url)
+        with self._lock:
+            self._futures.pop(url, None)
+        self.cache.unpin(key)
+
+    def _schedule(self, url: str, pin: bool) -> Future:
+        key = self.cache_key(url)
+        with self._lock:
+            future = self._futures.get(url)
+            if future is None:
+                # Every staged shard holds one pin from scheduling until release(), so
+                # read-ahead copies are not evicted before a reader gets to them.
+                self.cache.pin(key)
+                future = self._futures[url] = self._executor.submit(self._stage, url, key)
+                if not pin:
+                    self._unclaimed.add(url)
+            elif pin:
+                if url in self._unclaimed:
+                    self._unclaimed.discard(url)
+                else:
+                    self.cache.pin(key)
+        return future
+
+    def _stage(self, url: str, key: str) -> str:
+        cached = self.cache.lookup(key)
+        if cached is not None:
+            return str(cached)
+        return self._download(url, key)
+
+    def _download(self, url: str, key: str) -> str:
+        fetcher = fetcher_for(url)
+        dest = self.cache.path(key)
+        tmp = dest.with_name(dest.name + ".part")
+        expected = self.checksums.get(url) or self.checksums.get(Path(urlparse(url).path).name)
+        attempt = 0
+        while True:
+            try:
+                size = fetcher.size(url)
+                if size:
+                    self.cache.reserve(size)
+                started = time.monotonic()
+                fetcher.fetch(url, tmp)
+                if expected and sha256_file(tmp) != expected.lower():
+                    raise ValueError(f"checksum mismatch for {url}")
+                os.replace(tmp, dest)
+                nbytes = dest.stat().st_size
+                self.cache.add(key, nbytes)
+                self.logger.debug(f"Staged {url} ({nbytes} bytes in {time.monotonic() - started:.2f}s)")
+                return str(dest)
+            except Exception as exc:
+                tmp.unlink(missing_ok=True)
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise RuntimeError(f"Failed to stage {url} after {attempt} attempt(s): {exc}") from exc
+                delay = self.backoff_ms * (2 ** (attempt - 1)) / 1000.0
+                self.logger.warning(f"Staging {url} failed ({exc}); retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
 
 class Downloader:
-    """Placeholder downloader; extend with remote fetch + retries."""
+    """Fetches shard urls into a local directory through the registered fetchers."""
+
+    def __init__(self, dest_dir: str, max_retries: int = 3, backoff_ms: int = 100):
+        self.stager = ShardStager(dest_dir, max_bytes=1 << 62, read_ahead=0, max_retries=max_retries, backoff_ms=backoff_ms)
 
-    def fetch(self, urls: Iterable[str]) -> None:
-        raise NotImplementedError("Implement remote fetch logic")
+    def fetch(self, urls: Iterable[str]) -> List[str]:
+        paths = []
+        for url in urls:
+            paths.append(self.stager.get(url))
+            self.stager.release(url)
+        return paths
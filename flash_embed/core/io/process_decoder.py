@@ -0,0 +1,221 @@
+import io
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from flash_embed.core.io.reader import Sample
+from flash_embed.core.telemetry.logging import get_logger
+
+_POLL_S = 1.0  # how often a waiting decode checks that the workers are still alive
+
+
+def _decode_rgb(data: Any, draft_size: Optional[int] = None) -> np.ndarray:
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        if draft_size:
+            img.draft("RGB", (draft_size, draft_size))
+        return np.asarray(img.convert("RGB"))
+
+
+def _decode_worker(shm_name: str, slot_bytes: int, draft_size: Optional[int], tasks: Any, results: Any) -> None:
+    """Worker loop: encoded bytes and decoded pixels both travel through the task's slot."""
+    # Spawned children share the parent's resource tracker, so attaching here
+    # does not hand ownership of the segment to this process.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            slot, size = task
+            base = slot * slot_bytes
+            try:
+                pixels = _decode_rgb(bytes(shm.buf[base : base + size]), draft_size)
+                if pixels.nbytes > slot_bytes:
+                    results.put((slot, None, "decoded image exceeds slot size"))
+                    continue
+                out = np.ndarray(pixels.shape, dtype=np.uint8, buffer=shm.buf, offset=base)
+                out[...] = pixels
+                del out
+                results.put((slot, pixels.shape, None))
+            except Exception as exc:
+                results.put((slot, None, f"{type(exc).__name__}: {exc}"))
+    finally:
+        shm.close()
+
+
+class ProcessDecoder:
+    """CPU decoder that runs PIL in worker processes to sidestep the GIL.
+
+    A shared-memory ring of fixed-size slots carries the encoded bytes to a
+    worker and the decoded uint8 pixels back, so neither direction is pickled.
+    ``decode`` blocks the calling thread until its slot is filled; images that
+    do not fit in a slot are decoded in-process instead. ``draft_size``
+    enables JPEG draft-mode decoding as in ``Decoder``.
+
+    If a worker dies, or an image takes longer than ``timeout_s``, the pool
+    is torn down and restarted; the images in flight at that moment fail.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 2,
+        slots: Optional[int] = None,
+        slot_bytes: int = 32 << 20,
+        as_pil: bool = True,
+        draft_size: Optional[int] = None,
+        timeout_s: float = 60.0,
+    ):
+        self.num_workers = max(1, num_workers)
+        self.num_slots = slots or 2 * self.num_workers
+        self.slot_bytes = slot_bytes
+        self.as_pil = as_pil
+        self.draft_size = draft_size
+        self.timeout_s = timeout_s
+        self.logger = get_logger()
+
+        self._ctx = multiprocessing.get_context("spawn")
+        self._shm = shared_memory.SharedMemory(create=True, size=self.num_slots * slot_bytes)
+        self._free: "queue.Queue[int]" = queue.Queue()
+        for slot in range(self.num_slots):
+            self._free.put(slot)
+        self._lock = threading.Lock()
+        self._restart_lock = threading.Lock()
+        self._generation = 0
+        self._closed = False
+        self._start_pool()
+
+    def _start_pool(self) -> None:
+        # Each generation gets fresh queues: a worker killed mid-put can leave a queue unusable.
+        self._tasks = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._waiters: Dict[int, Future] = {}
+        self._procs = [
+            self._ctx.Process(
+                target=_decode_worker,
+                args=(self._shm.name, self.slot_bytes, self.draft_size, self._tasks, self._results),
+                daemon=True,
+            )
+            for _ in range(self.num_workers)
+        ]
+        for proc in self._procs:
+            proc.start()
+        self._collector = threading.Thread(target=self._collect, args=(self._results, self._waiters), daemon=True)
+        self._collector.start()
+
+    def decode(self, sample: Sample) -> Sample:
+        if not isinstance(sample.image, (bytes, bytearray, memoryview)):
+            return sample
+        data = memoryview(sample.image).cast("B")
+        if data.nbytes > self.slot_bytes:
+            pixels = _decode_rgb(data, self.draft_size)
+        else:
+            pixels = self._decode_in_worker(data)
+        return Sample(uid=sample.uid, image=self._wrap(pixels), text=sample.text, meta=sample.meta)
+
+    def _decode_in_worker(self, data: memoryview) -> np.ndarray:
+        slot = self._free.get()
+        try:
+            base = slot * self.slot_bytes
+            self._shm.buf[base : base + data.nbytes] = data
+            future: Future = Future()
+            with self._lock:
+                self._waiters[slot] = future
+                generation, tasks, procs = self._generation, self._tasks, self._procs
+            tasks.put((slot, data.nbytes))
+            shape, error = self._wait(future, generation, procs)
+            if error == "decoded image exceeds slot size":
+                return _decode_rgb(data, self.draft_size)
+            if error:
+                raise RuntimeError(error)
+            view = np.ndarray(shape, dtype=np.uint8, buffer=self._shm.buf, offset=base)
+            pixels = view.copy()
+            del view
+            return pixels
+        finally:
+            self._free.put(slot)
+
+    def _wait(self, future: Future, generation: int, procs: List[Any]) -> Tuple[Any, Optional[str]]:
+        deadline = time.monotonic() + self.timeout_s
+        while True:
+            try:
+                return future.result(timeout=max(0.0, min(_POLL_S, deadline - time.monotonic())))
+            except FutureTimeout:
+                pass
+            if self._closed:
+                return None, "process decoder closed"
+            dead = next((proc for proc in procs if not proc.is_alive()), None)
+            if dead is not None:
+                self._restart(generation, f"decode worker {dead.pid} died (exit code {dead.exitcode})")
+            elif time.monotonic() >= deadline:
+                self._restart(generation, f"decode timed out after {self.timeout_s:g}s")
+
+    def _restart(self, generation: int, reason: str) -> None:
+        """Kill the workers of ``generation`` and start new ones; its images in flight fail with ``reason``."""
+        with self._restart_lock:
+            if generation != self._generation or self._closed:
+                return  # another thread already restarted this pool
+            self.logger.warning(f"Restarting the process decoder pool: {reason}")
+            for proc in self._procs:
+                proc.kill()
+            for proc in self._procs:
+                proc.join(timeout=5)
+            # Only now are the slots safe to reuse: no worker of this generation can write them any more.
+            with self._lock:
+                stale = dict(self._waiters)
+                self._waiters.clear()
+                old_queues = (self._tasks, self._results)
+                self._generation += 1
+                self._start_pool()
+            # A killed worker may still hold a queue's lock: never block on (or at exit flush) the old queues.
+            for old in old_queues:
+                old.cancel_join_thread()
+                old.close()
+            for future in stale.values():
+                future.set_result((None, f"image lost when the decoder pool was restarted: {reason}"))
+
+    def _wrap(self, pixels: np.ndarray) -> Any:
+        if not self.as_pil:
+            return pixels
+        from PIL import Image
+
+        return Image.fromarray(pixels)
+
+    def _collect(self, results: Any, waiters: Dict[int, Future]) -> None:
+        while True:
+            try:
+                item = results.get(timeout=_POLL_S)
+            except (queue.Empty, OSError, ValueError):
+                if waiters is not self._waiters or self._closed:
+                    return  # this generation's pool was replaced (or closed)
+                continue
+            if item is None:
+                return
+            slot, shape, error = item
+            with self._lock:
+                future = waiters.pop(slot, None)
+            if future is not None:
+                future.set_result((shape, error))
+
+    def close(self) -> None:
+        with self._restart_lock:
+            if self._closed:
+                return
+            self._closed = True
+        for _ in self._procs:
+            self._tasks.put(None)
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        self._results.put(None)
+        self._collector.join(timeout=5)
+        self._shm.close()
+        self._shm.unlink()
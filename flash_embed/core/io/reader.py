@@ -3,11 +3,16 @@ import random
 import threading
 import queue
 from dataclasses import dataclass
-from typing import Any, Dict, Iterable, Iterator, List, Optional, Protocol
+from pathlib import Path
+from typing import Any, Callable, Collection, Dict, Iterable, Iterator, List, Optional, Protocol, Union
 
 import webdataset as wds
 from braceexpand import braceexpand
 
+from flash_embed.core.io import tar
+from flash_embed.core.io.downloader import ShardStager
+from flash_embed.core.telemetry.logging import get_logger
+
 
 @dataclass
 class Sample:
@@ -15,46 +20,365 @@ class Sample:
     image: Any
     text: Optional[str]
     meta: Dict[str, Any]
+    tokens: Any = None  # token ids of ``text``, set by the tokenize stage in text mode
+
+
+@dataclass
+class ShardDone:
+    """Marker yielded by readers once every sample of ``shard`` has been emitted.
+
+    ``error`` is set when the shard could not be read to the end; its samples
+    must then not be committed.
+    """
+
+    shard: str
+    error: Optional[str] = None
 
 
 class Reader(Protocol):
-    def __iter__(self) -> Iterator[Sample]:
+    def __iter__(self) -> Iterator[Union[Sample, ShardDone]]:
         ...
 
     def close(self) -> None:
         ...
 
 
+class ShardSource(Protocol):
+    """Hands shards out one at a time as readers ask for them, e.g. from a lease queue."""
+
+    def next_shard(self) -> Optional[str]:
+        """The next shard to read; blocks until one is available, None once there are no more."""
+        ...
+
+    def shard_read(self, shard: str, error: Optional[str] = None) -> None:
+        """Called after ``shard`` was read to the end, or with ``error`` if reading it failed."""
+        ...
+
+
+def expand_shards(patterns: Iterable[str]) -> List[str]:
+    """Expand brace patterns (e.g. ``data-{0000..0099}.tar``) into shard paths."""
+    return [s for pattern in patterns for s in braceexpand(pattern)]
+
+
+RAW = "raw"  # decode mode: images stay encoded until the pipeline's decode stage
+IMAGE_EXTENSIONS = ("jpg", "jpeg", "png", "webp")
+
+
+def _as_text(txt: Any) -> Optional[str]:
+    """Captions as ``str``: undecoded (raw) webdataset samples and mapped members carry bytes."""
+    if isinstance(txt, (bytes, bytearray, memoryview)):
+        return bytes(txt).decode("utf-8")
+    return txt
+
+
+def iter_raw_samples(
+    path: str,
+    shard: str,
+    keys: Optional[Collection[str]] = None,
+    index_path: Optional[str] = None,
+) -> Iterator[Sample]:
+    """Samples of a local tar whose images are zero-copy memoryviews into the mapped shard.
+
+    ``keys`` restricts reading to those samples; ``index_path`` loads or
+    persists the shard's sidecar index so later keyed reads need no scan.
+    """
+    index = tar.ShardIndex.open(path, index_path) if index_path else None
+    for member in tar.iter_samples(path, index=index, keys=keys):
+        image = next((member[ext] for ext in IMAGE_EXTENSIONS if ext in member), None)
+        if image is None:
+            continue
+        yield Sample(uid=member["__key__"], image=image, text=_as_text(member.get("txt")), meta={"shard": shard})
+
+
 class WebDatasetReader:
-    """Streaming reader for WebDataset shards."""
+    """Streaming reader for WebDataset shards.
 
-    def __init__(self, shards: Iterable[str], decode: str = "pil", shuffle: bool = False):
+    Samples carry their shard url in ``meta["shard"]``. When ``manifest_path``
+    is given, shards already committed there are skipped so reruns resume.
+    With ``decode="raw"`` local shards are memory-mapped and images are
+    passed on as views into the file, to be decoded by the pipeline.
+    """
+
+    def __init__(
+        self,
+        shards: Iterable[str],
+        decode: str = "pil",
+        shuffle: bool = False,
+        manifest_path: Optional[str] = None,
+    ):
         self.shards = list(shards)
         self.decode = decode
         self.shuffle = shuffle
+        self.manifest_path = manifest_path
         self._pipeline = None
 
-    def __iter__(self) -> Iterator[Sample]:
+    def __iter__(self) -> Iterator[Union[Sample, ShardDone]]:
         if not self.shards:
-            return iter([])
-        shards = [s for pattern in list(self.shards) for s in braceexpand(pattern)]
+            return
+        shards = expand_shards(self.shards)
+        if self.manifest_path:
+            from flash_embed.core.writer.manifest import completed_shards
+
+            done = completed_shards(self.manifest_path)
+            if done:
+                get_logger().info(f"Skipping {sum(s in done for s in shards)} shard(s) already in the manifest")
+            shards = [s for s in shards if s not in done]
+        if not shards:
+            return
         if self.shuffle:
             random.shuffle(shards)
+        if self.decode == RAW and not self.shuffle and all(os.path.isfile(s) for s in shards):
+            yield from self._iter_raw(shards)
+            return
 
         dataset = wds.WebDataset(shards, handler=wds.handlers.warn_and_continue)
         # keep image bytes for decoding later (e.g with DALI)
-        if self.decode:
+        if self.decode and self.decode != RAW:
             dataset = dataset.decode(self.decode)
         if self.shuffle:
             dataset = dataset.shuffle(1000)
-        dataset = dataset.to_tuple("jpg", "txt", "__key__")
-        for img, txt, key in dataset:
-            yield Sample(uid=key, image=img, text=txt, meta={})
+        dataset = dataset.to_tuple("jpg", "txt", "__key__", "__url__")
+        # Without shuffling, shards are streamed one after another, so a new url
+        # means the previous shard is finished; otherwise wait for the end.
+        open_shards: Dict[str, None] = {}
+        for img, txt, key, url in dataset:
+            if not self.shuffle and open_shards and url not in open_shards:
+                for shard in open_shards:
+                    yield ShardDone(shard=shard)
+                open_shards.clear()
+            open_shards[url] = None
+            yield Sample(uid=key, image=img, text=_as_text(txt), meta={"shard": url})
+        for shard in open_shards:
+            yield ShardDone(shard=shard)
+
+    def _iter_raw(self, shards: List[str]) -> Iterator[Union[Sample, ShardDone]]:
+        for shard in shards:
+            try:
+                yield from iter_raw_samples(shard, shard)
+            except Exception as exc:
+                get_logger().error(f"Reading shard {shard} failed: {exc}")
+                yield ShardDone(shard=shard, error=str(exc))
+                continue
+            yield ShardDone(shard=shard)
 
     def close(self) -> None:
         return
 
 
+def sample_nbytes(sample: Sample) -> int:
+    """Approximate in-memory size of a sample's payload, for byte-based prefetch budgets."""
+    image = sample.image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return len(image)
+    if hasattr(image, "nbytes"):
+        return int(image.nbytes)
+    if hasattr(image, "size") and hasattr(image, "mode"):  # PIL image
+        return image.size[0] * image.size[1] * len(image.getbands())
+    return len(sample.text or "")
+
+
+class _ByteBudget:
+    """Blocks producers while more than ``capacity`` bytes are buffered (one item always fits)."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.used = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def acquire(self, nbytes: int) -> bool:
+        with self._cond:
+            while not self._closed and self.used and self.used + nbytes > self.capacity:
+                self._cond.wait()
+            self.used += nbytes
+            return not self._closed
+
+    def release(self, nbytes: int) -> None:
+        with self._cond:
+            self.used -= nbytes
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class ParallelShardReader:
+    """Reads ``num_readers`` shards at once on a thread pool and interleaves their samples.
+
+    Each thread owns one shard at a time, so tar parsing and file reads for
+    different shards overlap; samples are tagged with their shard in
+    ``meta["shard"]`` and a ``ShardDone`` follows each shard's last sample.
+    Buffered samples are bounded by ``prefetch_bytes`` rather than a count,
+    so large images cannot blow up memory and small ones keep the queue deep.
+    With a ``stager``, each shard is read from its local staged copy while
+    samples and markers keep the original url. With ``decode="raw"`` local
+    shards are memory-mapped instead of parsed through webdataset.
+
+    ``keys`` (shard -> sample keys) restricts reading to those samples, for
+    retrying individual failures; local shards are then read by seeking to
+    the members through a ``tar.ShardIndex``. With ``build_index`` that index
+    is saved as a sidecar in ``index_dir`` (default: next to unstaged shards).
+
+    With a ``source``, threads take shards from it as they go instead of
+    from ``shards``, and report each one back once it is read.
+    """
+
+    def __init__(
+        self,
+        shards: Iterable[str],
+        num_readers: int = 4,
+        decode: Optional[str] = None,
+        shuffle: bool = False,
+        manifest_path: Optional[str] = None,
+        prefetch_bytes: int = 64 << 20,
+        stager: Optional[ShardStager] = None,
+        keys: Optional[Dict[str, Collection[str]]] = None,
+        build_index: bool = False,
+        index_dir: Optional[str] = None,
+        source: Optional[ShardSource] = None,
+    ):
+        self.shards = list(shards)
+        self.source = source
+        self.num_readers = max(1, num_readers)
+        self.decode = decode
+        self.shuffle = shuffle
+        self.manifest_path = manifest_path
+        self.stager = stager
+        self.keys = keys
+        self.build_index = build_index
+        self.index_dir = index_dir
+        self._budget = _ByteBudget(prefetch_bytes)
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+
+    def _pending_shards(self) -> List[str]:
+        # Reuse WebDatasetReader's expansion and manifest-based resume.
+        shards = expand_shards(self.shards)
+        if self.manifest_path:
+            from flash_embed.core.writer.manifest import completed_shards
+
+            done = completed_shards(self.manifest_path)
+            if done:
+                get_logger().info(f"Skipping {sum(s in done for s in shards)} shard(s) already in the manifest")
+            shards = [s for s in shards if s not in done]
+        if self.shuffle:
+            random.shuffle(shards)
+        return shards
+
+    def _read_shards(self, next_shard: Callable[[], Optional[str]]) -> None:
+        try:
+            while True:
+                shard = next_shard()
+                if shard is None:
+                    return
+                error = None
+                try:
+                    path = self.stager.get(shard) if self.stager else shard
+                    for sample in self._iter_shard(path, shard):
+                        nbytes = sample_nbytes(sample)
+                        if not self._budget.acquire(nbytes):
+                            return
+                        self._queue.put((sample, nbytes))
+                except Exception as exc:
+                    get_logger().error(f"Reading shard {shard} failed: {exc}")
+                    error = str(exc)
+                finally:
+                    if self.stager:
+                        self.stager.release(shard)
+                if self.source:
+                    self.source.shard_read(shard, error)
+                self._queue.put((ShardDone(shard=shard, error=error), 0))
+        finally:
+            self._queue.put(None)
+
+    def _index_path(self, path: str, shard: str) -> Optional[str]:
+        if not self.build_index:
+            return None
+        if self.index_dir:
+            return str(Path(self.index_dir) / (ShardStager.cache_key(shard) + tar.INDEX_SUFFIX))
+        # Staged copies come and go, so only sidecars of shards read in place are kept by default.
+        return path + tar.INDEX_SUFFIX if path == shard else None
+
+    def _iter_shard(self, path: str, shard: str) -> Iterator[Sample]:
+        keys = self.keys.get(shard) if self.keys is not None else None
+        if self.decode == RAW and os.path.isfile(path):
+            yield from iter_raw_samples(path, shard, keys=keys, index_path=self._index_path(path, shard))
+            return
+        dataset = wds.WebDataset([path], shardshuffle=False)
+        if self.decode and self.decode != RAW:
+            dataset = dataset.decode(self.decode)
+        for img, txt, key in dataset.to_tuple("jpg", "txt", "__key__"):
+            if keys is None or key in keys:
+                yield Sample(uid=key, image=img, text=_as_text(txt), meta={"shard": shard})
+
+    def __iter__(self) -> Iterator[Union[Sample, ShardDone]]:
+        if self.source is not None:
+            next_shard = self.source.next_shard
+            workers = self.num_readers
+        else:
+            shards = self._pending_shards()
+            if not shards:
+                return
+            if self.stager:
+                self.stager.plan(shards)
+            todo: "queue.Queue[str]" = queue.Queue()
+            for shard in shards:
+                todo.put(shard)
+
+            def next_shard() -> Optional[str]:
+                try:
+                    return todo.get_nowait()
+                except queue.Empty:
+                    return None
+
+            workers = min(self.num_readers, len(shards))
+        self._threads = [
+            threading.Thread(target=self._read_shards, args=(next_shard,), daemon=True) for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        finished = 0
+        while finished < workers:
+            item = self._queue.get()
+            if item is None:
+                finished += 1
+                continue
+            value, nbytes = item
+            if nbytes:
+                self._budget.release(nbytes)
+            yield value
+
+    def close(self) -> None:
+        self._budget.close()
+        if self.stager:
+            self.stager.close()
+
+
+class TextShardReader(ParallelShardReader):
+    """Caption-only reader: only ``.txt`` members are extracted, image bytes are skipped in the tar."""
+
+    def _iter_shard(self, path: str, shard: str) -> Iterator[Sample]:
+        keys = self.keys.get(shard) if self.keys is not None else None
+        if os.path.isfile(path):
+            # Mapped, so the image members' pages are never even read.
+            index_path = self._index_path(path, shard)
+            index = tar.ShardIndex.open(path, index_path) if index_path else None
+            for member in tar.iter_samples(path, index=index, keys=keys):
+                if "txt" in member:
+                    yield Sample(uid=member["__key__"], image=None, text=_as_text(member["txt"]), meta={"shard": shard})
+            return
+        dataset = wds.WebDataset([path], shardshuffle=False, select_files=_is_caption)
+        for txt, key in dataset.to_tuple("txt", "__key__"):
+            if keys is None or key in keys:
+                yield Sample(uid=key, image=None, text=_as_text(txt), meta={"shard": shard})
+
+
+def _is_caption(name: str) -> bool:
+    return name.endswith(".txt")
+
+
 def iter_images_from_directory(directory_path: str) -> Iterator[Sample]:
     """Fallback reader for plain directories; yields Sample objects."""
     from PIL import Image
@@ -78,7 +402,7 @@ class PrefetchReader:
     def __init__(self, reader: Reader, max_prefetch: int = 2):
         self.reader = reader
         self.max_prefetch = max_prefetch
-        self._queue: queue.Queue[Optional[Sample]] = queue.Queue(maxsize=max_prefetch)
+        self._queue: queue.Queue[Optional[Union[Sample, ShardDone]]] = queue.Queue(maxsize=max_prefetch)
         self._thread = threading.Thread(target=self._run, daemon=True)
         self._started = False
 
@@ -89,7 +413,7 @@ class PrefetchReader:
         finally:
             self._queue.put(None)
 
-    def __iter__(self) -> Iterator[Sample]:
+    def __iter__(self) -> Iterator[Union[Sample, ShardDone]]:
         if not self._started:
             self._thread.start()
             self._started = True
@@ -0,0 +1,195 @@
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from flash_embed.core.telemetry.logging import get_logger
+
+_BLOCK = 512
+INDEX_SUFFIX = ".idx"
+
+
+def _octal(field: bytes) -> int:
+    field = field.rstrip(b"\0 ").strip()
+    if not field:
+        return 0
+    if field[0] & 0x80:
+        # GNU base-256 encoding for large sizes.
+        return int.from_bytes(field[1:], "big")
+    return int(field, 8)
+
+
+def _pax_path(data: memoryview) -> str:
+    for record in bytes(data).split(b"\n"):
+        _, _, entry = record.partition(b" ")
+        key, _, value = entry.partition(b"=")
+        if key == b"path":
+            return value.decode("utf-8")
+    return ""
+
+
+def split_key(name: str) -> Tuple[str, str]:
+    """WebDataset convention: ``dir/abc.seg.jpg`` -> (``dir/abc``, ``seg.jpg``)."""
+    slash = name.rfind("/") + 1
+    dot = name.find(".", slash)
+    if dot < 0:
+        return name, ""
+    return name[:dot], name[dot + 1 :]
+
+
+def open_shard(path: str) -> memoryview:
+    """Read-only view of a whole shard file, memory-mapped."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b"")
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _checksum_ok(header: bytes) -> bool:
+    # The checksum field itself counts as eight spaces; some old tars summed signed bytes.
+    stored = _octal(header[148:156])
+    unsigned = sum(header[:148]) + 8 * 32 + sum(header[156:])
+    signed = unsigned - 256 * sum(b >= 128 for b in header[:148] + header[156:])
+    return stored in (unsigned, signed)
+
+
+def iter_members(buf: memoryview) -> Iterator[Tuple[str, int, int]]:
+    """Yield ``(name, offset, size)`` of each regular file in a tar held in ``buf``.
+
+    Raises ValueError on a corrupt header or a truncated archive, so a reader
+    reports the shard as failed instead of passing on a short member.
+    """
+    pos, end = 0, len(buf)
+    long_name = ""
+    while True:
+        if pos + _BLOCK > end:
+            # Writers always end with zero blocks, so a shard cut on a block boundary is caught too.
+            raise ValueError(f"truncated tar: no end-of-archive marker before offset {end}")
+        header = buf[pos : pos + _BLOCK].tobytes()
+        if header[0] == 0 and not any(header):
+            return  # end-of-archive marker
+        if not _checksum_ok(header):
+            raise ValueError(f"bad tar header checksum at offset {pos}")
+        size = _octal(header[124:136])
+        kind = header[156:157]
+        data = pos + _BLOCK
+        if data + size > end:
+            raise ValueError(f"truncated tar member at offset {data}: {size} bytes, {end - data} left")
+        pos = data + (size + _BLOCK - 1) // _BLOCK * _BLOCK
+        if kind in (b"L", b"x"):
+            long_name = (
+                bytes(buf[data : data + size]).rstrip(b"\0").decode("utf-8")
+                if kind == b"L"
+                else _pax_path(buf[data : data + size])
+            )
+            continue
+        if kind not in (b"0", b"\0", b"7"):
+            long_name = ""
+            continue
+        name = long_name
+        if not name:
+            name = header[0:100].split(b"\0", 1)[0].decode("utf-8")
+            prefix = header[345:500].split(b"\0", 1)[0]
+            if header[257:262] == b"ustar" and prefix:
+                name = prefix.decode("utf-8") + "/" + name
+        long_name = ""
+        yield name, data, size
+
+
+class ShardIndex:
+    """Byte ranges of a shard's members by sample key: ``{key: {ext: (offset, size)}}``.
+
+    Saved as a JSON sidecar together with the shard's size and mtime, so an
+    index for a shard that has since changed is rebuilt rather than trusted.
+    """
+
+    def __init__(self, members: Dict[str, Dict[str, Tuple[int, int]]], size: int, mtime_ns: int):
+        self.members = members
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    @classmethod
+    def build(cls, path: str) -> "ShardIndex":
+        stat = os.stat(path)
+        members: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        for name, offset, size in iter_members(open_shard(path)):
+            key, ext = split_key(name)
+            members.setdefault(key, {})[ext] = (offset, size)
+        return cls(members, stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load(cls, index_path: str) -> Optional["ShardIndex"]:
+        try:
+            with open(index_path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        members = {key: {ext: tuple(span) for ext, span in exts.items()} for key, exts in data["members"].items()}
+        return cls(members, data["size"], data["mtime_ns"])
+
+    @classmethod
+    def open(cls, path: str, index_path: Optional[str] = None) -> "ShardIndex":
+        """Load ``index_path`` if it matches ``path``; otherwise scan the shard (and save when a path is given)."""
+        if index_path:
+            index = cls.load(index_path)
+            if index is not None and index.matches(path):
+                return index
+        index = cls.build(path)
+        if index_path:
+            try:
+                index.save(index_path)
+            except OSError as exc:
+                get_logger().warning(f"Could not save shard index {index_path}: {exc}")
+        return index
+
+    def matches(self, path: str) -> bool:
+        stat = os.stat(path)
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+    def save(self, index_path: str) -> None:
+        path = Path(index_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"size": self.size, "mtime_ns": self.mtime_ns, "members": self.members}, f)
+        os.replace(tmp_path, path)
+
+
+def iter_samples(
+    path: str, index: Optional[ShardIndex] = None, keys: Optional[Iterable[str]] = None
+) -> Iterator[Dict[str, Any]]:
+    """Group a shard's members by key: ``{"__key__": key, "jpg": memoryview, ...}``.
+
+    Values are zero-copy views into the memory-mapped file, which stays mapped
+    for as long as any of them is referenced. With an ``index`` headers are
+    not parsed again; with ``keys`` only those samples are read, each by
+    seeking straight to its members (unknown keys are skipped).
+    """
+    buf = open_shard(path)
+    if keys is not None and index is None:
+        index = ShardIndex.build(path)
+    if index is not None:
+        for key in index.members if keys is None else keys:
+            members = index.members.get(key)
+            if members is None:
+                continue
+            found: Dict[str, Any] = {"__key__": key}
+            for ext, (offset, size) in members.items():
+                found[ext] = buf[offset : offset + size]
+            yield found
+        return
+    sample: Dict[str, Any] = {}
+    for name, offset, size in iter_members(buf):
+        key, ext = split_key(name)
+        if sample and sample["__key__"] != key:
+            yield sample
+            sample = {}
+        if not sample:
+            sample["__key__"] = key
+        sample[ext] = buf[offset : offset + size]
+    if sample:
+        yield sample
@@ -1,8 +1,19 @@
 from flash_embed.core.models.registry import resolve
 from flash_embed.core.models.model_runner import ModelRunner
 from flash_embed.core.models.torch_runner import TorchRunner
-from flash_embed.core.models.onnx_runner import OnnxRunner
+from flash_embed.core.models.onnx_runner import OnnxRunner, quantize_onnx
 from flash_embed.core.models.tensorrt_runner import TensorRTRunner
 from flash_embed.core.models.triton_runner import TritonRunner
+from flash_embed.core.models.preprocess import ImagePreprocessor, PreprocessSpec
 
-__all__ = ["resolve", "ModelRunner", "TorchRunner", "OnnxRunner", "TensorRTRunner", "TritonRunner"]
+__all__ = [
+    "resolve",
+    "ModelRunner",
+    "TorchRunner",
+    "OnnxRunner",
+    "TensorRTRunner",
+    "TritonRunner",
+    "ImagePreprocessor",
+    "PreprocessSpec",
+    "quantize_onnx",
+]
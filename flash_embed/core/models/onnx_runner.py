@@ -1,12 +1,44 @@
-from typing import Any, Dict, Sequence
+import hashlib
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
 
 import numpy as np
 
 from flash_embed.core.models.model_runner import ModelRunner
+from flash_embed.core.models.preprocess import ImagePreprocessor, preprocess_spec
+
+_NP_TYPES = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(double)": np.float64,
+    "tensor(int64)": np.int64,
+    "tensor(int32)": np.int32,
+}
+
+
+def quantize_onnx(model_path: str, output_path: str, per_channel: bool = False) -> str:
+    """Write a dynamically int8-quantized copy of ``model_path`` (weights int8, activations at runtime)."""
+    try:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+    except Exception as exc:
+        raise RuntimeError("onnxruntime is required for quantize_onnx") from exc
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    quantize_dynamic(model_path, output_path, weight_type=QuantType.QInt8, per_channel=per_channel)
+    return output_path
 
 
 class OnnxRunner(ModelRunner):
-    """ONNXRuntime runner with optional CUDA EP and IO binding."""
+    """ONNXRuntime runner with optional CUDA EP and IO binding.
+
+    The session runs with full graph optimization and configurable intra/inter
+    op thread pools. With ``cache_dir`` the optimized graph is saved on first
+    load and reused by later startups. Inputs are preprocessed into one reused
+    buffer, padded up to the nearest of ``batch_buckets`` so the session only
+    ever sees a few shapes, and bound with IO binding alongside preallocated
+    output buffers per bucket.
+    """
 
     def __init__(
         self,
@@ -14,6 +46,13 @@ class OnnxRunner(ModelRunner):
         device: str = "cuda",
         model_path: str | None = None,
         max_batch: int | None = None,
+        image_size: int | None = None,
+        image_mean: Sequence[float] | None = None,
+        image_std: Sequence[float] | None = None,
+        intra_op_threads: int | None = None,
+        inter_op_threads: int | None = None,
+        cache_dir: str | None = None,
+        batch_buckets: Sequence[int] | None = None,
         **_: Any,
     ):
         try:
@@ -23,40 +62,118 @@ class OnnxRunner(ModelRunner):
 
         if not model_path:
             raise ValueError("model_path is required for OnnxRunner")
-        
+
         self.ort = ort
         providers = ["CUDAExecutionProvider", "CPUExecutionProvider"] if device != "cpu" else ["CPUExecutionProvider"]
-        self.session = ort.InferenceSession(model_path, providers=providers)
+        self.session = self._create_session(model_path, providers, intra_op_threads, inter_op_threads, cache_dir)
         self.device = device
-        self._max_batch = max_batch or 64
+        self.buckets: List[int] = sorted(set(int(b) for b in batch_buckets or []))
+        self._max_batch = max_batch or (self.buckets[-1] if self.buckets else 64)
         self.input_names = [inp.name for inp in self.session.get_inputs()]
         self.output_names = [out.name for out in self.session.get_outputs()]
-        self._preprocess = None  
+        spec = preprocess_spec(self.session.get_inputs()[0].shape, image_size, image_mean, image_std)
+        self._preprocess = ImagePreprocessor(spec, max_batch=max([self._max_batch, *self.buckets]))
+        self._binding = self.session.io_binding() if device == "cpu" else None
+        self._outputs: Dict[int, Dict[str, np.ndarray]] = {}
+
+    def _create_session(
+        self,
+        model_path: str,
+        providers: List[str],
+        intra_op_threads: int | None,
+        inter_op_threads: int | None,
+        cache_dir: str | None,
+    ) -> Any:
+        ort = self.ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        if not cache_dir:
+            return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+
+        # Key the cache on the model bytes and providers; optimized graphs can contain EP-specific nodes.
+        stat = os.stat(model_path)
+        key = hashlib.sha1(f"{os.path.abspath(model_path)}:{stat.st_size}:{stat.st_mtime_ns}:{providers}".encode())
+        cached = Path(cache_dir) / f"{Path(model_path).stem}.{key.hexdigest()[:16]}.opt.onnx"
+        if cached.exists():
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            return ort.InferenceSession(str(cached), sess_options=options, providers=providers)
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cached.with_name(cached.name + f".{os.getpid()}.tmp")
+        options.optimized_model_filepath = str(tmp)
+        session = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+        if tmp.exists():
+            os.replace(tmp, cached)
+        return session
 
     def warmup(self) -> None:
-        dummy = np.zeros((1, 3, 224, 224), dtype=np.float32)
-        feeds = {self.input_names[0]: dummy}
-        _ = self.session.run(self.output_names, feeds)
+        size = self._preprocess.spec.crop
+        # Run every bucket once so each shape is planned before real traffic arrives.
+        for bucket in self.buckets or [1]:
+            self._run(np.zeros((bucket, 3, size, size), dtype=np.float32), bucket)
 
     def max_batch_size(self) -> int:
         return self._max_batch
 
+    def _bucket(self, n: int) -> int:
+        for bucket in self.buckets:
+            if bucket >= n:
+                return bucket
+        return n
+
+    def _output_buffers(self, rows: int) -> Dict[str, np.ndarray] | None:
+        if rows in self._outputs:
+            return self._outputs[rows]
+        buffers = {}
+        for out in self.session.get_outputs():
+            dims = list(out.shape)
+            dtype = _NP_TYPES.get(out.type)
+            if dtype is None or not dims or any(not isinstance(d, int) for d in dims[1:]):
+                return None
+            buffers[out.name] = np.empty((rows, *dims[1:]), dtype=dtype)
+        self._outputs[rows] = buffers
+        return buffers
+
+    def _run(self, inputs: np.ndarray, rows: int) -> Dict[str, np.ndarray]:
+        buffers = self._output_buffers(rows) if self._binding is not None else None
+        if buffers is None:
+            outputs = self.session.run(self.output_names, {self.input_names[0]: inputs})
+            return {name: out for name, out in zip(self.output_names, outputs)}
+
+        binding = self._binding
+        binding.clear_binding_inputs()
+        binding.clear_binding_outputs()
+        binding.bind_cpu_input(self.input_names[0], inputs)
+        for name, buf in buffers.items():
+            binding.bind_output(name, "cpu", 0, buf.dtype.type, buf.shape, buf.ctypes.data)
+        self.session.run_with_iobinding(binding)
+        return buffers
+
     def encode(
         self,
         images: Sequence[Any] | None = None,
         texts: Sequence[str] | None = None,
     ) -> Dict[str, np.ndarray]:
-        feeds: Dict[str, Any] = {}
-        if images is not None:
-            if self._preprocess:
-                imgs = self._preprocess(images)
-            else:
-                imgs = np.stack(images)
-            feeds[self.input_names[0]] = imgs
-       
-        outputs = self.session.run(self.output_names, feeds)
-        
-        return {name: out for name, out in zip(self.output_names, outputs)}
+        if images is None:
+            raise ValueError("OnnxRunner expects images input")
+        n = len(images)
+        rows = self._bucket(n)
+        if isinstance(images, np.ndarray) and images.ndim == 4:
+            imgs = images  # already a preprocessed NCHW batch
+            if rows != n:
+                imgs = np.concatenate([imgs, np.zeros((rows - n, *imgs.shape[1:]), dtype=imgs.dtype)])
+        else:
+            self._preprocess(images)
+            # Rows past n hold stale data from earlier batches; their outputs are dropped.
+            imgs = self._preprocess.buffer[:rows]
+
+        outputs = self._run(imgs, rows)
+        # Output buffers are reused by the next batch, so hand back copies of the real rows.
+        return {name: out[:n].copy() for name, out in outputs.items()}
 
     def close(self) -> None:
         return
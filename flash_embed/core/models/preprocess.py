@@ -0,0 +1,136 @@
+import io
+from dataclasses import dataclass
+from typing import Any, Optional, Sequence, Tuple
+
+import numpy as np
+
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+@dataclass
+class PreprocessSpec:
+    """Resize-shortest-side, center-crop and normalize parameters for a model."""
+
+    size: int = 224
+    crop: int = 224
+    mean: Tuple[float, ...] = CLIP_MEAN
+    std: Tuple[float, ...] = CLIP_STD
+    interpolation: str = "bicubic"
+
+    @classmethod
+    def from_transform(cls, transform: Any) -> Optional["PreprocessSpec"]:
+        """Read the spec off a torchvision ``Compose`` (Resize, CenterCrop, ..., Normalize).
+
+        Returns None when the pipeline contains steps we cannot reproduce, in
+        which case callers should keep using the transform itself.
+        """
+        steps = getattr(transform, "transforms", None)
+        if not steps:
+            return None
+        spec = cls()
+        for step in steps:
+            name = type(step).__name__
+            if name == "Resize":
+                size = step.size
+                if isinstance(size, (list, tuple)):
+                    if len(size) != 1:
+                        return None
+                    size = size[0]
+                spec.size = int(size)
+                spec.interpolation = str(getattr(step.interpolation, "value", step.interpolation)).lower()
+            elif name == "CenterCrop":
+                crop = step.size
+                spec.crop = int(crop[0] if isinstance(crop, (list, tuple)) else crop)
+            elif name == "Normalize":
+                spec.mean = tuple(float(m) for m in step.mean)
+                spec.std = tuple(float(s) for s in step.std)
+            elif name in {"ToTensor", "function"}:
+                # plain functions are the RGB-conversion helpers clip/open_clip insert
+                continue
+            else:
+                return None
+        return spec
+
+
+def preprocess_spec(
+    input_shape: Sequence[Any],
+    image_size: Optional[int] = None,
+    mean: Optional[Sequence[float]] = None,
+    std: Optional[Sequence[float]] = None,
+) -> PreprocessSpec:
+    """Spec for an exported model: crop from a static NCHW input shape, the rest from config."""
+    crop = input_shape[-1] if len(input_shape) == 4 and isinstance(input_shape[-1], int) else None
+    crop = crop or image_size or 224
+    return PreprocessSpec(
+        size=max(image_size or crop, crop),
+        crop=crop,
+        mean=tuple(mean) if mean else CLIP_MEAN,
+        std=tuple(std) if std else CLIP_STD,
+    )
+
+
+_RESAMPLE = {"nearest": 0, "bilinear": 2, "bicubic": 3, "lanczos": 1, "box": 4, "hamming": 5}
+
+
+class ImagePreprocessor:
+    """CPU preprocessing that fills a reused ``(B, 3, crop, crop)`` float32 buffer.
+
+    Encoded JPEGs are decoded with PIL's draft mode (DCT-domain downscaling)
+    when the image is much larger than the target, the resize and center crop
+    are done in a single ``Image.resize(box=...)`` call, and normalization is
+    written straight into the batch buffer, so a batch costs no per-sample
+    tensor allocations. Pass ``buffer`` to fill caller-owned (e.g. pinned)
+    memory. The returned array is a view that is overwritten by the next call.
+    """
+
+    def __init__(
+        self,
+        spec: Optional[PreprocessSpec] = None,
+        max_batch: int = 64,
+        buffer: Optional[np.ndarray] = None,
+    ):
+        self.spec = spec or PreprocessSpec()
+        shape = (max_batch, 3, self.spec.crop, self.spec.crop)
+        if buffer is not None and tuple(buffer.shape[1:]) != shape[1:]:
+            raise ValueError(f"Preprocess buffer must have shape (B, {', '.join(map(str, shape[1:]))})")
+        self.buffer = buffer if buffer is not None else np.empty(shape, dtype=np.float32)
+        std = np.asarray(self.spec.std, dtype=np.float32)
+        mean = np.asarray(self.spec.mean, dtype=np.float32)
+        self._scale = (1.0 / (255.0 * std)).reshape(3, 1, 1)
+        self._bias = (-mean / std).reshape(3, 1, 1)
+        self._resample = _RESAMPLE.get(self.spec.interpolation, 3)
+
+    def __call__(self, images: Sequence[Any]) -> np.ndarray:
+        if len(images) > len(self.buffer):
+            self.buffer = np.empty((len(images), *self.buffer.shape[1:]), dtype=np.float32)
+        out = self.buffer[: len(images)]
+        for i, image in enumerate(images):
+            self.fill(out[i], image)
+        return out
+
+    def fill(self, out: np.ndarray, image: Any) -> None:
+        pixels = np.asarray(self.load(image)).transpose(2, 0, 1)
+        np.multiply(pixels, self._scale, out=out, casting="unsafe")
+        out += self._bias
+
+    def load(self, image: Any):
+        """Decode (if needed), resize the shortest side and center crop to a PIL image."""
+        from PIL import Image
+
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            image = Image.open(io.BytesIO(image))
+            # Not decoded yet: let libjpeg downscale by up to 8x while decoding.
+            image.draft("RGB", (self.spec.size, self.spec.size))
+        elif isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+        width, height = image.size
+        scale = self.spec.size / min(width, height)
+        crop = self.spec.crop / scale  # crop size in source pixels
+        left = (width - crop) / 2
+        top = (height - crop) / 2
+        box = (max(left, 0.0), max(top, 0.0), min(left + crop, width), min(top + crop, height))
+        return image.resize((self.spec.crop, self.spec.crop), self._resample, box=box, reducing_gap=3.0)
@@ -3,6 +3,7 @@ from typing import Any, Dict, Sequence
 import numpy as np
 
 from flash_embed.core.models.model_runner import ModelRunner
+from flash_embed.core.models.preprocess import ImagePreprocessor, preprocess_spec
 
 
 class TensorRTRunner(ModelRunner):
@@ -13,6 +14,9 @@ class TensorRTRunner(ModelRunner):
         model_path: str,
         device: str = "cuda",
         max_batch: int | None = None,
+        image_size: int | None = None,
+        image_mean: Sequence[float] | None = None,
+        image_std: Sequence[float] | None = None,
         **_: Any,
     ):
         try:
@@ -48,6 +52,15 @@ class TensorRTRunner(ModelRunner):
                 self.outputs.append((binding, shape, dtype, device_mem))
             self.allocations.append(device_mem)
 
+        # The engine has a static input shape: preprocess straight into a host
+        # buffer of that shape and copy it over whole, padding short batches.
+        _, in_shape, in_dtype, _ = self.inputs[0]
+        self._host_input = np.zeros(tuple(in_shape), dtype=in_dtype)
+        spec = preprocess_spec(tuple(in_shape), image_size, image_mean, image_std)
+        self._preprocess = ImagePreprocessor(
+            spec, buffer=self._host_input if in_dtype == np.float32 else None, max_batch=in_shape[0]
+        )
+
     def warmup(self) -> None:
         if not self.inputs:
             return
@@ -67,18 +80,25 @@ class TensorRTRunner(ModelRunner):
         # Minimal implementation assumes single image input and single output.
         if images is None:
             raise ValueError("TensorRTRunner expects images input")
-        np_input = np.asarray(images)
-        # TODO: apply preprocessing externally before calling encode.
         name, shape, dtype, device_mem = self.inputs[0]
-        if np_input.size != np.prod(shape):
-            np_input = np_input.reshape(shape)
-        self.cuda.memcpy_htod(device_mem, np_input.astype(dtype))
+        n = len(images)
+        if n > shape[0]:
+            raise ValueError(f"Batch of {n} exceeds engine batch size {shape[0]}")
+        host = self._host_input
+        if isinstance(images, np.ndarray) and images.ndim == 4:
+            host[:n] = images
+        else:
+            batch = self._preprocess(images)
+            if not np.may_share_memory(batch, host):
+                host[:n] = batch
+        host[n:] = 0
+        self.cuda.memcpy_htod(device_mem, host)
         self.context.execute_v2(self.bindings)
         outputs: Dict[str, np.ndarray] = {}
         for name, shape, dtype, device_mem in self.outputs:
             host_out = np.empty(shape, dtype=dtype)
             self.cuda.memcpy_dtoh(host_out, device_mem)
-            outputs[name] = host_out
+            outputs[name] = host_out[:n]
         return outputs
 
     def close(self) -> None:
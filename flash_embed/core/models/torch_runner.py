@@ -1,14 +1,35 @@
-from typing import Any, Dict, Sequence, Union
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, List, Sequence, Union
 
 import numpy as np
 import torch
 from all_clip import load_clip
 
 from flash_embed.core.models.model_runner import ModelRunner
+from flash_embed.core.models.preprocess import ImagePreprocessor, PreprocessSpec
+from flash_embed.core.models.transfer import TransferEngine
+from flash_embed.core.telemetry.logging import get_logger
 
 
 class TorchRunner(ModelRunner):
-    """Torch implementation of ModelRunner."""
+    """Torch implementation of ModelRunner.
+
+    Optional speedups: ``compile`` wraps both towers in ``torch.compile``
+    (compiled artifacts are kept in ``cache_dir`` so later startups skip most
+    of the work), ``channels_last`` switches the image tower to NHWC,
+    ``precision="bf16"`` runs under autocast, and ``inference_mode`` replaces
+    ``no_grad``. Image batches are padded up to the nearest of
+    ``batch_buckets`` and ``warmup`` runs every bucket, so compilation
+    happens at startup rather than mid-run. With ``eager_tolerance``,
+    warmup also compares the optimized outputs against the plain fp32 eager
+    model and fails if they drift further apart than that. Warmup then checks
+    whether the text tower accepts token batches trimmed to their longest
+    row; ``encode_tokens`` pads to the full context otherwise.
+    """
 
     def __init__(
         self,
@@ -16,29 +37,236 @@ class TorchRunner(ModelRunner):
         device: Union[str, torch.device] = "cuda",
         max_batch: int | None = None,
         model_path: str | None = None,  # unused for torch
+        transfer_slots: int = 2,
+        batch_buckets: Sequence[int] | None = None,
+        cache_dir: str | None = None,
+        compile: bool = False,
+        compile_mode: str | None = None,
+        channels_last: bool = False,
+        precision: str = "fp32",
+        inference_mode: bool = True,
+        eager_tolerance: float | None = None,
         **_: Any,
     ):
+        if precision not in {"fp32", "bf16"}:
+            raise ValueError(f"Unsupported torch precision: {precision}")
         self.device = torch.device(device)
         self.model, self.preprocess, self.tokenizer = load_clip(model_name, device=self.device)
         self.model.eval()
-        self._max_batch = max_batch
+        self.buckets: List[int] = sorted(set(int(b) for b in batch_buckets or []))
+        self._max_batch = max_batch or (self.buckets[-1] if self.buckets else None)
+        self.context_length = int(self.tokenizer(["x"]).shape[-1])
+        # Pad token batches only to their longest row once warmup has shown the text tower allows it.
+        self._trim_tokens = False
+
+        self.model_name = model_name
+        self.channels_last = channels_last
+        self.precision = precision
+        self.eager_tolerance = eager_tolerance
+        self._grad_mode: Callable[[], ContextManager[Any]] = torch.inference_mode if inference_mode else torch.no_grad
+        if channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+        self._encode_image: Callable[[torch.Tensor], torch.Tensor] = self.model.encode_image
+        self._encode_text: Callable[[torch.Tensor], torch.Tensor] = self.model.encode_text
+        self._compiled = compile
+        self._compile_cache: Path | None = None
+        if compile:
+            self._compile(compile_mode, cache_dir)
+
+        # Replace the per-image torchvision transform with the fused batch
+        # preprocessor when we can reproduce it. It writes straight into the
+        # transfer engine's ring of (pinned, on CUDA) host buffers, one
+        # preprocessor per slot so batches can be prepared concurrently.
+        spec = PreprocessSpec.from_transform(self.preprocess)
+        self.input_size = spec.crop if spec else 224
+        norm = spec or PreprocessSpec()
+        self._mean = torch.tensor(norm.mean, device=self.device).view(1, 3, 1, 1) * 255.0
+        self._inv_std = 1.0 / (torch.tensor(norm.std, device=self.device).view(1, 3, 1, 1) * 255.0)
+        shape = (max([self.max_batch_size(), *self.buckets]), 3, self.input_size, self.input_size)
+        self._engine = TransferEngine(self.device, shape, num_slots=transfer_slots)
+        self._preprocessors: List[ImagePreprocessor] = []
+        if spec is not None:
+            self._preprocessors = [ImagePreprocessor(spec, buffer=slot.host.numpy()) for slot in self._engine.slots]
+        # Model calls are enqueued one at a time; preprocessing and copies overlap around them.
+        self._compute_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=len(self._engine.slots), thread_name_prefix="torch-runner")
+
+    def _compile(self, mode: str | None, cache_dir: str | None) -> None:
+        if cache_dir:
+            # Key the artifacts on everything that changes the generated code.
+            buckets = "-".join(map(str, self.buckets)) or "dynamic"
+            name = self.model_name.replace("/", "_").replace(":", "_")
+            layout = "nhwc" if self.channels_last else "nchw"
+            key = (
+                f"{name}.{self.device.type}.{self.precision}.{layout}.{mode or 'default'}.{buckets}"
+                f".torch{torch.__version__}"
+            )
+            self._compile_cache = Path(cache_dir) / f"{key}.compile.bin"
+            load = getattr(torch.compiler, "load_cache_artifacts", None)
+            if callable(load) and self._compile_cache.exists():
+                load(self._compile_cache.read_bytes())
+        # Buckets bound the image shapes, so they compile statically; token batches vary in both dims.
+        self._encode_image = torch.compile(self.model.encode_image, mode=mode, dynamic=False if self.buckets else None)
+        self._encode_text = torch.compile(self.model.encode_text, mode=mode, dynamic=True)
+
+    def _save_compile_cache(self) -> None:
+        save = getattr(torch.compiler, "save_cache_artifacts", None)
+        if self._compile_cache is None or not callable(save):
+            return
+        artifacts = save()
+        if artifacts is None:
+            return
+        self._compile_cache.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._compile_cache.with_name(self._compile_cache.name + ".tmp")
+        tmp_path.write_bytes(artifacts[0])
+        tmp_path.replace(self._compile_cache)
+
+    def _autocast(self) -> ContextManager[Any]:
+        if self.precision == "bf16":
+            return torch.autocast(device_type=self.device.type, dtype=torch.bfloat16)
+        return nullcontext()
+
+    def _run_image(self, batch: torch.Tensor) -> torch.Tensor:
+        if self.channels_last:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        with self._autocast():
+            return self._encode_image(batch).float()
+
+    def _run_text(self, tokens: torch.Tensor) -> torch.Tensor:
+        with self._autocast():
+            return self._encode_text(tokens).float()
 
     def warmup(self) -> None:
-        with torch.no_grad():
-            dummy_img = torch.zeros(1, 3, 224, 224, device=self.device)
-            _ = self.model.encode_image(dummy_img)
-            dummy_txt = self.tokenizer(["warmup"]).to(self.device)
-            _ = self.model.encode_text(dummy_txt)
+        # Compiled towers see every shape they will get at startup: each bucket, or two sizes
+        # (which makes dynamo mark the batch dimension dynamic) when unbucketed.
+        compiled = self._compiled
+        sizes = self.buckets or ([1, self.max_batch_size()] if compiled else [1])
+        with self._grad_mode():
+            for rows in sizes:
+                self._run_image(torch.zeros(rows, 3, self.input_size, self.input_size, device=self.device))
+            for texts in (["warmup"], ["warmup", "warmup"]) if compiled else (["warmup"],):
+                self._run_text(self.tokenizer(texts).to(self.device))
+            self._trim_tokens = self._accepts_short_context()
+        if self.eager_tolerance is not None:
+            self._check_against_eager()
+        if compiled:
+            self._save_compile_cache()
+
+    def _accepts_short_context(self) -> bool:
+        """Whether a token batch trimmed to its longest row embeds like the full-context one."""
+        tokens = self.tokenizer(["a photo of a cat"]).to(self.device)
+        length = int((tokens[0] != 0).sum())
+        full = self._run_text(tokens)
+        try:
+            short = self._run_text(tokens[:, :length])
+        except RuntimeError:
+            # Fixed-context text towers (e.g. positional embeddings added at full length).
+            get_logger().info(f"Text tower needs the full {self.context_length}-token context; not trimming")
+            return False
+        cosine = torch.nn.functional.cosine_similarity(short, full, dim=-1)
+        return bool((cosine > 0.999).all())
+
+    def _check_against_eager(self) -> None:
+        """Compare L2-normalized outputs on a fixed random batch against the fp32 eager model."""
+        rows = self.buckets[0] if self.buckets else 1
+        generator = torch.Generator().manual_seed(0)
+        images = torch.randn(rows, 3, self.input_size, self.input_size, generator=generator).to(self.device)
+        tokens = self.tokenizer(["a photo of a cat"] * rows).to(self.device)
+        with self._grad_mode():
+            pairs = {
+                "image": (self._run_image(images), self.model.encode_image(images).float()),
+                "text": (self._run_text(tokens), self.model.encode_text(tokens).float()),
+            }
+        for kind, (optimized, eager) in pairs.items():
+            optimized = torch.nn.functional.normalize(optimized, dim=-1)
+            eager = torch.nn.functional.normalize(eager, dim=-1)
+            drift = float((optimized - eager).abs().max())
+            if drift > self.eager_tolerance:
+                raise RuntimeError(
+                    f"Optimized torch {kind} embeddings differ from eager by {drift:.3g} "
+                    f"(eager_tolerance={self.eager_tolerance})"
+                )
+            get_logger().info(f"Optimized torch {kind} embeddings within {drift:.3g} of eager")
 
     def max_batch_size(self) -> int:
         return self._max_batch or 64
 
+    def max_inflight(self) -> int:
+        """Batches ``encode_async`` can overlap: one per transfer slot."""
+        return len(self._engine.slots)
+
+    def _bucket(self, n: int) -> int:
+        for bucket in self.buckets:
+            if bucket >= n:
+                return bucket
+        return n
+
     def _prep_texts(self, texts: Sequence[str]) -> torch.Tensor:
         return self.tokenizer(list(texts)).to(self.device)
 
+    def tokenize(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """Token ids per caption, with the zero padding stripped; thread-safe, runs ahead of ``encode_tokens``."""
+        ids = self.tokenizer(list(texts)).numpy()
+        lengths = ids.shape[1] - np.argmax(ids[:, ::-1] != 0, axis=1)
+        return [row[:length] for row, length in zip(ids, lengths)]
+
+    def encode_tokens(self, tokens: Sequence[np.ndarray]) -> Dict[str, np.ndarray]:
+        length = max(len(t) for t in tokens) if self._trim_tokens else self.context_length
+        batch = np.zeros((len(tokens), length), dtype=np.int64)
+        for row, ids in zip(batch, tokens):
+            row[: len(ids)] = ids
+        with self._grad_mode():
+            return {"text": self._encode_text_tokens(torch.from_numpy(batch).to(self.device))}
+
+    def _prep_tensors(self, images: Sequence[torch.Tensor]) -> torch.Tensor:
+        """Normalize already-decoded uint8 HWC tensors (e.g. from DALI) on the device."""
+        batch = torch.stack(list(images)).to(self.device, non_blocking=True)
+        batch = batch.permute(0, 3, 1, 2).float()
+        if batch.shape[-2:] != (self.input_size, self.input_size):
+            batch = torch.nn.functional.interpolate(
+                batch, size=(self.input_size, self.input_size), mode="bicubic", antialias=True
+            )
+        return (batch - self._mean) * self._inv_std
+
     def _prep_images(self, images: Sequence[Any]) -> torch.Tensor:
-        preprocessed_images = [self.preprocess(image).unsqueeze(0) for image in images]
-        return torch.cat(preprocessed_images, dim=0).to(self.device, non_blocking=True)
+        if isinstance(images[0], torch.Tensor):
+            batch = self._prep_tensors(images)
+        else:
+            preprocessed_images = [self.preprocess(image).unsqueeze(0) for image in images]
+            batch = torch.cat(preprocessed_images, dim=0).to(self.device, non_blocking=True)
+        pad = self._bucket(len(batch)) - len(batch)
+        if pad:
+            batch = torch.cat([batch, batch.new_zeros((pad, *batch.shape[1:]))])
+        return batch
+
+    def _encode_images(self, images: Sequence[Any]) -> np.ndarray:
+        rows = len(images)
+        if not self._preprocessors or isinstance(images[0], torch.Tensor) or rows > self._engine.capacity:
+            # Device tensors (DALI) need no host staging; unknown transforms and oversized batches bypass the ring.
+            batch_images = self._prep_images(images)
+            with self._compute_lock:
+                return self._run_image(batch_images)[:rows].cpu().numpy()
+        slot = self._engine.acquire()
+        try:
+            self._preprocessors[slot.index](images)
+            padded = min(self._bucket(rows), self._engine.capacity)
+            slot.host[rows:padded].zero_()
+            batch_images = self._engine.to_device(slot, padded)
+            with self._compute_lock, self._engine.compute():
+                self._engine.to_host(slot, {"image": self._run_image(batch_images)[:rows]})
+            return self._engine.wait(slot)["image"]
+        finally:
+            self._engine.release(slot)
+
+    def _encode_text_tokens(self, tokens: torch.Tensor) -> np.ndarray:
+        # Token batches are small and copied in place; the embeddings come back through a slot like images.
+        slot = self._engine.acquire()
+        try:
+            with self._compute_lock, self._engine.compute(tokens):
+                self._engine.to_host(slot, {"text": self._run_text(tokens)})
+            return self._engine.wait(slot)["text"]
+        finally:
+            self._engine.release(slot)
 
     def encode(
         self,
@@ -46,15 +274,23 @@ class TorchRunner(ModelRunner):
         texts: Sequence[str] | None = None,
     ) -> Dict[str, np.ndarray]:
         outputs: Dict[str, np.ndarray] = {}
-        with torch.no_grad():
+        with self._grad_mode():
             if images:
-                batch_images = self._prep_images(images)
-                outputs["image"] = self.model.encode_image(batch_images).cpu().numpy()
+                outputs["image"] = self._encode_images(images)
             if texts:
-                tokenized = self._prep_texts(texts)
-                outputs["text"] = self.model.encode_text(tokenized).cpu().numpy()
+                outputs["text"] = self._encode_text_tokens(self._prep_texts(texts))
         return outputs
 
+    async def encode_async(
+        self,
+        images: Sequence[Any] | None = None,
+        texts: Sequence[str] | None = None,
+    ) -> Dict[str, np.ndarray]:
+        """``encode`` on the runner's own threads, so up to ``max_inflight()`` batches overlap."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.encode, images, texts)
+
     def close(self) -> None:
+        self._executor.shutdown(wait=True)
         if self.device.type == "cuda":
             torch.cuda.empty_cache()
@@ -0,0 +1,118 @@
+import queue
+from contextlib import nullcontext
+from typing import Any, ContextManager, Dict, List, Tuple
+
+import numpy as np
+import torch
+
+
+class TransferSlot:
+    """One ring entry: a host input buffer, its device twin and reused host outputs."""
+
+    def __init__(self, index: int, host: torch.Tensor, device: torch.Tensor, cuda: bool):
+        self.index = index
+        self.host = host
+        self.device = device
+        self.outputs: Dict[str, torch.Tensor] = {}
+        self.pending: List[Tuple[str, int]] = []  # (output name, rows) queued by the current batch
+        self.ready = torch.cuda.Event() if cuda else None  # input copied to the device
+        self.computed = torch.cuda.Event() if cuda else None  # outputs produced on the compute stream
+        self.done = torch.cuda.Event() if cuda else None  # outputs copied back to the host
+
+
+class TransferEngine:
+    """Ring of pinned host buffers with separate copy and compute streams.
+
+    A batch takes a slot, is preprocessed into the slot's host buffer, copied
+    to the device on the copy stream and run on the compute stream once that
+    copy lands; its outputs are copied back on the copy stream into pinned
+    host tensors the slot keeps between batches. With two or more slots,
+    preparing batch N+1 overlaps inference of batch N.
+
+    On CPU the ring works the same way without pinning, streams or the input
+    copy (the device buffer is the host buffer); outputs still go through the
+    slot's reused tensors, so the code path can be exercised without a GPU.
+    """
+
+    def __init__(
+        self,
+        device: torch.device,
+        shape: Tuple[int, ...],
+        num_slots: int = 2,
+        dtype: torch.dtype = torch.float32,
+    ):
+        self.device = device
+        self.cuda = device.type == "cuda"
+        self.capacity = shape[0]
+        self.slots: List[TransferSlot] = []
+        self._free: "queue.Queue[TransferSlot]" = queue.Queue()
+        for index in range(max(1, num_slots)):
+            host = torch.empty(shape, dtype=dtype, pin_memory=self.cuda)
+            on_device = torch.empty(shape, dtype=dtype, device=device) if self.cuda else host
+            slot = TransferSlot(index, host, on_device, self.cuda)
+            self.slots.append(slot)
+            self._free.put(slot)
+        self.copy_stream = torch.cuda.Stream(device) if self.cuda else None
+        self.compute_stream = torch.cuda.Stream(device) if self.cuda else None
+
+    def acquire(self) -> TransferSlot:
+        """Take a free slot, blocking while every slot has a batch in flight."""
+        return self._free.get()
+
+    def release(self, slot: TransferSlot) -> None:
+        slot.pending.clear()
+        self._free.put(slot)
+
+    def to_device(self, slot: TransferSlot, rows: int) -> torch.Tensor:
+        """Queue the copy of ``slot.host[:rows]``; the result is only valid on the compute stream."""
+        if not self.cuda:
+            return slot.device[:rows]
+        with torch.cuda.stream(self.copy_stream):
+            slot.device[:rows].copy_(slot.host[:rows], non_blocking=True)
+            slot.ready.record(self.copy_stream)
+        self.compute_stream.wait_event(slot.ready)
+        return slot.device[:rows]
+
+    def compute(self, *inputs: torch.Tensor) -> ContextManager[Any]:
+        """Context that makes the compute stream current for the model call.
+
+        ``inputs`` made on the caller's stream (e.g. moved with ``.to(device)``
+        rather than through a slot) are waited for and kept alive until the
+        compute stream is done with them.
+        """
+        if not self.cuda:
+            return nullcontext()
+        if inputs:
+            self.compute_stream.wait_stream(torch.cuda.current_stream(self.device))
+            for tensor in inputs:
+                tensor.record_stream(self.compute_stream)
+        return torch.cuda.stream(self.compute_stream)
+
+    def to_host(self, slot: TransferSlot, outputs: Dict[str, torch.Tensor]) -> None:
+        """Queue copies of ``outputs`` into the slot's host tensors, after the compute stream's work."""
+        if self.cuda:
+            slot.computed.record(self.compute_stream)
+            self.copy_stream.wait_event(slot.computed)
+        with torch.cuda.stream(self.copy_stream) if self.cuda else nullcontext():
+            for name, tensor in outputs.items():
+                target = self._output(slot, name, tensor)[: len(tensor)]
+                if self.cuda:
+                    # Produced on the compute stream, read here: keep the allocator from reusing it early.
+                    tensor.record_stream(self.copy_stream)
+                target.copy_(tensor, non_blocking=self.cuda)
+                slot.pending.append((name, len(tensor)))
+            if self.cuda:
+                slot.done.record(self.copy_stream)
+
+    def wait(self, slot: TransferSlot) -> Dict[str, np.ndarray]:
+        """Block until the slot's outputs are on the host; returns copies, as the slot is reused."""
+        if self.cuda:
+            slot.done.synchronize()
+        return {name: slot.outputs[name][:rows].numpy().copy() for name, rows in slot.pending}
+
+    def _output(self, slot: TransferSlot, name: str, like: torch.Tensor) -> torch.Tensor:
+        out = slot.outputs.get(name)
+        if out is None or out.dtype != like.dtype or out.shape[1:] != like.shape[1:] or len(out) < len(like):
+            shape = (max(self.capacity, len(like)), *like.shape[1:])
+            out = slot.outputs[name] = torch.empty(shape, dtype=like.dtype, pin_memory=self.cuda)
+        return out
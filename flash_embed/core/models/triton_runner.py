@@ -1,8 +1,11 @@
+import asyncio
+import threading
 from typing import Any, Dict, Sequence
 
 import numpy as np
 
 from flash_embed.core.models.model_runner import ModelRunner
+from flash_embed.core.models.preprocess import ImagePreprocessor, preprocess_spec
 
 
 class TritonRunner(ModelRunner):
@@ -14,6 +17,10 @@ class TritonRunner(ModelRunner):
         max_batch: int | None = None,
         triton_url: str | None = None,
         triton_version: str | None = None,
+        image_size: int | None = None,
+        image_mean: Sequence[float] | None = None,
+        image_std: Sequence[float] | None = None,
+        **_: Any,
     ):
         try:
             import tritonclient.grpc as grpcclient
@@ -38,14 +45,26 @@ class TritonRunner(ModelRunner):
         self.input_names = [inp.name for inp in self.model_metadata.inputs]
         self.output_names = [out.name for out in self.model_metadata.outputs]
 
+        # Models taking a float NCHW tensor get preprocessed batches; anything
+        # else (e.g. raw bytes for a server-side DALI ensemble) is sent as is.
+        self._preprocess: ImagePreprocessor | None = None
+        model_input = self.model_metadata.inputs[0] if self.model_metadata.inputs else None
+        if model_input is not None and model_input.datatype == "FP32" and len(model_input.shape) == 4:
+            spec = preprocess_spec(list(model_input.shape), image_size, image_mean, image_std)
+            self._preprocess = ImagePreprocessor(spec, max_batch=self._max_batch)
+        self._preprocess_lock = threading.Lock()
+
     def warmup(self) -> None:
         # Attempt a lightweight warmup if possible.
         if not self.input_names:
             return
-        dummy_shape = self.model_metadata.inputs[0].shape
-        dummy = np.zeros(dummy_shape, dtype=np.float32)
+        if self._preprocess is not None:
+            size = self._preprocess.spec.crop
+            dummy = np.zeros((1, 3, size, size), dtype=np.float32)
+        else:
+            dummy = np.zeros(self.model_metadata.inputs[0].shape, dtype=np.float32)[None]
         try:
-            self.encode(images=[dummy])
+            self.encode(images=dummy)
         except Exception:
             # Ignore warmup failures; real errors will surface on first request.
             pass
@@ -53,10 +72,18 @@ class TritonRunner(ModelRunner):
     def max_batch_size(self) -> int:
         return self._max_batch
 
-    def _build_inputs(self, images: Sequence[Any]) -> list:
-        np_images = np.asarray(images)
-        infer_input = self.grpcclient.InferInput(self.input_names[0], np_images.shape, np_images.dtype.name)
-        infer_input.set_data_from_numpy(np_images)
+    def _to_array(self, images: Sequence[Any]) -> np.ndarray:
+        if self._preprocess is not None and not (isinstance(images, np.ndarray) and images.ndim == 4):
+            return self._preprocess(images)
+        return np.asarray(images)
+
+    def _build_inputs(self, images: Sequence[Any], client: Any = None) -> list:
+        client = client or self.grpcclient
+        # The preprocessor reuses one buffer; set_data_from_numpy copies it out, so hold the lock until then.
+        with self._preprocess_lock:
+            np_images = self._to_array(images)
+            infer_input = client.InferInput(self.input_names[0], np_images.shape, np_images.dtype.name)
+            infer_input.set_data_from_numpy(np_images)
         return [infer_input]
 
     def _build_outputs(self) -> list:
@@ -86,14 +113,15 @@ class TritonRunner(ModelRunner):
     ) -> Dict[str, np.ndarray]:
         if images is None:
             raise ValueError("TritonRunner expects images input")
-        np_images = np.asarray(images)
-        infer_input = self.grpcclient_aio.InferInput(self.input_names[0], np_images.shape, np_images.dtype.name)
-        infer_input.set_data_from_numpy(np_images)
+        # Resizing and normalizing a batch off the event loop keeps the other pipeline stages
+        # and in-flight requests moving meanwhile.
+        loop = asyncio.get_running_loop()
+        inputs = await loop.run_in_executor(None, self._build_inputs, images, self.grpcclient_aio)
         outputs = [self.grpcclient_aio.InferRequestedOutput(name) for name in self.output_names]
         response = await self.async_client.infer(
             model_name=self.model_name,
             model_version=self.model_version,
-            inputs=[infer_input],
+            inputs=inputs,
             outputs=outputs,
         )
         return {name: response.as_numpy(name) for name in self.output_names}
@@ -1,4 +1,6 @@
 from flash_embed.core.pipeline.workers import AsyncPipeline
-from flash_embed.core.pipeline.scheduler import Scheduler, Task, TaskState
+from flash_embed.core.pipeline.scheduler import Scheduler, ShardProgress
+from flash_embed.core.pipeline.orchestrator import ShardOrchestrator, ShardState, Lease, LeasedShardSource
+from flash_embed.core.pipeline.cache import CaptionCache, EmbeddingCache
 
-__all__ = ["AsyncPipeline", "Scheduler", "Task", "TaskState"]
+__all__ = ["AsyncPipeline", "Scheduler", "ShardProgress", "ShardOrchestrator", "ShardState", "Lease", "LeasedShardSource", "CaptionCache", "EmbeddingCache"]
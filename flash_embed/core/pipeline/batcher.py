@@ -1,6 +1,6 @@
 import time
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Sequence
 
 from flash_embed.core.io.reader import Sample
 
@@ -8,10 +8,17 @@ from flash_embed.core.io.reader import Sample
 @dataclass
 class Batch:
     samples: List[Sample]
+    seq: int = 0  # emission order, used to write batches back in order
+    outputs: Optional[Dict[str, Any]] = None  # precomputed embeddings (cache hits); skips inference
 
 
 class DynamicBatcher:
-    """Batcher with size and timeout triggers."""
+    """Batcher with size and timeout triggers.
+
+    The deadline starts when the first sample of a batch arrives. ``add`` only
+    sees it when another sample comes in, so callers should also wait at most
+    ``timeout()`` for the next sample and ``flush`` when it elapses.
+    """
 
     def __init__(self, max_size: int, max_delay_s: float):
         self.max_size = max_size
@@ -19,19 +26,187 @@ class DynamicBatcher:
         self._buffer: List[Sample] = []
         self._deadline = time.monotonic() + self.max_delay_s
 
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def target_size(self) -> int:
+        return self.max_size
+
+    @property
+    def delay_s(self) -> float:
+        return self.max_delay_s
+
     def add(self, sample: Sample) -> Optional[Batch]:
+        if not self._buffer:
+            self._deadline = time.monotonic() + self.delay_s
         self._buffer.append(sample)
-        if len(self._buffer) >= self.max_size:
+        if len(self._buffer) >= self.target_size:
             return self.flush()
         if time.monotonic() >= self._deadline and self._buffer:
             return self.flush()
         return None
 
+    def timeout(self) -> Optional[float]:
+        """Seconds until the pending partial batch is due, or None when nothing is buffered."""
+        if not self._buffer:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def record(self, size: int, seconds: float) -> None:
+        """Feedback from the infer stage; the fixed batcher ignores it."""
+        return
+
     def flush(self) -> Optional[Batch]:
         if not self._buffer:
-            self._deadline = time.monotonic() + self.max_delay_s
+            self._deadline = time.monotonic() + self.delay_s
             return None
         batch = Batch(samples=list(self._buffer))
         self._buffer.clear()
-        self._deadline = time.monotonic() + self.max_delay_s
+        self._deadline = time.monotonic() + self.delay_s
         return batch
+
+
+@dataclass
+class _BucketStats:
+    latency_s: float = 0.0  # EWMA of per-batch inference time at this size
+    count: int = 0
+    epoch: int = -1  # retune round in which the bucket was last measured
+
+
+class AdaptiveBatcher(DynamicBatcher):
+    """Batcher that tunes its batch size from observed inference latency.
+
+    Sizes are restricted to ``buckets`` so compiled backends only see a few
+    shapes. Every ``window`` batches the batcher hill-climbs: it keeps the best
+    measured bucket (most samples/second in ``throughput`` mode, the largest
+    under ``latency_target_s`` in ``latency`` mode) and spends the next window
+    probing a neighbour not measured in the last ``stale_after`` rounds, so the
+    choice follows changes in image mix and decode speed. Partial batches are flushed after roughly one
+    inference time (capped at ``max_delay_s``): waiting longer than the model
+    takes to run only idles it.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        max_delay_s: float,
+        buckets: Optional[Sequence[int]] = None,
+        target: str = "throughput",
+        latency_target_s: float = 0.1,
+        min_delay_s: float = 0.001,
+        window: int = 8,
+        stale_after: int = 16,
+        alpha: float = 0.3,
+    ):
+        if target not in {"throughput", "latency"}:
+            raise ValueError(f"Unsupported batching target: {target}")
+        buckets = sorted({int(b) for b in buckets or [] if 0 < int(b) <= max_size})
+        if not buckets:
+            buckets = sorted({1 << i for i in range(max_size.bit_length())} | {max_size})
+        self.buckets = buckets
+        self.target = target
+        self.latency_target_s = latency_target_s
+        self.min_delay_s = min_delay_s
+        self.window = window
+        self.stale_after = stale_after
+        self.alpha = alpha
+        self._stats = [_BucketStats() for _ in buckets]
+        # Start in the middle so both directions get probed early.
+        self._index = self._best = len(buckets) // 2
+        self._epoch = 0
+        self._since_retune = 0
+        super().__init__(max_size=max_size, max_delay_s=max_delay_s)
+
+    @property
+    def target_size(self) -> int:
+        return self.buckets[self._index]
+
+    @property
+    def delay_s(self) -> float:
+        stats = self._stats[self._index]
+        if not stats.count:
+            return self.max_delay_s
+        return min(self.max_delay_s, max(self.min_delay_s, stats.latency_s))
+
+    def record(self, size: int, seconds: float) -> None:
+        # Partial batches (timeouts, end of input) say little about any bucket's cost.
+        if size not in self.buckets:
+            return
+        index = self.buckets.index(size)
+        stats = self._stats[index]
+        stats.latency_s = seconds if not stats.count else (1 - self.alpha) * stats.latency_s + self.alpha * seconds
+        stats.count += 1
+        stats.epoch = self._epoch
+        if index == self._index:
+            self._since_retune += 1
+            if self._since_retune >= self.window:
+                self._retune()
+
+    def _retune(self) -> None:
+        self._since_retune = 0
+        self._epoch += 1
+        # Pick the best measured bucket around the incumbent, then probe one of its stale neighbours.
+        around = [i for i in (self._best - 1, self._best, self._best + 1, self._index) if 0 <= i < len(self.buckets)]
+        measured = sorted({i for i in around if not self._stale(i)})
+        if self.target == "throughput":
+            self._best = max(measured, key=lambda i: self.buckets[i] / self._stats[i].latency_s)
+        else:
+            fits = [i for i in measured if self._stats[i].latency_s <= self.latency_target_s]
+            self._best = max(fits) if fits else measured[0]
+        stale = [i for i in (self._best + 1, self._best - 1) if 0 <= i < len(self.buckets) and self._stale(i)]
+        # Probe upward first: larger batches are usually the cheaper direction to be wrong in.
+        self._index = stale[0] if stale else self._best
+
+    def _stale(self, index: int) -> bool:
+        stats = self._stats[index]
+        return stats.count == 0 or self._epoch - stats.epoch > self.stale_after
+
+
+class LengthBucketBatcher(DynamicBatcher):
+    """Batcher for text that groups samples of similar token length.
+
+    Samples go to a buffer per ``bucket_width``-token length range, so padding
+    within a batch stays small. A full bucket is emitted at once; when the
+    deadline of the oldest pending sample passes, ``flush`` returns the
+    buckets one per call, oldest first (call it until it returns None).
+    """
+
+    def __init__(self, max_size: int, max_delay_s: float, bucket_width: int = 8):
+        self.bucket_width = max(1, bucket_width)
+        self._buckets: Dict[int, List[Sample]] = {}
+        self._started: Dict[int, float] = {}
+        super().__init__(max_size=max_size, max_delay_s=max_delay_s)
+
+    def __len__(self) -> int:
+        return sum(len(b) for b in self._buckets.values())
+
+    def _length(self, sample: Sample) -> int:
+        tokens = sample.tokens
+        return len(tokens) if tokens is not None else len((sample.text or "").split())
+
+    def add(self, sample: Sample) -> Optional[Batch]:
+        key = self._length(sample) // self.bucket_width
+        bucket = self._buckets.setdefault(key, [])
+        if not bucket:
+            self._started[key] = time.monotonic()
+        bucket.append(sample)
+        if len(bucket) >= self.max_size:
+            return self._pop(key)
+        if self.timeout() == 0.0:
+            return self.flush()
+        return None
+
+    def timeout(self) -> Optional[float]:
+        if not self._started:
+            return None
+        return max(0.0, min(self._started.values()) + self.max_delay_s - time.monotonic())
+
+    def flush(self) -> Optional[Batch]:
+        if not self._started:
+            return None
+        return self._pop(min(self._started, key=self._started.__getitem__))
+
+    def _pop(self, key: int) -> Batch:
+        self._started.pop(key, None)
+        return Batch(samples=self._buckets.pop(key))
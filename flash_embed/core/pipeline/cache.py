@@ -0,0 +1,127 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    digest BLOB NOT NULL,
+    kind TEXT NOT NULL,
+    dtype TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (model, digest, kind)
+) WITHOUT ROWID;
+"""
+
+
+def content_digest(image: Any, text: Optional[Union[str, bytes]] = None) -> Optional[bytes]:
+    """Hash of an image's encoded bytes (or its pixels once decoded) and caption; None if unhashable."""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        data = image
+    elif hasattr(image, "tobytes"):
+        # Decoded PIL images / arrays: a hit then saves inference but not decode.
+        data = image.tobytes()
+    else:
+        return None
+    digest = hashlib.blake2b(data, digest_size=16)
+    if text is not None:
+        # Text embeddings ride along with the image ones, so the caption is part of the key.
+        digest.update(b"\0" + (text if isinstance(text, bytes) else text.encode()))
+    return digest.digest()
+
+
+def _to_numpy(array: Any) -> np.ndarray:
+    if hasattr(array, "detach"):
+        array = array.detach().float().cpu().numpy()
+    return np.asarray(array)
+
+
+class CaptionCache:
+    """Thread-safe in-memory LRU of embeddings by caption text, for repeated captions in text mode."""
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, Dict[str, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, text: str) -> Optional[Dict[str, np.ndarray]]:
+        with self._lock:
+            outputs = self._items.get(text)
+            if outputs is not None:
+                self._items.move_to_end(text)
+            return outputs
+
+    def put_many(self, texts: Sequence[Optional[str]], outputs: Dict[str, Any]) -> None:
+        arrays = {kind: _to_numpy(array) for kind, array in outputs.items()}
+        with self._lock:
+            for i, text in enumerate(texts):
+                if text is None:
+                    continue
+                # Copies, so cached rows don't pin whole batch arrays in memory.
+                self._items[text] = {kind: array[i].copy() for kind, array in arrays.items()}
+                self._items.move_to_end(text)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+class EmbeddingCache:
+    """Embeddings keyed by (model, content digest) in a local SQLite file.
+
+    ``model`` must change whenever the embeddings would (weights, backend,
+    preprocessing), otherwise stale vectors are served. Several processes may
+    share the file; writes are batched per inference batch.
+    """
+
+    def __init__(self, path: str, model: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.model = model
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, digest: bytes) -> Optional[Dict[str, np.ndarray]]:
+        """All cached vectors for ``digest`` by embedding kind, or None on a miss."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, dtype, vector FROM embeddings WHERE model = ? AND digest = ?", (self.model, digest)
+            ).fetchall()
+        if not rows:
+            return None
+        return {kind: np.frombuffer(vector, dtype=dtype) for kind, dtype, vector in rows}
+
+    def put_many(self, digests: Sequence[Optional[bytes]], outputs: Dict[str, Any], rows: Iterable[int]) -> None:
+        """Store row ``i`` of every output array under ``digests[i]`` for each ``i`` in ``rows``."""
+        arrays = {kind: _to_numpy(array) for kind, array in outputs.items()}
+        records: List[tuple] = []
+        for i in rows:
+            digest = digests[i]
+            if digest is None:
+                continue
+            for kind, array in arrays.items():
+                vector = np.ascontiguousarray(array[i])
+                records.append((self.model, digest, kind, vector.dtype.str, vector.tobytes()))
+        if not records:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", records)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
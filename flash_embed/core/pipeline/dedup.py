@@ -0,0 +1,128 @@
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _faiss():
+    try:
+        import faiss
+    except Exception as exc:
+        raise RuntimeError("faiss is required for the faiss dedup backend") from exc
+    return faiss
+
+
+@dataclass
+class Duplicate:
+    row: int  # row within the checked batch
+    of: Tuple[str, str]  # (shard, uid) of the earlier, kept sample
+    score: float  # cosine similarity
+
+
+class NearDuplicateFilter:
+    """Flags embeddings within ``threshold`` cosine similarity of one seen earlier in the run.
+
+    Vectors are L2-normalized copies; what gets written is untouched. The
+    ``numpy`` backend keeps the last ``window`` kept vectors in a ring and
+    compares each batch against them block by block (plus against earlier
+    rows of the same batch). The ``faiss`` backend uses an exact inner-product
+    index over every kept vector instead, for runs where the window would be
+    too short. Only first occurrences enter the reference set.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        window: int = 65536,
+        backend: str = "numpy",
+        block_rows: int = 16384,
+    ):
+        if backend not in {"numpy", "faiss"}:
+            raise ValueError(f"Unsupported dedup backend: {backend}")
+        self.threshold = threshold
+        self.window = window
+        self.backend = backend
+        self.block_rows = block_rows
+        self._vectors: Optional[np.ndarray] = None
+        self._ids: List[Tuple[str, str]] = []
+        self._size = 0
+        self._next = 0  # ring write position (numpy backend)
+        self._index: Any = None
+
+    def check(self, vectors: Any, ids: Sequence[Tuple[str, str]]) -> List[Duplicate]:
+        """Return the duplicate rows of ``vectors`` and remember the rest."""
+        queries = np.asarray(vectors, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        best, best_at = self._search(queries)
+
+        # Earlier rows of this batch are references too: mask the diagonal and everything above it.
+        local = queries @ queries.T
+        local[np.triu_indices(len(queries))] = -np.inf
+        duplicates: List[Duplicate] = []
+        kept: List[int] = []
+        for row in range(len(queries)):
+            score, of = float(best[row]), None
+            if score >= self.threshold:
+                of = self._ids[best_at[row]]
+            j = int(np.argmax(local[row]))
+            if local[row, j] >= self.threshold and local[row, j] > score:
+                score, of = float(local[row, j]), ids[j]
+            if of is not None:
+                duplicates.append(Duplicate(row=row, of=of, score=score))
+                # Only kept rows stay references for the rest of the batch.
+                local[row + 1 :, row] = -np.inf
+            else:
+                kept.append(row)
+        self._add(queries[kept], [ids[i] for i in kept])
+        return duplicates
+
+    def _search(self, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        best = np.full(len(queries), -np.inf, dtype=np.float32)
+        best_at = np.zeros(len(queries), dtype=np.int64)
+        if not self._size:
+            return best, best_at
+        if self.backend == "faiss":
+            scores, labels = self._index.search(queries, 1)
+            return scores[:, 0], labels[:, 0]
+        for start in range(0, self._size, self.block_rows):
+            block = self._vectors[start : min(start + self.block_rows, self._size)]
+            scores = queries @ block.T
+            at = np.argmax(scores, axis=1)
+            top = scores[np.arange(len(queries)), at]
+            better = top > best
+            best[better] = top[better]
+            best_at[better] = at[better] + start
+        return best, best_at
+
+    def _add(self, vectors: np.ndarray, ids: List[Tuple[str, str]]) -> None:
+        if not len(vectors):
+            return
+        if self.backend == "faiss":
+            if self._index is None:
+                self._index = _faiss().IndexFlatIP(vectors.shape[1])
+            self._index.add(np.ascontiguousarray(vectors))
+            self._ids.extend(ids)
+            self._size += len(vectors)
+            return
+        if self._vectors is None:
+            self._vectors = np.empty((self.window, vectors.shape[1]), dtype=np.float32)
+            self._ids = [("", "")] * self.window
+        for vector, sample_id in zip(vectors[-self.window :], ids[-self.window :]):
+            self._vectors[self._next] = vector
+            self._ids[self._next] = sample_id
+            self._next = (self._next + 1) % self.window
+        self._size = min(self._size + len(vectors), self.window)
+
+
+def write_duplicates(path: Path, records: Sequence[Dict[str, Any]]) -> None:
+    """Atomically write a duplicates map as JSON lines."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
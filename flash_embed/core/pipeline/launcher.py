@@ -0,0 +1,209 @@
+import contextlib
+import copy
+import multiprocessing
+import os
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from flash_embed.config import Config
+from flash_embed.core.io.reader import expand_shards
+from flash_embed.core.telemetry.logging import get_logger
+from flash_embed.core.writer.manifest import merge_manifests
+
+
+def rank_dir(rank: int) -> str:
+    return f"rank-{rank:03d}"
+
+
+def deal_shards(shards: Sequence[str], num_procs: int) -> List[List[str]]:
+    """Round-robin ``shards`` over ``num_procs`` ranks; the same input always gives the same split."""
+    return [list(shards[rank::num_procs]) for rank in range(num_procs)]
+
+
+def split_cores(num_procs: int, cores_per_proc: Optional[int] = None) -> List[List[int]]:
+    """Disjoint CPU sets per rank, taken from the cores this process may run on."""
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    if not available:
+        return [[] for _ in range(num_procs)]
+    per_proc = cores_per_proc or max(1, len(available) // num_procs)
+    return [[available[(rank * per_proc + i) % len(available)] for i in range(per_proc)] for rank in range(num_procs)]
+
+
+def _rank_dirs(out_dir: Path) -> List[str]:
+    return sorted(p.name for p in out_dir.glob("rank-*") if p.is_dir())
+
+
+def _rank_config(cfg: Config, rank: int) -> Config:
+    rank_cfg = copy.deepcopy(cfg)
+    rank_cfg.output.out_dir = str(Path(cfg.output.out_dir) / rank_dir(rank))
+    rank_cfg.launcher.num_procs = 1
+    if cfg.telemetry.metrics_port is not None:
+        rank_cfg.telemetry.metrics_port = cfg.telemetry.metrics_port + rank
+    if cfg.orchestrator.worker_id:
+        rank_cfg.orchestrator.worker_id = f"{cfg.orchestrator.worker_id}-{rank}"
+    # Every rank must project into the same space.
+    rank_cfg.postprocess.projection_path = _projection_path(cfg)
+    return rank_cfg
+
+
+def _projection_path(cfg: Config) -> str:
+    return cfg.postprocess.projection_path or str(Path(cfg.output.out_dir) / "projection.npz")
+
+
+def require_projection(cfg: Config) -> None:
+    """Reject PCA across processes until a fitted projection exists; each would fit and save its own."""
+    if cfg.postprocess.reduce == "pca" and not os.path.exists(_projection_path(cfg)):
+        raise ValueError(
+            f"PCA with several processes needs a fitted projection at {_projection_path(cfg)}; "
+            "fit one with a single-process run over a few shards first, or use postprocess.reduce=random"
+        )
+
+
+_THREAD_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+@contextlib.contextmanager
+def _environ(env: Dict[str, str]) -> Iterator[None]:
+    """Set ``env`` in this process for the duration; spawned children copy it when they start."""
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _limit_threads(num_threads: int) -> None:
+    # Pools of libraries already imported were sized before pinning (the spawn import chain loads torch).
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(num_threads)
+    faiss = sys.modules.get("faiss")
+    if faiss is not None:
+        faiss.omp_set_num_threads(num_threads)
+
+
+def _pinned(target: Callable[..., None], args: tuple, cores: List[int]) -> None:
+    if cores:
+        os.sched_setaffinity(0, cores)
+        _limit_threads(len(cores))
+    target(*args)
+
+
+def start_rank(
+    ctx: Any,
+    target: Callable[..., None],
+    args: tuple,
+    name: str,
+    device: Optional[str] = None,
+    cores: Optional[List[int]] = None,
+) -> multiprocessing.process.BaseProcess:
+    """Start ``target(*args)`` in a spawned process that sees only ``device`` and runs on ``cores``.
+
+    The GPU and thread-count variables go into the environment the child
+    starts with, so they hold before any of its imports initialize CUDA,
+    OpenMP or MKL; the child then pins itself and resizes pools already made.
+    """
+    env: Dict[str, str] = {}
+    if device is not None:
+        env["CUDA_VISIBLE_DEVICES"] = device
+    if cores:
+        env.update({var: str(len(cores)) for var in _THREAD_VARS if var not in os.environ})
+    proc = ctx.Process(target=_pinned, args=(target, args, list(cores or [])), name=name)
+    with _environ(env):
+        proc.start()
+    return proc
+
+
+def _run_rank(cfg: Config, shards: Optional[List[str]]) -> None:
+    import asyncio
+
+    from flash_embed.core.pipeline.workers import AsyncPipeline
+
+    if shards is None:
+        from flash_embed.cli import run_worker
+
+        # The rank directory is already this process's own.
+        run_worker(cfg)
+        return
+    cfg.io.data_paths = shards
+    pipeline = AsyncPipeline(cfg)
+    asyncio.run(pipeline.run())
+
+
+def launch(cfg: Config) -> None:
+    """Run ``launcher.num_procs`` pipelines in worker processes and merge their manifests.
+
+    Shards are dealt round-robin, or with ``launcher.queue`` pulled from the
+    SQLite shard queue (``orchestrator.db_path``, default
+    ``<out_dir>/shards.db``). Rank ``r`` writes to ``<out_dir>/rank-r``, sees
+    only GPU ``launcher.devices[r % len]`` and is pinned to its own cores.
+    """
+    logger = get_logger()
+    num_procs = cfg.launcher.num_procs
+    require_projection(cfg)
+    out_dir = Path(cfg.output.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # Shards committed by an earlier launch (possibly with another process count) are not redone.
+    done = {entry["shard"] for entry in merge_manifests(str(out_dir), _rank_dirs(out_dir))}
+    shards = [shard for shard in expand_shards(cfg.io.data_paths) if shard not in done]
+    if done:
+        logger.info(f"Skipping {len(done)} shard(s) already committed under {out_dir}")
+
+    assignments: List[Optional[List[str]]]
+    if cfg.launcher.queue:
+        from flash_embed.core.pipeline.orchestrator import ShardOrchestrator
+
+        cfg = copy.deepcopy(cfg)
+        cfg.orchestrator.db_path = cfg.orchestrator.db_path or str(Path(cfg.output.out_dir) / "shards.db")
+        orchestrator = ShardOrchestrator(
+            cfg.orchestrator.db_path,
+            max_retries=cfg.retry.max_retries,
+            backoff_ms=cfg.retry.backoff_ms,
+            lease_s=cfg.orchestrator.lease_s,
+        )
+        try:
+            orchestrator.add_shards(shards)
+        finally:
+            orchestrator.close()
+        assignments = [None] * num_procs
+    else:
+        assignments = list(deal_shards(shards, num_procs))
+
+    devices = cfg.launcher.devices
+    cores = split_cores(num_procs, cfg.launcher.cores_per_proc) if cfg.launcher.pin_cores else [[]] * num_procs
+    ctx = multiprocessing.get_context("spawn")
+    procs: Dict[int, multiprocessing.process.BaseProcess] = {}
+    for rank in range(num_procs):
+        if assignments[rank] == []:
+            continue
+        device = devices[rank % len(devices)] if devices else None
+        proc = start_rank(
+            ctx,
+            _run_rank,
+            (_rank_config(cfg, rank), assignments[rank]),
+            name=f"flash-embed-{rank_dir(rank)}",
+            device=device,
+            cores=cores[rank],
+        )
+        procs[rank] = proc
+        logger.info(
+            f"Started {rank_dir(rank)} (pid {proc.pid}, device {device or 'default'}, "
+            f"{'queue' if assignments[rank] is None else f'{len(assignments[rank])} shard(s)'})"
+        )
+
+    failed = []
+    for rank, proc in procs.items():
+        proc.join()
+        if proc.exitcode != 0:
+            failed.append(rank)
+
+    entries = merge_manifests(str(out_dir), _rank_dirs(out_dir))
+    logger.info(f"Merged {len(entries)} committed shard(s) from {num_procs} process(es) into {cfg.output.out_dir}")
+    if failed:
+        raise RuntimeError(f"Worker process(es) {[rank_dir(r) for r in failed]} failed; rerun to resume")
@@ -0,0 +1,292 @@
+import enum
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set
+
+from flash_embed.core.telemetry.logging import get_logger
+from flash_embed.core.writer.manifest import completed_shards
+
+
+class ShardState(str, enum.Enum):
+    PENDING = "pending"
+    IN_PROGRESS = "in_progress"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class Lease:
+    shard: str
+    worker_id: str
+    attempts: int  # attempt count when leased; doubles as the lease token
+    expires_at: float
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    shard TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    lease_expires REAL,
+    available_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shards_state ON shards (state, available_at);
+"""
+
+
+class ShardOrchestrator:
+    """Durable local shard queue backed by SQLite in WAL mode.
+
+    Every process opens its own orchestrator on the same database file; leases
+    are taken inside ``BEGIN IMMEDIATE`` transactions so two workers never get
+    the same shard. Expired leases are reclaimed on acquire and count as a
+    failed attempt against the retry budget.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_retries: int = 3,
+        backoff_ms: int = 100,
+        lease_s: float = 600.0,
+    ):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self.max_retries = max_retries
+        self.backoff_s = backoff_ms / 1000.0
+        self.lease_s = lease_s
+        self.logger = get_logger()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def add_shards(self, shards: Iterable[str]) -> int:
+        """Insert shards as PENDING; already-known shards are left untouched."""
+        now = time.time()
+        rows = [(shard, ShardState.PENDING.value, now) for shard in shards]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO shards (shard, state, updated_at) VALUES (?, ?, ?)", rows
+                )
+                added = self._conn.total_changes - before
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def acquire(self, worker_id: str) -> Optional[Lease]:
+        """Lease the next available shard, or return None if none is ready."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._reclaim(now)
+                row = self._conn.execute(
+                    "SELECT shard, attempts FROM shards WHERE state = ? AND available_at <= ? "
+                    "ORDER BY available_at, shard LIMIT 1",
+                    (ShardState.PENDING.value, now),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                shard, attempts = row
+                expires_at = now + self.lease_s
+                self._conn.execute(
+                    "UPDATE shards SET state = ?, worker_id = ?, lease_expires = ?, updated_at = ? WHERE shard = ?",
+                    (ShardState.IN_PROGRESS.value, worker_id, expires_at, now, shard),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return Lease(shard=shard, worker_id=worker_id, attempts=attempts, expires_at=expires_at)
+
+    def heartbeat(self, lease: Lease) -> bool:
+        """Extend a lease; returns False if it was lost to a reclaim."""
+        now = time.time()
+        expires_at = now + self.lease_s
+        updated = self._update_owned(
+            lease, "lease_expires = ?, updated_at = ?", (expires_at, now)
+        )
+        if updated:
+            lease.expires_at = expires_at
+        return updated
+
+    def complete(self, lease: Lease) -> bool:
+        now = time.time()
+        return self._update_owned(
+            lease,
+            "state = ?, lease_expires = NULL, last_error = NULL, updated_at = ?",
+            (ShardState.DONE.value, now),
+        )
+
+    def fail(self, lease: Lease, error: str) -> Optional[ShardState]:
+        """Record a failed attempt; the shard is retried until the budget runs out."""
+        now = time.time()
+        attempts = lease.attempts + 1
+        state, available_at = self._next_state(attempts, now)
+        updated = self._update_owned(
+            lease,
+            "state = ?, attempts = ?, available_at = ?, lease_expires = NULL, last_error = ?, updated_at = ?",
+            (state.value, attempts, available_at, error, now),
+        )
+        return state if updated else None
+
+    def reclaim_expired(self) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                reclaimed = self._reclaim(time.time())
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return reclaimed
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM shards GROUP BY state").fetchall()
+        counts = {state.value: 0 for state in ShardState}
+        counts.update({state: count for state, count in rows})
+        return counts
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _next_state(self, attempts: int, now: float):
+        if attempts > self.max_retries:
+            return ShardState.FAILED, now
+        return ShardState.PENDING, now + self.backoff_s * (2 ** (attempts - 1))
+
+    def _reclaim(self, now: float) -> int:
+        rows = self._conn.execute(
+            "SELECT shard, attempts FROM shards WHERE state = ? AND lease_expires < ?",
+            (ShardState.IN_PROGRESS.value, now),
+        ).fetchall()
+        for shard, attempts in rows:
+            state, available_at = self._next_state(attempts + 1, now)
+            self._conn.execute(
+                "UPDATE shards SET state = ?, attempts = ?, available_at = ?, worker_id = NULL, "
+                "lease_expires = NULL, last_error = ?, updated_at = ? WHERE shard = ?",
+                (state.value, attempts + 1, available_at, "lease expired", now, shard),
+            )
+        if rows:
+            self.logger.warning(f"Reclaimed {len(rows)} shard(s) with expired leases")
+        return len(rows)
+
+    def _update_owned(self, lease: Lease, assignments: str, params: tuple) -> bool:
+        # Every reclaim or failure bumps ``attempts``, so it tells a stale lease apart from a
+        # later one the same worker id holds on the same shard.
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE shards SET {assignments} WHERE shard = ? AND worker_id = ? AND state = ? AND attempts = ?",
+                (*params, lease.shard, lease.worker_id, ShardState.IN_PROGRESS.value, lease.attempts),
+            )
+        return cursor.rowcount == 1
+
+
+class LeasedShardSource:
+    """Shard source for one pipeline that leases its shards from a ``ShardOrchestrator``.
+
+    Reader threads call ``next_shard``, which leases the next shard, or waits
+    while other workers hold leases that may still be reclaimed. A lease is
+    completed once its shard is committed to ``manifest_path`` (or is in
+    ``committed``, shards an earlier run wrote elsewhere) and failed as soon
+    as the reader reports an error; ``close`` fails the leases the
+    pipeline left uncommitted. One thread heartbeats every outstanding lease.
+    """
+
+    def __init__(
+        self,
+        orchestrator: ShardOrchestrator,
+        worker_id: str,
+        manifest_path: str,
+        heartbeat_s: float = 30.0,
+        poll_s: float = 1.0,
+        committed: Optional[Set[str]] = None,
+    ):
+        self.orchestrator = orchestrator
+        self.worker_id = worker_id
+        self.manifest_path = manifest_path
+        self.heartbeat_s = heartbeat_s
+        self.poll_s = poll_s
+        self.committed = set(committed or ())
+        self.completed = 0
+        self.logger = get_logger()
+        self._leases: Dict[str, Lease] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._beat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._beat.start()
+
+    def next_shard(self) -> Optional[str]:
+        while not self._stop.is_set():
+            with self._lock:
+                done = self._settle()
+                lease = self.orchestrator.acquire(self.worker_id)
+                if lease is not None:
+                    self._leases[lease.shard] = lease
+                    if lease.shard not in done:
+                        return lease.shard
+                    # Committed by an earlier run that died before completing the lease.
+                    self._settle(done)
+                    continue
+                counts = self.orchestrator.counts()
+                # Leases held here only wait for this pipeline to commit them.
+                if counts[ShardState.PENDING.value] == 0 and counts[ShardState.IN_PROGRESS.value] <= len(self._leases):
+                    return None
+            self._stop.wait(self.poll_s)
+        return None
+
+    def shard_read(self, shard: str, error: Optional[str] = None) -> None:
+        if error is None:
+            return
+        with self._lock:
+            lease = self._leases.pop(shard, None)
+            if lease is not None:
+                state = self.orchestrator.fail(lease, error)
+                self.logger.error(f"Shard {shard} failed ({state.value if state else 'lease lost'}): {error}")
+
+    def close(self) -> None:
+        """Complete committed leases and fail the rest; call once the pipeline has finished."""
+        self._stop.set()
+        self._beat.join()
+        with self._lock:
+            self._settle()
+            for lease in self._leases.values():
+                state = self.orchestrator.fail(lease, "not committed")
+                self.logger.error(f"Shard {lease.shard} was not committed ({state.value if state else 'lease lost'})")
+            self._leases.clear()
+
+    def _settle(self, done: Optional[Set[str]] = None) -> Set[str]:
+        # Caller holds ``_lock``.
+        if done is None:
+            done = completed_shards(self.manifest_path) | self.committed
+        for shard in [shard for shard in self._leases if shard in done]:
+            if self.orchestrator.complete(self._leases.pop(shard)):
+                self.completed += 1
+            else:
+                self.logger.warning(f"Lease on {shard} was reclaimed before completion")
+        return done
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stop.wait(self.heartbeat_s):
+            with self._lock:
+                self._settle()
+                for shard, lease in list(self._leases.items()):
+                    if not self.orchestrator.heartbeat(lease):
+                        self.logger.warning(f"Lost lease on {shard}")
+                        del self._leases[shard]
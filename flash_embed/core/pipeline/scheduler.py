@@ -1,51 +1,113 @@
-import enum
+import json
 import time
-from dataclasses import dataclass, field
-from typing import Dict, Optional
+from typing import IO, Dict, Iterable, List, Optional
 
+FAILED_NAME = "failed.jsonl"
 
-class TaskState(str, enum.Enum):
-    PENDING = "pending"
-    IN_PROGRESS = "in_progress"
-    RETRY = "retry"
-    FAILED = "failed"
-    DONE = "done"
 
+class ShardProgress:
+    """Per-shard counters; a shard is ready once sealed and fully accounted for."""
 
-@dataclass
-class Task:
-    uid: str
-    state: TaskState = TaskState.PENDING
-    retries: int = 0
-    last_error: Optional[str] = None
-    started_at: float = field(default_factory=time.time)
-    ended_at: Optional[float] = None
+    __slots__ = ("shard", "started", "done", "failed", "sealed", "finalized", "error")
+
+    def __init__(self, shard: str):
+        self.shard = shard
+        self.started = 0
+        self.done = 0
+        self.failed = 0
+        self.sealed = False
+        self.finalized = False
+        self.error: Optional[str] = None  # set when the reader could not read the whole shard
+
+    @property
+    def in_flight(self) -> int:
+        return self.started - self.done - self.failed
+
+    @property
+    def ready(self) -> bool:
+        return self.sealed and not self.finalized and self.done + self.failed >= self.started
+
+    def __repr__(self) -> str:
+        return (
+            f"ShardProgress(shard={self.shard!r}, started={self.started}, done={self.done}, "
+            f"failed={self.failed}, sealed={self.sealed}, finalized={self.finalized})"
+        )
 
 
 class Scheduler:
-    """Task tracker for pipeline visibility and retries."""
-
-    def __init__(self):
-        self.tasks: Dict[str, Task] = {}
-
-    def start(self, uid: str) -> Task:
-        task = self.tasks.get(uid, Task(uid=uid))
-        task.state = TaskState.IN_PROGRESS
-        task.started_at = time.time()
-        self.tasks[uid] = task
-        return task
-
-    def complete(self, uid: str) -> Task:
-        task = self.tasks[uid]
-        task.state = TaskState.DONE
-        task.ended_at = time.time()
-        return task
-
-    def fail(self, uid: str, error: str, retry: bool = False) -> Task:
-        task = self.tasks.get(uid, Task(uid=uid))
-        task.state = TaskState.RETRY if retry else TaskState.FAILED
-        task.retries += 1 if retry else task.retries
-        task.last_error = error
-        task.ended_at = time.time()
-        self.tasks[uid] = task
-        return task
+    """Shard-level accounting for pipeline visibility and shard completion.
+
+    Samples are only counted, never stored, so memory depends on the number
+    of open shards rather than on how many images a run processes. Finalized
+    shards are dropped. Uids of failed samples are appended to ``failed_path``
+    (JSON lines) when given, so they can be inspected or retried later.
+    """
+
+    def __init__(self, failed_path: Optional[str] = None):
+        self.shards: Dict[str, ShardProgress] = {}
+        self.failed_path = failed_path
+        self.finalized = 0
+        self.totals = {"started": 0, "done": 0, "failed": 0}
+        self._failed_file: Optional[IO[str]] = None
+
+    def start(self, uid: str, shard: str = "") -> None:
+        self._progress(shard).started += 1
+        self.totals["started"] += 1
+
+    def complete(self, uid: str, shard: str = "") -> None:
+        self._progress(shard).done += 1
+        self.totals["done"] += 1
+
+    def fail(self, uid: str, error: str, shard: str = "") -> None:
+        progress = self._progress(shard)
+        progress.failed += 1
+        self.totals["failed"] += 1
+        if self.failed_path:
+            if self._failed_file is None:
+                self._failed_file = open(self.failed_path, "a", buffering=1)
+            record = {"shard": shard, "uid": uid, "error": error, "time": round(time.time(), 3)}
+            self._failed_file.write(json.dumps(record) + "\n")
+
+    def seal(self, shard: str, error: Optional[str] = None) -> None:
+        """Mark that the reader has emitted every sample of ``shard`` (or gave up with ``error``)."""
+        progress = self._progress(shard)
+        progress.sealed = True
+        progress.error = error
+
+    def seal_all(self) -> None:
+        for progress in self.shards.values():
+            progress.sealed = True
+
+    def ready_shards(self) -> List[ShardProgress]:
+        return [progress for progress in self.shards.values() if progress.ready]
+
+    def mark_finalized(self, shard: str) -> None:
+        progress = self.shards.pop(shard, None)
+        if progress is not None:
+            progress.finalized = True
+            self.finalized += 1
+
+    def close(self) -> None:
+        if self._failed_file is not None:
+            self._failed_file.close()
+            self._failed_file = None
+
+    def _progress(self, shard: str) -> ShardProgress:
+        progress = self.shards.get(shard)
+        if progress is None:
+            progress = self.shards[shard] = ShardProgress(shard)
+        return progress
+
+
+def load_failures(paths: Iterable[str]) -> Dict[str, List[str]]:
+    """Uids of failed samples by shard, from ``failed.jsonl`` files written by ``Scheduler``."""
+    failures: Dict[str, Dict[str, None]] = {}
+    for path in paths:
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn final line
+                failures.setdefault(record["shard"], {})[record["uid"]] = None
+    return {shard: list(uids) for shard, uids in failures.items()}
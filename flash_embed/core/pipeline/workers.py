@@ -1,57 +1,191 @@
 import asyncio
+import time
 from concurrent.futures import ThreadPoolExecutor
-from typing import Optional
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
 
 from flash_embed.config import Config
 from flash_embed.core.io.decoder import Decoder
 from flash_embed.core.io.dali_decoder import DaliDecoder
-from flash_embed.core.io.reader import Reader, Sample, WebDatasetReader, PrefetchReader
+from flash_embed.core.io.downloader import ShardStager, load_checksums
+from flash_embed.core.io.process_decoder import ProcessDecoder
+from flash_embed.core.io.reader import (
+    ParallelShardReader,
+    PrefetchReader,
+    Reader,
+    Sample,
+    ShardDone,
+    ShardSource,
+    TextShardReader,
+    WebDatasetReader,
+)
 from flash_embed.core.models import resolve, ModelRunner
-from flash_embed.core.pipeline.batcher import DynamicBatcher
-from flash_embed.core.pipeline.scheduler import Scheduler
+from flash_embed.core.pipeline.batcher import AdaptiveBatcher, Batch, DynamicBatcher, LengthBucketBatcher
+from flash_embed.core.pipeline.cache import CaptionCache, EmbeddingCache, content_digest
+from flash_embed.core.pipeline.dedup import NearDuplicateFilter, write_duplicates
+from flash_embed.core.pipeline.scheduler import FAILED_NAME, Scheduler
 from flash_embed.core.telemetry.logging import get_logger
-from flash_embed.core.telemetry.metrics import Metrics
-from flash_embed.core.writer import Writer
+from flash_embed.core.telemetry.metrics import Metrics, MetricsServer
+from flash_embed.core.writer import MANIFEST_NAME, Writer
+from flash_embed.core.writer.postprocess import Postprocessor, to_numpy
+from flash_embed.core.writer.writer import shard_stem
+
+
+def build_stager(config: Config) -> Optional[ShardStager]:
+    """The shard stager ``io.stage_dir`` asks for, or None to read shards in place."""
+    io = config.io
+    if not io.stage_dir:
+        return None
+    return ShardStager(
+        io.stage_dir,
+        max_bytes=int(io.stage_cache_gb * (1 << 30)),
+        read_ahead=io.stage_read_ahead,
+        max_retries=config.retry.max_retries,
+        backoff_ms=config.retry.backoff_ms,
+        checksums=load_checksums(io.stage_checksums) if io.stage_checksums else None,
+    )
+
+
+@dataclass
+class _CacheHit:
+    sample: Sample
+    outputs: Dict[str, np.ndarray]
 
 
 class AsyncPipeline:
     """Async orchestrator: ingest -> decode -> batch -> infer -> write."""
 
-    def __init__(self, config: Config, reader: Optional[Reader] = None):
+    def __init__(self, config: Config, reader: Optional[Reader] = None, source: Optional[ShardSource] = None):
         self.config = config
         self.logger = get_logger()
         self.metrics = Metrics()
 
-        backend_cls = resolve(config.model.backend)
-        self.model_runner: ModelRunner = backend_cls(
-            model_name=config.model.name,
-            device=config.model.device,
-            max_batch=config.model.max_batch,
-            model_path=config.model.path,
-            triton_url=config.model.triton_url,
-            triton_version=config.model.triton_version,
-        )
+        # Each infer loop owns a runner: most backends are not safe to call from several threads.
+        self.model_runners: List[ModelRunner] = [
+            self._build_runner() for _ in range(max(1, config.workers.infer_workers))
+        ]
+        self.model_runner = self.model_runners[0]
 
-        base_reader: Reader = reader or WebDatasetReader(
-            shards=config.io.data_paths,
-            decode=config.io.decode,
-            shuffle=config.io.shuffle,
-        )
-        self.reader: Reader = PrefetchReader(base_reader, max_prefetch=config.io.prefetch)
+        if config.io.mode not in {"image", "text"}:
+            raise ValueError(f"Unsupported pipeline mode: {config.io.mode}")
+        self.text_mode = config.io.mode == "text"
 
-        if config.io.decode_backend == "dali":
-            device_id = 0 if config.model.device.startswith("cuda") else -1
-            self.decoder = DaliDecoder(device_id=device_id, decode_device=config.io.decode_device)
+        manifest_path = str(Path(config.output.out_dir) / MANIFEST_NAME)
+        if reader is None and self.text_mode:
+            self.reader: Reader = TextShardReader(
+                shards=config.io.data_paths,
+                num_readers=config.workers.reader_threads,
+                shuffle=config.io.shuffle,
+                manifest_path=manifest_path,
+                prefetch_bytes=config.io.prefetch_mb << 20,
+                stager=build_stager(config),
+                build_index=config.io.shard_index,
+                index_dir=config.io.shard_index_dir,
+                source=source,
+            )
+        elif reader is None and (
+            source is not None or config.workers.reader_threads > 1 or config.io.stage_dir or config.io.shard_index
+        ):
+            # Already prefetches on its own threads, bounded in bytes; the only reader that takes a shard source.
+            self.reader = ParallelShardReader(
+                shards=config.io.data_paths,
+                num_readers=config.workers.reader_threads,
+                decode=config.io.decode,
+                shuffle=config.io.shuffle,
+                manifest_path=manifest_path,
+                prefetch_bytes=config.io.prefetch_mb << 20,
+                stager=build_stager(config),
+                build_index=config.io.shard_index,
+                index_dir=config.io.shard_index_dir,
+                source=source,
+            )
         else:
-            self.decoder = Decoder()
+            base_reader: Reader = reader or WebDatasetReader(
+                shards=config.io.data_paths,
+                decode=config.io.decode,
+                shuffle=config.io.shuffle,
+                manifest_path=manifest_path,
+            )
+            self.reader = PrefetchReader(base_reader, max_prefetch=config.io.prefetch)
 
-        self.batcher = DynamicBatcher(
-            max_size=config.batch.size,
-            max_delay_s=config.batch.max_delay_ms / 1000.0,
-        )
+        # Text mode tokenizes in the decode stage when the backend can take token ids.
+        self.tokenize = getattr(self.model_runner, "tokenize", None) if self.text_mode else None
+        self.decoder = self._build_decoder()
 
-        self.scheduler = Scheduler()
-        self.writer = Writer(config.output.out_dir, fmt=config.output.format)
+        max_delay_s = config.batch.max_delay_ms / 1000.0
+        if self.text_mode:
+            self.batcher: DynamicBatcher = LengthBucketBatcher(
+                max_size=min(config.batch.size, self.model_runner.max_batch_size()),
+                max_delay_s=max_delay_s,
+                bucket_width=config.batch.length_bucket_width,
+            )
+        elif config.batch.mode == "adaptive":
+            self.batcher = AdaptiveBatcher(
+                max_size=min(config.batch.size, self.model_runner.max_batch_size()),
+                max_delay_s=max_delay_s,
+                buckets=config.model.batch_buckets,
+                target=config.batch.target,
+                latency_target_s=config.batch.latency_target_ms / 1000.0,
+            )
+        elif config.batch.mode == "fixed":
+            self.batcher = DynamicBatcher(max_size=config.batch.size, max_delay_s=max_delay_s)
+        else:
+            raise ValueError(f"Unsupported batch mode: {config.batch.mode}")
+
+        self.cache: Optional[EmbeddingCache] = None
+        if config.cache.path:
+            model = config.model
+            key = (
+                f"{model.backend}:{model.name}:{model.path or ''}:{model.image_size}:{model.precision}:"
+                f"{config.cache.model_version}"
+            )
+            self.cache = EmbeddingCache(config.cache.path, key)
+        # Content digests of cache misses in flight, filled in after inference.
+        self._digests: Dict[Tuple[str, str], bytes] = {}
+        self._hits: List[_CacheHit] = []
+        self.captions: Optional[CaptionCache] = None
+        if self.text_mode and config.cache.caption_items > 0:
+            self.captions = CaptionCache(config.cache.caption_items)
+
+        self.dedup: Optional[NearDuplicateFilter] = None
+        if config.dedup.threshold is not None:
+            if config.dedup.action not in {"drop", "flag"}:
+                raise ValueError(f"Unsupported dedup action: {config.dedup.action}")
+            self.dedup = NearDuplicateFilter(
+                config.dedup.threshold, window=config.dedup.window, backend=config.dedup.backend
+            )
+        # Duplicates map rows per shard, written next to the shard's outputs on commit.
+        self._duplicates: Dict[str, List[Dict[str, Any]]] = {}
+
+        self.scheduler = Scheduler(failed_path=str(Path(config.output.out_dir) / FAILED_NAME))
+        post = config.postprocess
+        self.postprocess: Optional[Postprocessor] = None
+        if post.normalize or post.reduce or post.quantize:
+            self.postprocess = Postprocessor(
+                normalize=post.normalize,
+                reduce=post.reduce,
+                dim=post.dim,
+                quantize=post.quantize,
+                projection_path=post.projection_path or str(Path(config.output.out_dir) / "projection.npz"),
+                fit_samples=post.fit_samples,
+                seed=post.seed,
+            )
+        # Batches held back until the PCA projection is fitted on their rows.
+        self._prefit: List[Tuple[Batch, Dict[str, Any]]] = []
+        self.writer = Writer(
+            config.output.out_dir,
+            fmt=config.output.format,
+            store_text=config.output.store_text,
+            store_meta=config.output.store_meta,
+            row_group_size=config.output.row_group_size,
+            dtype="float16" if post.quantize == "float16" else config.output.dtype,
+            store_rows=config.output.store_rows,
+            store_chunk_rows=config.output.store_chunk_rows,
+            postprocess=self.postprocess.describe() if self.postprocess else None,
+        )
 
         cap = config.queues.capacity
         self.raw_q: asyncio.Queue[Optional[Sample]] = asyncio.Queue(maxsize=cap)
@@ -60,11 +194,84 @@ class AsyncPipeline:
         self.output_q: asyncio.Queue = asyncio.Queue(maxsize=cap)
 
         self.decode_workers = max(1, config.workers.decode_workers)
+        # Batch decoders (DALI) decode whole batches in the batch stage instead of per sample.
+        self.decode_batch = getattr(self.decoder, "decode_batch", None) if self.decoder is not None else None
 
         self.decode_executor = ThreadPoolExecutor(max_workers=self.decode_workers)
         self.infer_executor = ThreadPoolExecutor(max_workers=config.workers.infer_workers)
         self.writer_executor = ThreadPoolExecutor(max_workers=1)
 
+        # Stage functions wrapped so each call is timed in the thread that runs it.
+        # next() with a default: StopIteration cannot cross a Future, so exhaustion comes back as None.
+        self._next = self.metrics.timed("read", lambda iterator: next(iterator, None))
+        if self.text_mode:
+            self._decode = self.metrics.timed("tokenize", self._tokenize)
+        else:
+            self._decode = self.metrics.timed("decode", self.decoder.decode)
+        if self.decode_batch is not None:
+            self.decode_batch = self.metrics.timed("decode", self.decode_batch)
+        self._write_batch = self.metrics.timed("write", self.writer.write_batch)
+        self._commit_shard = self.metrics.timed("commit", self.writer.commit_shard)
+        self._batch_started: Optional[float] = None
+        self._next_seq = 0
+        self._closed = False
+
+        telemetry = config.telemetry
+        self.metrics_server: Optional[MetricsServer] = None
+        if telemetry.metrics_port is not None:
+            self.metrics_server = MetricsServer(self.metrics, host=telemetry.metrics_host, port=telemetry.metrics_port)
+            self.logger.info(f"Serving metrics on http://{telemetry.metrics_host}:{self.metrics_server.port}/metrics")
+
+    def _build_decoder(self) -> Any:
+        config = self.config
+        if self.text_mode:
+            return None
+        if config.io.decode_backend == "dali":
+            device_id = 0 if config.model.device.startswith("cuda") else -1
+            return DaliDecoder(
+                device_id=device_id,
+                decode_device=config.io.decode_device,
+                batch_size=config.batch.size,
+                num_threads=config.workers.decode_workers,
+                resize=config.model.image_size,
+                crop=config.model.image_size,
+                output=config.io.decode_output,
+            )
+        if config.io.decode_backend == "process":
+            return ProcessDecoder(
+                num_workers=config.workers.decode_workers,
+                slot_bytes=config.io.decode_slot_mb << 20,
+                draft_size=config.model.image_size,
+                timeout_s=config.io.decode_timeout_s,
+            )
+        return Decoder(draft_size=config.model.image_size)
+
+    def _build_runner(self) -> ModelRunner:
+        model = self.config.model
+        backend_cls = resolve(model.backend)
+        return backend_cls(
+            model_name=model.name,
+            device=model.device,
+            max_batch=model.max_batch,
+            model_path=model.path,
+            triton_url=model.triton_url,
+            triton_version=model.triton_version,
+            image_size=model.image_size,
+            image_mean=model.image_mean,
+            image_std=model.image_std,
+            intra_op_threads=model.intra_op_threads,
+            inter_op_threads=model.inter_op_threads,
+            cache_dir=model.cache_dir,
+            batch_buckets=model.batch_buckets,
+            transfer_slots=model.transfer_slots,
+            compile=model.compile,
+            compile_mode=model.compile_mode,
+            channels_last=model.channels_last,
+            precision=model.precision,
+            inference_mode=model.inference_mode,
+            eager_tolerance=model.eager_tolerance,
+        )
+
     async def run(self) -> None:
         tasks = []
 
@@ -74,26 +281,55 @@ class AsyncPipeline:
             tasks.append(asyncio.create_task(self._decode_loop()))
 
         tasks.append(asyncio.create_task(self._batch_loop()))
-        tasks.append(asyncio.create_task(self._infer_loop()))
+        for runner in self.model_runners:
+            tasks.append(asyncio.create_task(self._infer_loop(runner)))
         tasks.append(asyncio.create_task(self._write_loop()))
 
+        sampler = asyncio.create_task(self._sample_loop())
         try:
             await asyncio.gather(*tasks)
         finally:
+            sampler.cancel()
             self.close()
 
+    async def _sample_loop(self) -> None:
+        """Periodically record queue occupancy and throughput gauges."""
+        interval = self.config.telemetry.sample_interval_s
+        queues = {"raw": self.raw_q, "decoded": self.decoded_q, "batch": self.batch_q, "output": self.output_q}
+        last = time.monotonic()
+        last_images = last_bytes = 0.0
+        while True:
+            await asyncio.sleep(interval)
+            for name, queue in queues.items():
+                depth = queue.qsize()
+                self.metrics.observe("queue_occupancy", depth, {"queue": name}, scale=1.0)
+                self.metrics.set_gauge("queue_depth", depth, {"queue": name})
+            now = time.monotonic()
+            images, nbytes = self.metrics.counter("images_written"), self.metrics.counter("bytes_read")
+            self.metrics.set_gauge("images_per_second", (images - last_images) / (now - last))
+            self.metrics.set_gauge("bytes_per_second", (nbytes - last_bytes) / (now - last))
+            last, last_images, last_bytes = now, images, nbytes
+
     async def _read_loop(self) -> None:
         iterator = iter(self.reader)
         while True:
             try:
-                sample = await asyncio.to_thread(next, iterator)
-            except StopIteration:
-                break
+                item = await asyncio.to_thread(self._next, iterator)
             except Exception as exc:
                 self.logger.error(f"Read failed: {exc}")
                 break
-            self.scheduler.start(sample.uid)
-            await self.raw_q.put(sample)
+            if item is None:
+                # Readers that don't report shard boundaries are sealed at the end.
+                self.scheduler.seal_all()
+                break
+            if isinstance(item, ShardDone):
+                self.scheduler.seal(item.shard, item.error)
+                continue
+            self.scheduler.start(item.uid, item.meta.get("shard", ""))
+            self.metrics.inc("samples_read")
+            if isinstance(item.image, (bytes, bytearray, memoryview)):
+                self.metrics.inc("bytes_read", len(item.image))
+            await self.raw_q.put(item)
 
         for _ in range(self.decode_workers):
             await self.raw_q.put(None)
@@ -106,54 +342,179 @@ class AsyncPipeline:
                 if sample is None:
                     await self.decoded_q.put(None)
                     return
+                if self.captions is not None:
+                    outputs = self.captions.get(sample.text or "")
+                    self.metrics.inc("caption_cache_hits" if outputs is not None else "caption_cache_misses")
+                    if outputs is not None:
+                        await self.decoded_q.put(_CacheHit(sample, outputs))
+                        continue
+                if self.cache is not None:
+                    outputs = await loop.run_in_executor(self.decode_executor, self._lookup, sample)
+                    if outputs is not None:
+                        await self.decoded_q.put(_CacheHit(sample, outputs))
+                        continue
+                if self.decode_batch is not None:
+                    await self.decoded_q.put(sample)
+                    continue
                 try:
-                    decoded = await loop.run_in_executor(
-                        self.decode_executor, self.decoder.decode, sample
-                    )
+                    decoded = await loop.run_in_executor(self.decode_executor, self._decode, sample)
                     await self.decoded_q.put(decoded)
                 except Exception as exc:
                     self.logger.error(f"Decode failed: {exc}")
-                    self.scheduler.fail(sample.uid, str(exc), retry=False)
+                    self._digests.pop(_sample_key(sample), None)
+                    self.scheduler.fail(sample.uid, str(exc), shard=sample.meta.get("shard", ""))
             finally:
                 self.raw_q.task_done()
 
+    def _tokenize(self, sample: Sample) -> Sample:
+        if self.tokenize is not None:
+            sample.tokens = self.tokenize([sample.text or ""])[0]
+        return sample
+
+    def _lookup(self, sample: Sample) -> Optional[Dict[str, np.ndarray]]:
+        """Cached embeddings for ``sample``; on a miss remember its digest for the fill after inference."""
+        digest = content_digest(sample.image, sample.text)
+        if digest is None:
+            return None
+        try:
+            outputs = self.cache.get(digest)
+        except Exception as exc:
+            self.logger.warning(f"Embedding cache lookup failed: {exc}")
+            outputs = None
+        if outputs is None:
+            self.metrics.inc("cache_misses")
+            self._digests[_sample_key(sample)] = digest
+            return None
+        self.metrics.inc("cache_hits")
+        return outputs
+
     async def _batch_loop(self) -> None:
         completed_decoders = 0
         while True:
-            sample = await self.decoded_q.get()
+            timeout = self.batcher.timeout()
+            if timeout is None and self._hits:
+                timeout = self.batcher.max_delay_s
+            try:
+                sample = await asyncio.wait_for(self.decoded_q.get(), timeout)
+            except asyncio.TimeoutError:
+                # The deadline passed with no new sample: ship the partial batch now.
+                batch = self.batcher.flush()
+                if batch:
+                    await self._emit_batch(batch)
+                await self._emit_hits()
+                continue
             try:
                 if sample is None:
                     completed_decoders += 1
                     if completed_decoders == self.decode_workers:
+                        # Bucketing batchers may hold several partial batches.
                         batch = self.batcher.flush()
-                        if batch:
-                            await self.batch_q.put(batch)
-                        await self.batch_q.put(None)
+                        while batch:
+                            await self._emit_batch(batch)
+                            batch = self.batcher.flush()
+                        await self._emit_hits()
+                        for _ in self.model_runners:
+                            await self.batch_q.put(None)
                         break
                     continue
+                if isinstance(sample, _CacheHit):
+                    if self._hits and self._hits[0].outputs.keys() != sample.outputs.keys():
+                        await self._emit_hits()
+                    self._hits.append(sample)
+                    if len(self._hits) >= self.batcher.max_size:
+                        await self._emit_hits()
+                    continue
 
+                if self._batch_started is None:
+                    self._batch_started = time.perf_counter()
                 maybe_batch = self.batcher.add(sample)
                 if maybe_batch:
-                    await self.batch_q.put(maybe_batch)
+                    await self._emit_batch(maybe_batch)
             finally:
                 self.decoded_q.task_done()
 
-    async def _infer_loop(self) -> None:
+    async def _emit_batch(self, batch: Batch) -> None:
+        if self._batch_started is not None:
+            self.metrics.observe("stage_seconds", time.perf_counter() - self._batch_started, {"stage": "batch"})
+            self._batch_started = None
+        self.metrics.observe("batch_size", len(batch.samples), scale=1.0)
+        if self.decode_batch is not None:
+            loop = asyncio.get_running_loop()
+            try:
+                batch.samples = await loop.run_in_executor(self.decode_executor, self.decode_batch, batch.samples)
+            except Exception as exc:
+                # One bad image fails the whole run; redo per sample to isolate it.
+                self.logger.warning(f"Batch decode failed ({exc}); retrying per sample")
+                decoded = []
+                for sample in batch.samples:
+                    try:
+                        decoded.append(await loop.run_in_executor(self.decode_executor, self._decode, sample))
+                    except Exception as sample_exc:
+                        self.logger.error(f"Decode failed: {sample_exc}")
+                        self._digests.pop(_sample_key(sample), None)
+                        self.scheduler.fail(sample.uid, str(sample_exc), shard=sample.meta.get("shard", ""))
+                batch.samples = decoded
+            if not batch.samples:
+                return
+        # Infer loops may finish out of order; the write loop restores this order.
+        batch.seq = self._next_seq
+        self._next_seq += 1
+        await self.batch_q.put(batch)
+
+    async def _emit_hits(self) -> None:
+        if not self._hits:
+            return
+        hits, self._hits = self._hits, []
+        outputs = {kind: np.stack([hit.outputs[kind] for hit in hits]) for kind in hits[0].outputs}
+        batch = Batch(samples=[hit.sample for hit in hits], seq=self._next_seq, outputs=outputs)
+        self._next_seq += 1
+        await self.batch_q.put(batch)
+
+    async def _infer_loop(self, runner: ModelRunner) -> None:
         loop = asyncio.get_running_loop()
-        await loop.run_in_executor(self.infer_executor, self.model_runner.warmup)
+        await loop.run_in_executor(self.infer_executor, runner.warmup)
 
-        encode_async = getattr(self.model_runner, "encode_async", None)
+        encode = self.metrics.timed("infer", runner.encode)
+        encode_async = getattr(runner, "encode_async", None)
+        encode_tokens = getattr(runner, "encode_tokens", None)
+        if callable(encode_tokens):
+            encode_tokens = self.metrics.timed("infer", encode_tokens)
+        # Async backends keep several batches in flight (Triton requests, torch transfer slots);
+        # sync runners run one batch at a time.
+        runner_inflight = getattr(runner, "max_inflight", None)
+        inflight = max(self.config.workers.max_inflight, runner_inflight() if callable(runner_inflight) else 1)
+        window = asyncio.Semaphore(max(1, inflight) if callable(encode_async) else 1)
+        pending: Set[asyncio.Task] = set()
 
         while True:
             batch = await self.batch_q.get()
             try:
                 if batch is None:
-                    await self.output_q.put(None)
                     break
+                if batch.outputs is not None:
+                    await self.output_q.put((batch, batch.outputs))
+                    continue
+                await window.acquire()
+                task = asyncio.create_task(self._infer_batch(batch, encode, encode_async, encode_tokens))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                task.add_done_callback(lambda _: window.release())
+            finally:
+                self.batch_q.task_done()
 
-                images = [s.image for s in batch.samples]
-                texts_raw = [s.text for s in batch.samples]
+        if pending:
+            await asyncio.gather(*pending)
+        await self.output_q.put(None)
 
+    async def _infer_batch(
+        self, batch: Batch, encode: Callable[..., Any], encode_async: Any, encode_tokens: Any
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        outputs = None
+        try:
+            try:
+                images = None if self.text_mode else [s.image for s in batch.samples]
+                texts_raw = [s.text for s in batch.samples]
                 if all(t is None for t in texts_raw):
                     texts = None
                 elif all(t is not None for t in texts_raw):
@@ -162,45 +523,216 @@ class AsyncPipeline:
                     self.logger.warning("Mixed presence of text in batch; filling missing as empty.")
                     texts = [t or "" for t in texts_raw]
 
-                try:
-                    if callable(encode_async):
+                started = time.perf_counter()
+                if callable(encode_tokens) and batch.samples[0].tokens is not None:
+                    tokens = [s.tokens for s in batch.samples]
+                    outputs = await loop.run_in_executor(self.infer_executor, encode_tokens, tokens)
+                elif callable(encode_async):
+                    with self.metrics.time("infer"):
                         outputs = await encode_async(images=images, texts=texts)
-                    else:
-                        outputs = await loop.run_in_executor(
-                            self.infer_executor, self.model_runner.encode, images, texts
-                        )
-                    self.metrics.inc("batches_inferred")
-                    for s in batch.samples:
-                        self.scheduler.complete(s.uid)
-                    await self.output_q.put(outputs)
+                else:
+                    outputs = await loop.run_in_executor(self.infer_executor, encode, images, texts)
+                self.batcher.record(len(batch.samples), time.perf_counter() - started)
+                self.metrics.inc("batches_inferred")
+                self.metrics.inc("images_inferred", len(batch.samples))
+            except Exception as exc:
+                self.logger.error(f"Inference failed: {exc}")
+                outputs = None
+                for s in batch.samples:
+                    self.scheduler.fail(s.uid, str(exc), shard=s.meta.get("shard", ""))
+            if self.captions is not None and outputs is not None:
+                try:
+                    self.captions.put_many([s.text for s in batch.samples], outputs)
                 except Exception as exc:
-                    self.logger.error(f"Inference failed: {exc}")
-                    for s in batch.samples:
-                        self.scheduler.fail(s.uid, str(exc), retry=False)
-            finally:
-                self.batch_q.task_done()
+                    self.logger.warning(f"Could not fill caption cache: {exc}")
+            if self.cache is not None:
+                digests = [self._digests.pop(_sample_key(s), None) for s in batch.samples]
+                if outputs is not None:
+                    try:
+                        await loop.run_in_executor(
+                            self.writer_executor, self.cache.put_many, digests, outputs, range(len(digests))
+                        )
+                    except Exception as exc:
+                        self.logger.warning(f"Could not fill embedding cache: {exc}")
+        finally:
+            # Failed batches still pass through (without outputs) so the writer's sequence has no gaps.
+            await self.output_q.put((batch, outputs))
 
     async def _write_loop(self) -> None:
-        loop = asyncio.get_running_loop()
+        held: Dict[int, Tuple[Batch, Optional[Dict[str, Any]]]] = {}
+        expected = 0
+        finished = 0
         while True:
-            outputs = await self.output_q.get()
+            item = await self.output_q.get()
             try:
-                if outputs is None:
-                    break
-                try:
-                    await loop.run_in_executor(
-                        self.writer_executor, self.writer.write_batch, outputs
-                    )
-                    self.metrics.inc("batches_written")
-                except Exception as exc:
-                    self.logger.error(f"Write failed: {exc}")
+                if item is None:
+                    finished += 1
+                    if finished == len(self.model_runners):
+                        break
+                    continue
+                held[item[0].seq] = item
+                # Write in batch order, holding results that overtook an earlier batch.
+                while expected in held:
+                    await self._write(*held.pop(expected))
+                    expected += 1
+                await self._commit_ready_shards()
             finally:
                 self.output_q.task_done()
+        for seq in sorted(held):
+            await self._write(*held.pop(seq))
+        if self._prefit:
+            # Fewer rows than fit_samples in the whole run: fit on what there is.
+            await self._fit_postprocess()
+        await self._commit_ready_shards()
+
+    async def _write(self, batch: Batch, outputs: Optional[Dict[str, Any]]) -> None:
+        if outputs is None:
+            return
+        loop = asyncio.get_running_loop()
+        if self.dedup is not None and self.config.dedup.kind in outputs:
+            try:
+                batch, outputs, dropped = await loop.run_in_executor(
+                    self.writer_executor, self._dedup_batch, batch, outputs
+                )
+            except Exception as exc:
+                self.logger.warning(f"Dedup failed, writing batch unfiltered: {exc}")
+                dropped = []
+            # Dropped rows are done: the shard must still complete without them.
+            for s in dropped:
+                self.scheduler.complete(s.uid, s.meta.get("shard", ""))
+            if not batch.samples:
+                return
+        await self._postprocess_and_store(batch, outputs)
+
+    async def _postprocess_and_store(self, batch: Batch, outputs: Dict[str, Any]) -> None:
+        loop = asyncio.get_running_loop()
+        if self.postprocess is not None:
+            if self.postprocess.needs_fit:
+                self._prefit.append((batch, outputs))
+                if sum(len(b.samples) for b, _ in self._prefit) >= self.postprocess.fit_samples:
+                    await self._fit_postprocess()
+                return
+            try:
+                outputs = await loop.run_in_executor(self.writer_executor, self.postprocess, outputs)
+            except Exception as exc:
+                self.logger.error(f"Postprocess failed: {exc}")
+                for s in batch.samples:
+                    self.scheduler.fail(s.uid, str(exc), shard=s.meta.get("shard", ""))
+                return
+        await self._store(batch, outputs)
+
+    async def _fit_postprocess(self) -> None:
+        held, self._prefit = self._prefit, []
+        # One projection for every kind keeps image and text vectors in the same space.
+        sample = np.concatenate([to_numpy(array) for _, outputs in held for array in outputs.values()])
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.writer_executor, self.postprocess.fit, sample)
+        except Exception as exc:
+            self.logger.error(f"Fitting the {self.postprocess.reduce} projection failed: {exc}")
+            for batch, _ in held:
+                for s in batch.samples:
+                    self.scheduler.fail(s.uid, str(exc), shard=s.meta.get("shard", ""))
+            return
+        self.logger.info(f"Fitted {self.postprocess.reduce} projection on {len(sample)} rows")
+        for batch, outputs in held:
+            await self._postprocess_and_store(batch, outputs)
+
+    async def _store(self, batch: Batch, outputs: Dict[str, Any]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.writer_executor, self._write_batch, outputs, batch.samples)
+            self.metrics.inc("batches_written")
+            self.metrics.inc("images_written", len(batch.samples))
+            for s in batch.samples:
+                self.scheduler.complete(s.uid, s.meta.get("shard", ""))
+        except Exception as exc:
+            self.logger.error(f"Write failed: {exc}")
+            for s in batch.samples:
+                self.scheduler.fail(s.uid, str(exc), shard=s.meta.get("shard", ""))
+
+    def _dedup_batch(
+        self, batch: Batch, outputs: Dict[str, Any]
+    ) -> Tuple[Batch, Dict[str, Any], List[Sample]]:
+        """Record near-duplicates in ``batch`` and, in drop mode, split their rows off.
+
+        Runs on the writer thread in batch order, so which copy is kept is deterministic.
+        """
+        ids = [_sample_key(s) for s in batch.samples]
+        vectors = outputs[self.config.dedup.kind]
+        if hasattr(vectors, "detach"):
+            vectors = vectors.detach().float().cpu().numpy()
+        duplicates = self.dedup.check(vectors, ids)
+        if not duplicates:
+            return batch, outputs, []
+        self.metrics.inc("duplicates", len(duplicates))
+        for dup in duplicates:
+            shard, uid = ids[dup.row]
+            self._duplicates.setdefault(shard, []).append(
+                {"uid": uid, "duplicate_of": dup.of[1], "duplicate_of_shard": dup.of[0], "score": round(dup.score, 6)}
+            )
+        if self.config.dedup.action != "drop":
+            return batch, outputs, []
+        dropped = {dup.row for dup in duplicates}
+        keep = [i for i in range(len(batch.samples)) if i not in dropped]
+        outputs = {kind: array[keep] for kind, array in outputs.items()}
+        kept = Batch(samples=[batch.samples[i] for i in keep], seq=batch.seq)
+        return kept, outputs, [batch.samples[i] for i in sorted(dropped)]
+
+    async def _commit_ready_shards(self) -> None:
+        loop = asyncio.get_running_loop()
+        for progress in self.scheduler.ready_shards():
+            if progress.error is not None:
+                # A partially read shard must not reach the manifest; a rerun redoes it.
+                self.logger.error(f"Shard {progress.shard} was not fully read ({progress.error}); discarding it")
+                await loop.run_in_executor(self.writer_executor, self.writer.discard_shard, progress.shard)
+                self._duplicates.pop(progress.shard, None)
+                self.scheduler.mark_finalized(progress.shard)
+                continue
+            if progress.done == 0:
+                # Nothing survived; leave it out of the manifest so a rerun retries it.
+                self.logger.error(f"Shard {progress.shard or '<unsharded>'} produced no outputs")
+                self.scheduler.mark_finalized(progress.shard)
+                continue
+            duplicates = self._duplicates.pop(progress.shard, [])
+            try:
+                if duplicates:
+                    path = self.writer.output_dir / f"{shard_stem(progress.shard)}.duplicates.jsonl"
+                    await loop.run_in_executor(self.writer_executor, write_duplicates, path, duplicates)
+                await loop.run_in_executor(
+                    self.writer_executor, self._commit_shard, progress.shard, progress.failed, len(duplicates)
+                )
+                self.metrics.inc("shards_committed")
+            except Exception as exc:
+                self.logger.error(f"Commit of shard {progress.shard} failed: {exc}")
+            self.scheduler.mark_finalized(progress.shard)
 
     def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
         self.reader.close()
+        decoder_close = getattr(self.decoder, "close", None)
+        if callable(decoder_close):
+            decoder_close()
         self.writer.close()
-        self.model_runner.close()
+        self.scheduler.close()
+        for runner in self.model_runners:
+            runner.close()
         self.decode_executor.shutdown(wait=False)
         self.infer_executor.shutdown(wait=False)
-        self.writer_executor.shutdown(wait=False)
\ No newline at end of file
+        self.writer_executor.shutdown(wait=False)
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.config.telemetry.write_summary:
+            path = self.config.telemetry.summary_path or str(Path(self.config.output.out_dir) / "metrics.json")
+            try:
+                self.metrics.write_summary(path)
+            except OSError as exc:
+                self.logger.warning(f"Could not write metrics summary to {path}: {exc}")
+
+
+def _sample_key(sample: Sample) -> Tuple[str, str]:
+    return sample.meta.get("shard", ""), sample.uid
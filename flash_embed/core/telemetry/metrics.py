@@ -1,12 +1,240 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Log-linear buckets: 2**_PRECISION exact buckets, then 2**(_PRECISION - 1) per power
+# of two (~3% relative error), over integer values in _UNIT. Covers up to ~2**40 units.
+_PRECISION = 5
+_HALF = 1 << (_PRECISION - 1)
+_NUM_BUCKETS = (1 << _PRECISION) + 40 * _HALF
+_UNIT = 1e-6  # histograms record integer microseconds (or raw counts for sizes)
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Optional[Dict[str, str]]) -> Key:
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+def _bucket(value: int) -> int:
+    if value < (1 << _PRECISION):
+        return max(value, 0)
+    shift = value.bit_length() - _PRECISION
+    return min((1 << _PRECISION) + (shift - 1) * _HALF + ((value >> shift) - _HALF), _NUM_BUCKETS - 1)
+
+
+def _bucket_value(index: int) -> int:
+    """Upper bound of a bucket, in recorded units."""
+    if index < (1 << _PRECISION):
+        return index
+    shift = (index - (1 << _PRECISION)) // _HALF + 1
+    mantissa = (index - (1 << _PRECISION)) % _HALF + _HALF
+    return ((mantissa + 1) << shift) - 1
+
+
+class Histogram:
+    """HDR-style histogram with fixed log-linear buckets.
+
+    Each thread records into its own bucket array, so ``record`` takes no lock;
+    ``snapshot`` merges the per-thread arrays (readers may see a value or two
+    late, which is fine for monitoring). ``scale`` converts recorded values to
+    integer units, e.g. ``1e6`` for seconds -> microseconds.
+    """
+
+    def __init__(self, scale: float = 1.0 / _UNIT):
+        self.scale = scale
+        self._local = threading.local()
+        self._shards: List[List[float]] = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> List[float]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # Layout: buckets..., count, sum, max
+            shard = [0] * _NUM_BUCKETS + [0, 0.0, 0.0]
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def record(self, value: float) -> None:
+        shard = self._shard()
+        shard[_bucket(int(value * self.scale))] += 1
+        shard[_NUM_BUCKETS] += 1
+        shard[_NUM_BUCKETS + 1] += value
+        if value > shard[_NUM_BUCKETS + 2]:
+            shard[_NUM_BUCKETS + 2] = value
+
+    def snapshot(self, quantiles: Tuple[float, ...] = (0.5, 0.9, 0.99)) -> Dict[str, float]:
+        with self._lock:
+            shards = list(self._shards)
+        counts = [0] * _NUM_BUCKETS
+        total, value_sum, value_max = 0, 0.0, 0.0
+        for shard in shards:
+            for i, c in enumerate(shard[:_NUM_BUCKETS]):
+                if c:
+                    counts[i] += c
+            total += shard[_NUM_BUCKETS]
+            value_sum += shard[_NUM_BUCKETS + 1]
+            value_max = max(value_max, shard[_NUM_BUCKETS + 2])
+        out = {"count": total, "sum": value_sum, "max": value_max}
+        for q in quantiles:
+            out[f"p{q * 100:g}"] = self._quantile(counts, total, q, value_max)
+        return out
+
+    def _quantile(self, counts: List[int], total: int, q: float, value_max: float) -> float:
+        if not total:
+            return 0.0
+        target = q * total
+        seen = 0
+        for i, c in enumerate(counts):
+            seen += c
+            if c and seen >= target:
+                return min(_bucket_value(i) / self.scale, value_max)
+        return value_max
+
+
 class Metrics:
-    """Placeholder metrics collector; replace with Prom/Grafana integration."""
+    """Counters, gauges and histograms for one pipeline run.
+
+    Counters and histograms are updated without locks from any thread.
+    ``prometheus`` renders the text exposition format and ``summary`` a JSON
+    friendly dict; labels are plain ``{"stage": "decode"}`` dicts.
+    """
 
     def __init__(self):
-        self.counters = {}
+        self.started = time.monotonic()
+        self._local = threading.local()
+        self._counter_shards: List[Dict[Key, float]] = []
+        self._histograms: Dict[Key, Histogram] = {}
+        self._gauges: Dict[Key, float] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def counters(self) -> Dict[str, float]:
+        return {_format_key(key): value for key, value in self._counter_totals().items()}
+
+    def inc(self, name: str, value: float = 1, labels: Optional[Dict[str, str]] = None) -> None:
+        shard = getattr(self._local, "counters", None)
+        if shard is None:
+            shard = self._local.counters = {}
+            with self._lock:
+                self._counter_shards.append(shard)
+        key = _key(name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None, scale: float = 1.0 / _UNIT) -> None:
+        key = _key(name, labels)
+        hist = self._histograms.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self._histograms.setdefault(key, Histogram(scale))
+        hist.record(value)
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, {"stage": stage})
+
+    def timed(self, stage: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+        """Wrap ``fn`` so each call is recorded under ``stage`` in the thread that runs it."""
+
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with self.time(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    def counter(self, name: str, labels: Optional[Dict[str, str]] = None) -> float:
+        return self._counter_totals().get(_key(name, labels), 0)
+
+    def _counter_totals(self) -> Dict[Key, float]:
+        with self._lock:
+            shards = list(self._counter_shards)
+        totals: Dict[Key, float] = {}
+        for shard in shards:
+            for key, value in list(shard.items()):
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            histograms = dict(self._histograms)
+        return {
+            "elapsed_s": time.monotonic() - self.started,
+            "counters": {_format_key(k): v for k, v in sorted(self._counter_totals().items())},
+            "gauges": {_format_key(k): v for k, v in sorted(self._gauges.items())},
+            "histograms": {_format_key(k): h.snapshot() for k, h in sorted(histograms.items())},
+        }
+
+    def prometheus(self, prefix: str = "flash_embed") -> str:
+        lines: List[str] = []
+        for (name, labels), value in sorted(self._counter_totals().items()):
+            lines.append(f"{prefix}_{name}_total{_labels(labels)} {value}")
+        for (name, labels), value in sorted(self._gauges.items()):
+            lines.append(f"{prefix}_{name}{_labels(labels)} {value}")
+        with self._lock:
+            histograms = dict(self._histograms)
+        for (name, labels), hist in sorted(histograms.items()):
+            snap = hist.snapshot()
+            for q in (0.5, 0.9, 0.99):
+                lines.append(f"{prefix}_{name}{_labels(labels + (('quantile', str(q)),))} {snap[f'p{q * 100:g}']}")
+            lines.append(f"{prefix}_{name}_sum{_labels(labels)} {snap['sum']}")
+            lines.append(f"{prefix}_{name}_count{_labels(labels)} {snap['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_summary(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def _format_key(key: Key) -> str:
+    name, labels = key
+    return name + _labels(labels)
+
+
+class MetricsServer:
+    """Serves ``/metrics`` (Prometheus text) and ``/metrics.json`` from a daemon thread."""
+
+    def __init__(self, metrics: Metrics, host: str = "127.0.0.1", port: int = 9400):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # noqa: N802
+                if self.path == "/metrics":
+                    body, ctype = metrics.prometheus().encode(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, ctype = json.dumps(metrics.summary()).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_: Any) -> None:
+                return
 
-    def inc(self, name: str, value: int = 1) -> None:
-        self.counters[name] = self.counters.get(name, 0) + value
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
 
-    def observe(self, name: str, value: float) -> None:
-        # histogram placeholder
-        self.counters[name] = self.counters.get(name, 0) + value
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,3 +1,22 @@
-from .writer import Writer
+from .writer import Writer, iter_outputs, load_shard, shard_stem
+from .store import EmbeddingStore, EmbeddingStoreWriter
+from .postprocess import Postprocessor, dequantize
+from .manifest import MANIFEST_NAME, RETRY_DIR, Manifest, completed_shards, load_manifest, load_outputs, merge_manifests
 
-__all__ = ["Writer"]
+__all__ = [
+    "Writer",
+    "iter_outputs",
+    "load_shard",
+    "shard_stem",
+    "EmbeddingStore",
+    "EmbeddingStoreWriter",
+    "Postprocessor",
+    "dequantize",
+    "MANIFEST_NAME",
+    "RETRY_DIR",
+    "Manifest",
+    "completed_shards",
+    "load_manifest",
+    "load_outputs",
+    "merge_manifests",
+]
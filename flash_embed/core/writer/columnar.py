@@ -0,0 +1,113 @@
+import os
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except Exception as exc:
+        raise RuntimeError("pyarrow is required for parquet/arrow output") from exc
+    return pa, pq
+
+
+def embedding_array(array: np.ndarray):
+    """Wrap a (rows, dim) matrix as a FixedSizeListArray without copying the buffer."""
+    pa, _ = _pyarrow()
+    array = np.ascontiguousarray(array)
+    rows, dim = array.shape[0], int(np.prod(array.shape[1:]))
+    return pa.FixedSizeListArray.from_arrays(pa.array(array.reshape(rows * dim)), dim)
+
+
+class ColumnarShardWriter:
+    """Streams one output shard into a Parquet file or Arrow IPC file.
+
+    Rows are appended batch by batch and flushed as a row group (or record
+    batch) every ``row_group_size`` rows, so memory stays bounded by one row
+    group. Output goes to a temporary file that ``commit`` renames into place.
+    """
+
+    def __init__(self, path: Path, fmt: str = "parquet", row_group_size: int = 8192):
+        if fmt not in {"parquet", "arrow"}:
+            raise ValueError(f"Unsupported columnar format: {fmt}")
+        self.path = path
+        self.tmp_path = path.with_name(path.name + ".tmp")
+        self.format = fmt
+        self.row_group_size = max(1, row_group_size)
+        self.rows = 0
+        self._embeddings: List[np.ndarray] = []
+        self._columns: Dict[str, List[str]] = {}
+        self._buffered = 0
+        self._writer = None
+
+    def append(self, embeddings: np.ndarray, columns: Dict[str, List[str]]) -> None:
+        self._embeddings.append(embeddings)
+        for name, values in columns.items():
+            self._columns.setdefault(name, []).extend(values)
+        self._buffered += len(embeddings)
+        self.rows += len(embeddings)
+        while self._buffered >= self.row_group_size:
+            self._flush(self.row_group_size)
+
+    def commit(self) -> None:
+        """Flush remaining rows, close the file and rename it into place."""
+        while self._buffered:
+            self._flush(min(self._buffered, self.row_group_size))
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        with open(self.tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self.tmp_path.exists():
+            self.tmp_path.unlink()
+
+    def _flush(self, rows: int) -> None:
+        pa, pq = _pyarrow()
+        if len(self._embeddings) == 1 and len(self._embeddings[0]) == rows:
+            head, rest = self._embeddings[0], None
+        else:
+            merged = np.concatenate(self._embeddings, axis=0)
+            head, rest = merged[:rows], merged[rows:]
+        self._embeddings = [rest] if rest is not None and len(rest) else []
+
+        arrays = {name: pa.array(values[:rows], type=pa.string()) for name, values in self._columns.items()}
+        arrays["embedding"] = embedding_array(head)
+        for name in self._columns:
+            del self._columns[name][:rows]
+        self._buffered -= rows
+
+        batch = pa.RecordBatch.from_arrays(list(arrays.values()), names=list(arrays))
+        if self._writer is None:
+            if self.format == "parquet":
+                self._writer = pq.ParquetWriter(str(self.tmp_path), batch.schema)
+            else:
+                self._writer = pa.ipc.new_file(str(self.tmp_path), batch.schema)
+        if self.format == "parquet":
+            self._writer.write_table(pa.Table.from_batches([batch]), row_group_size=rows)
+        else:
+            self._writer.write_batch(batch)
+
+
+def read_columnar(path: Path, fmt: str) -> Dict[str, np.ndarray]:
+    """Read a columnar shard back as ``{"embedding": (rows, dim), "uid": ..., ...}``."""
+    pa, pq = _pyarrow()
+    if fmt == "arrow":
+        with pa.memory_map(str(path)) as source:
+            table = pa.ipc.open_file(source).read_all()
+    else:
+        table = pq.read_table(path)
+    out = {name: np.asarray(table.column(name).to_pylist()) for name in table.column_names if name != "embedding"}
+    embedding = table.column("embedding").combine_chunks()
+    dim = embedding.type.list_size
+    out["embedding"] = embedding.flatten().to_numpy(zero_copy_only=False).reshape(-1, dim)
+    return out
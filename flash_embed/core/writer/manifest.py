@@ -0,0 +1,92 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+MANIFEST_NAME = "manifest.jsonl"
+RETRY_DIR = "retry"  # where ``flash-embed retry`` re-embeds failed samples, with its own manifest
+
+
+class Manifest:
+    """Append-only JSON-lines manifest; one line per committed shard.
+
+    A shard counts as finished once its line is on disk, so the line is only
+    appended after the shard's output files have been renamed into place.
+    """
+
+    def __init__(self, output_dir: str):
+        self.path = Path(output_dir) / MANIFEST_NAME
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry) + "\n"
+        with open(self.path, "a") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def entries(self) -> List[Dict[str, Any]]:
+        return load_manifest(str(self.path))
+
+
+def load_manifest(path: str) -> List[Dict[str, Any]]:
+    """Read manifest entries, ignoring a torn final line left by a crash."""
+    if not os.path.isfile(path):
+        return []
+    entries = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return entries
+
+
+def load_outputs(output_dir: str) -> List[Dict[str, Any]]:
+    """Entries of ``output_dir``'s manifest followed by those of its ``retry`` run.
+
+    Retried samples are missing from the original shard outputs, so readers
+    need both; retry entries get ``dir`` set so their files resolve.
+    """
+    entries = load_manifest(str(Path(output_dir) / MANIFEST_NAME))
+    for entry in load_manifest(str(Path(output_dir) / RETRY_DIR / MANIFEST_NAME)):
+        entry = dict(entry)
+        entry["dir"] = str(Path(RETRY_DIR) / entry["dir"]) if entry.get("dir") else RETRY_DIR
+        entries.append(entry)
+    return entries
+
+
+def completed_shards(path: str) -> Set[str]:
+    return {entry["shard"] for entry in load_manifest(path) if "shard" in entry}
+
+
+def merge_manifests(output_dir: str, subdirs: List[str]) -> List[Dict[str, Any]]:
+    """Combine the manifests of ``output_dir/<subdir>`` into ``output_dir``'s manifest.
+
+    Each merged entry records its ``dir`` so readers resolve files relative to
+    it. Entries already in ``output_dir``'s manifest (e.g. from an earlier
+    single-process run) are kept; a shard committed more than once keeps its
+    latest entry, subdirectories taking precedence. The merged manifest is
+    rewritten atomically, so merging is idempotent.
+    """
+    path = Path(output_dir) / MANIFEST_NAME
+    merged: Dict[str, Dict[str, Any]] = {}
+    for entry in load_manifest(str(path)):
+        merged[entry.get("shard", "")] = entry
+    for subdir in subdirs:
+        for entry in load_manifest(str(Path(output_dir) / subdir / MANIFEST_NAME)):
+            entry = dict(entry)
+            entry["dir"] = str(Path(subdir) / entry["dir"]) if entry.get("dir") else subdir
+            merged.pop(entry.get("shard", ""), None)
+            merged[entry.get("shard", "")] = entry
+    entries = list(merged.values())
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.writelines(json.dumps(entry) + "\n" for entry in entries)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return entries
@@ -0,0 +1,137 @@
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+SCALE_SUFFIX = "_scale"  # int8 outputs store per-row scales under "<kind>_scale"
+
+
+def to_numpy(array: Any) -> np.ndarray:
+    if hasattr(array, "detach"):
+        array = array.detach().float().cpu().numpy()
+    return np.asarray(array, dtype=np.float32)
+
+
+def l2_normalize(array: np.ndarray) -> np.ndarray:
+    return array / np.maximum(np.linalg.norm(array, axis=1, keepdims=True), 1e-12)
+
+
+def quantize_int8(array: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8: ``array ~= codes * scale``; returns ``(codes, scale[:, None])``."""
+    scale = np.maximum(np.abs(array).max(axis=1, keepdims=True), 1e-12) / 127.0
+    codes = np.clip(np.rint(array / scale), -127, 127).astype(np.int8)
+    return codes, scale.astype(np.float32)
+
+
+def dequantize(codes: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    return codes.astype(np.float32) * scale.reshape(len(scale), 1)
+
+
+class Postprocessor:
+    """Vectorized embedding post-processing applied before writing.
+
+    Steps, all optional: L2 normalization, reduction to ``dim`` dimensions
+    (``pca`` fitted on the first rows seen, or a seeded Gaussian ``random``
+    projection), renormalization, then ``float16`` or per-row scaled
+    ``int8`` quantization. The same projection is used for every embedding
+    kind so image and text vectors stay comparable; it is saved to
+    ``projection_path`` (``components``/``mean``) for projecting queries
+    and reused when that file already exists.
+    """
+
+    def __init__(
+        self,
+        normalize: bool = False,
+        reduce: Optional[str] = None,
+        dim: Optional[int] = None,
+        quantize: Optional[str] = None,
+        projection_path: Optional[str] = None,
+        fit_samples: int = 16384,
+        seed: int = 0,
+    ):
+        if reduce not in {None, "pca", "random"}:
+            raise ValueError(f"Unsupported reduction: {reduce}")
+        if reduce and not dim:
+            raise ValueError("postprocess.dim is required with a reduction")
+        if quantize not in {None, "float16", "int8"}:
+            raise ValueError(f"Unsupported quantization: {quantize}")
+        self.normalize = normalize
+        self.reduce = reduce
+        self.dim = dim
+        self.quantize = quantize
+        self.projection_path = projection_path
+        self.fit_samples = fit_samples
+        self.seed = seed
+        self.components: Optional[np.ndarray] = None
+        self.mean: Optional[np.ndarray] = None
+        if reduce and projection_path and os.path.exists(projection_path):
+            with np.load(projection_path) as data:
+                self.components, self.mean = data["components"], data["mean"]
+            if self.components.shape[1] != dim:
+                raise ValueError(f"{projection_path} projects to {self.components.shape[1]} dims, not {dim}")
+
+    @property
+    def needs_fit(self) -> bool:
+        """True until a PCA projection exists; callers buffer ``fit_samples`` rows first."""
+        return self.reduce == "pca" and self.components is None
+
+    def fit(self, sample: np.ndarray) -> None:
+        sample = to_numpy(sample)
+        if self.normalize:
+            sample = l2_normalize(sample)
+        if self.reduce == "pca":
+            if len(sample) < self.dim:
+                raise ValueError(f"PCA to {self.dim} dims needs at least {self.dim} rows, got {len(sample)}")
+            mean = sample.mean(axis=0)
+            # Right singular vectors of the centered sample are the principal axes.
+            _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+            self.components, self.mean = np.ascontiguousarray(vt[: self.dim].T), mean
+        else:
+            rng = np.random.default_rng(self.seed)
+            self.components = rng.standard_normal((sample.shape[1], self.dim)).astype(np.float32)
+            self.components /= np.sqrt(self.dim)
+            self.mean = np.zeros(sample.shape[1], dtype=np.float32)
+        if self.projection_path:
+            self._save()
+
+    def _save(self) -> None:
+        path = Path(self.projection_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Per-process temp name: launcher ranks may save the same (seeded) projection at once.
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp.npz")
+        np.savez(tmp_path, components=self.components, mean=self.mean)
+        os.replace(tmp_path, path)
+
+    def __call__(self, outputs: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        processed: Dict[str, np.ndarray] = {}
+        for kind, array in outputs.items():
+            array = to_numpy(array)
+            if self.normalize:
+                array = l2_normalize(array)
+            if self.reduce:
+                if self.components is None:
+                    self.fit(array)  # random projection only needs the input width
+                array = (array - self.mean) @ self.components
+                if self.normalize:
+                    array = l2_normalize(array)
+            if self.quantize == "int8":
+                processed[kind], processed[kind + SCALE_SUFFIX] = quantize_int8(array)
+                continue
+            processed[kind] = array.astype(np.float16) if self.quantize == "float16" else array
+        return processed
+
+    def describe(self) -> Dict[str, Any]:
+        """Manifest record of the applied steps, enough for readers to dequantize and project queries."""
+        record: Dict[str, Any] = {"normalize": self.normalize}
+        if self.reduce:
+            record.update(reduce=self.reduce, dim=self.dim)
+            if self.reduce == "random":
+                record["seed"] = self.seed
+            if self.projection_path:
+                record["projection"] = str(self.projection_path)
+        if self.quantize:
+            record["quantize"] = self.quantize
+            if self.quantize == "int8":
+                record["scale_suffix"] = SCALE_SUFFIX
+        return record
@@ -0,0 +1,289 @@
+import itertools
+import json
+import os
+import re
+import struct
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from flash_embed.core.writer.manifest import MANIFEST_NAME, load_manifest
+
+# Fixed-size .npy header so the final shape can be written in place when sealing.
+_HEADER_BYTES = 128
+_MAGIC = b"\x93NUMPY\x01\x00"
+
+
+def _npy_header(dtype: np.dtype, shape: Tuple[int, ...]) -> bytes:
+    header = repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": shape})
+    body = header.encode("latin1")
+    pad = _HEADER_BYTES - len(_MAGIC) - 2 - len(body) - 1
+    if pad < 0:
+        raise ValueError(f"Store header too large for shape {shape}")
+    return _MAGIC + struct.pack("<H", _HEADER_BYTES - len(_MAGIC) - 2) + body + b" " * pad + b"\n"
+
+
+def _store_name(kind: str, index: int) -> str:
+    return f"{kind}-{index:05d}.npy"
+
+
+class _StoreFile:
+    """One preallocated store file; grows in chunks and is sealed once full."""
+
+    def __init__(self, path: Path, row_shape: Tuple[int, ...], dtype: np.dtype, capacity: int, chunk_rows: int):
+        self.path = path
+        self.row_shape = row_shape
+        self.dtype = dtype
+        self.capacity = capacity
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self.row_bytes = int(np.prod(row_shape)) * dtype.itemsize
+        self._allocated = 0
+        self._mmap: Optional[np.memmap] = None
+        with open(path, "wb") as f:
+            # A zero-row header marks the file as unsealed for readers.
+            f.write(_npy_header(dtype, (0, *row_shape)))
+        self._grow(min(chunk_rows, capacity))
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.rows
+
+    def append(self, array: np.ndarray) -> int:
+        start = self.rows
+        end = start + len(array)
+        if end > self._allocated:
+            self._grow(min(self.capacity, max(end, self._allocated + self.chunk_rows)))
+        self._mmap[start:end] = array
+        self.rows = end
+        return start
+
+    def flush(self) -> None:
+        if self._mmap is not None:
+            self._mmap.flush()
+
+    def seal(self) -> None:
+        if self._mmap is not None:
+            self._mmap.flush()
+            self._mmap = None
+        seal_store_file(self.path, self.rows)
+
+    def _grow(self, rows: int) -> None:
+        if self._mmap is not None:
+            self._mmap.flush()
+            self._mmap = None
+        with open(self.path, "r+b") as f:
+            f.truncate(_HEADER_BYTES + rows * self.row_bytes)
+        self._allocated = rows
+        self._mmap = np.memmap(
+            self.path, dtype=self.dtype, mode="r+", offset=_HEADER_BYTES, shape=(rows, *self.row_shape)
+        )
+
+
+def seal_store_file(path: Path, rows: int) -> None:
+    """Trim a store file to ``rows`` and write its final header."""
+    with open(path, "r+b") as f:
+        np.lib.format.read_magic(f)
+        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        row_shape = tuple(shape[1:])
+        row_bytes = int(np.prod(row_shape)) * dtype.itemsize
+        f.truncate(_HEADER_BYTES + rows * row_bytes)
+        f.seek(0)
+        f.write(_npy_header(dtype, (rows, *row_shape)))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class EmbeddingStoreWriter:
+    """Appends committed rows of one embedding kind into large store files.
+
+    Files are named ``{kind}-{index}.npy`` and hold up to ``capacity`` rows;
+    columns (uids, text, ...) go to row-aligned ``.{column}.jsonl`` sidecars.
+    ``append`` returns the segments the rows landed in, which the caller
+    records in the manifest. On startup, a file left unsealed by a crash is
+    trimmed back to the rows the manifest says were committed.
+    """
+
+    def __init__(self, output_dir: Path, kind: str, capacity: int = 1 << 20, chunk_rows: int = 1 << 16):
+        self.output_dir = Path(output_dir)
+        self.kind = kind
+        self.capacity = capacity
+        self.chunk_rows = chunk_rows
+        self._current: Optional[_StoreFile] = None
+        self._next_index = self._recover()
+
+    def append(self, array: np.ndarray, columns: Dict[str, Sequence[str]]) -> List[Dict[str, Any]]:
+        segments = []
+        offset = 0
+        while offset < len(array):
+            current = self._current
+            if current is None or current.free == 0:
+                current = self._open(array)
+            count = min(current.free, len(array) - offset)
+            start = current.append(array[offset : offset + count])
+            current.flush()
+            offsets = {}
+            for name, values in columns.items():
+                with open(current.path.with_suffix(f".{name}.jsonl"), "ab") as f:
+                    offsets[name] = f.tell()
+                    f.writelines((json.dumps(v) + "\n").encode() for v in values[offset : offset + count])
+                    f.flush()
+                    os.fsync(f.fileno())
+            segments.append({"file": current.path.name, "start": start, "count": count, "offsets": offsets})
+            offset += count
+            if current.free == 0:
+                current.seal()
+                self._current = None
+        return segments
+
+    def close(self) -> None:
+        if self._current is not None:
+            self._current.seal()
+            self._current = None
+
+    def _open(self, array: np.ndarray) -> _StoreFile:
+        path = self.output_dir / _store_name(self.kind, self._next_index)
+        self._next_index += 1
+        self._current = _StoreFile(path, tuple(array.shape[1:]), array.dtype, self.capacity, self.chunk_rows)
+        return self._current
+
+    def _recover(self) -> int:
+        committed: Dict[str, int] = {}
+        for segment in _segments(load_manifest(str(self.output_dir / MANIFEST_NAME)), self.kind):
+            end = segment["start"] + segment["count"]
+            committed[segment["file"]] = max(committed.get(segment["file"], 0), end)
+
+        pattern = re.compile(rf"^{re.escape(self.kind)}-(\d+)\.npy$")
+        last = -1
+        for path in sorted(self.output_dir.glob(f"{self.kind}-*.npy")):
+            match = pattern.match(path.name)
+            if not match:
+                continue
+            if path.name not in committed:
+                # Nothing in this file was ever committed.
+                _remove_store_file(path)
+                continue
+            if _header_rows(path) != committed[path.name]:
+                seal_store_file(path, committed[path.name])
+                _trim_sidecars(path, committed[path.name])
+            last = max(last, int(match.group(1)))
+        return last + 1
+
+
+class EmbeddingStore:
+    """Read-only, memory-mapped view over every sealed store file of ``kind``.
+
+    Rows are addressed globally in commit order; indexing only touches the
+    pages it reads.
+    """
+
+    def __init__(self, output_dir: str, kind: str = "image"):
+        self.output_dir = Path(output_dir)
+        files: Dict[str, None] = {}
+        for segment in _segments(load_manifest(str(self.output_dir / MANIFEST_NAME)), kind):
+            files[segment["file"]] = None
+        self.files: List[Path] = []
+        self._arrays: List[np.ndarray] = []
+        for name in files:
+            array = np.load(self.output_dir / name, mmap_mode="r")
+            if len(array):
+                self.files.append(self.output_dir / name)
+                self._arrays.append(array)
+        self._offsets = np.cumsum([0] + [len(a) for a in self._arrays])
+
+    def __len__(self) -> int:
+        return int(self._offsets[-1])
+
+    def __getitem__(self, index: Union[int, slice, Sequence[int], np.ndarray]) -> np.ndarray:
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError(index)
+            file_idx = int(np.searchsorted(self._offsets, index, side="right")) - 1
+            return self._arrays[file_idx][index - self._offsets[file_idx]]
+        if isinstance(index, slice):
+            index = np.arange(len(self))[index]
+        return self.take(np.asarray(index))
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.int64)
+        file_idx = np.searchsorted(self._offsets, rows, side="right") - 1
+        out = np.empty((len(rows), *self._arrays[0].shape[1:]), dtype=self._arrays[0].dtype)
+        for idx in np.unique(file_idx):
+            mask = file_idx == idx
+            out[mask] = self._arrays[idx][rows[mask] - self._offsets[idx]]
+        return out
+
+    def arrays(self) -> List[np.ndarray]:
+        """The underlying memory-mapped arrays, one per sealed file."""
+        return list(self._arrays)
+
+    def column(self, name: str = "uid") -> np.ndarray:
+        values: List[str] = []
+        for path, array in zip(self.files, self._arrays):
+            with open(path.with_suffix(f".{name}.jsonl")) as f:
+                values.extend(json.loads(line) for _, line in zip(range(len(array)), f))
+        return np.asarray(values, dtype=str)
+
+
+def read_segments(output_dir: Path, segments: List[Dict[str, Any]], columns: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Read one committed shard back from its store segments."""
+    parts = []
+    values: Dict[str, List[str]] = {name: [] for name in columns}
+    for segment in segments:
+        path = Path(output_dir) / segment["file"]
+        start, end = segment["start"], segment["start"] + segment["count"]
+        # Map by rows rather than np.load so files still being appended to are readable.
+        shape, dtype = _header(path)
+        array = np.memmap(path, dtype=dtype, mode="r", offset=_HEADER_BYTES, shape=(end, *shape[1:]))
+        parts.append(np.array(array[start:end]))
+        for name in columns:
+            with open(path.with_suffix(f".{name}.jsonl"), "rb") as f:
+                # Byte offsets recorded at append time let us seek instead of rescanning.
+                f.seek(segment.get("offsets", {}).get(name, 0))
+                skip = 0 if name in segment.get("offsets", {}) else start
+                values[name].extend(json.loads(line) for line in itertools.islice(f, skip, skip + segment["count"]))
+    out = {name: np.asarray(v, dtype=str) for name, v in values.items()}
+    out["embedding"] = np.concatenate(parts, axis=0)
+    return out
+
+
+def _segments(entries: List[Dict[str, Any]], kind: str) -> List[Dict[str, Any]]:
+    segments = []
+    for entry in entries:
+        if entry.get("format") != "memmap":
+            continue
+        for segment in entry["files"].get(kind, []):
+            if entry.get("dir"):
+                # Merged manifests (see merge_manifests) point into per-process subdirectories.
+                segment = dict(segment, file=f"{entry['dir']}/{segment['file']}")
+            segments.append(segment)
+    return segments
+
+
+def _header(path: Path) -> Tuple[Tuple[int, ...], np.dtype]:
+    with open(path, "rb") as f:
+        np.lib.format.read_magic(f)
+        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+    return shape, dtype
+
+
+def _header_rows(path: Path) -> int:
+    return _header(path)[0][0]
+
+
+def _trim_sidecars(path: Path, rows: int) -> None:
+    for sidecar in path.parent.glob(path.stem + ".*.jsonl"):
+        with open(sidecar, "r+b") as f:
+            for _ in range(rows):
+                if not f.readline():
+                    break
+            f.truncate(f.tell())
+
+
+def _remove_store_file(path: Path) -> None:
+    for sidecar in path.parent.glob(path.stem + ".*.jsonl"):
+        sidecar.unlink()
+    path.unlink()
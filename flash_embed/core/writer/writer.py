@@ -1,44 +1,277 @@
+import hashlib
 import json
+import os
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import numpy as np
 
+from flash_embed.core.io.reader import Sample
+from flash_embed.core.telemetry.logging import get_logger
+from flash_embed.core.writer.columnar import ColumnarShardWriter, read_columnar
+from flash_embed.core.writer.manifest import Manifest, load_outputs
+from flash_embed.core.writer.postprocess import SCALE_SUFFIX, dequantize
+from flash_embed.core.writer.store import EmbeddingStoreWriter, read_segments
+
+
+def shard_stem(shard: str) -> str:
+    """Output file stem for a shard url (``.../data-0001.tar`` -> ``data-0001-<hash>``).
+
+    The short hash of the full url keeps same-named shards from different
+    directories or buckets from overwriting each other's outputs.
+    """
+    if not shard:
+        return "unsharded"
+    name = Path(shard).name
+    for suffix in (".tar.gz", ".tgz", ".tar"):
+        if name.endswith(suffix):
+            name = name[: -len(suffix)]
+            break
+    return f"{name or 'shard'}-{hashlib.sha1(shard.encode()).hexdigest()[:12]}"
+
+
+@dataclass
+class _ShardBuffer:
+    embeddings: Dict[str, List[np.ndarray]] = field(default_factory=dict)
+    columns: Dict[str, List[str]] = field(default_factory=dict)
+
 
 class Writer:
-    """Writer supporting multiple output formats with a simple manifest."""
+    """Writer supporting multiple output formats with a per-shard manifest.
+
+    Each input shard becomes one file per embedding kind, with the sample uids
+    (and optionally text and meta) stored row-aligned next to the embeddings.
+    npy/npz rows are buffered until ``commit_shard``; parquet/arrow rows are
+    streamed into the open file in row groups. ``memmap`` instead appends each
+    committed shard into large preallocated store files shared by many input
+    shards (see ``EmbeddingStoreWriter``). Files are written to a
+    temporary name and renamed into place before the shard is appended to the
+    manifest, so a crash never leaves a shard half-recorded.
+    """
 
-    def __init__(self, output_dir: str, fmt: str = "npy"):
+    def __init__(
+        self,
+        output_dir: str,
+        fmt: str = "npy",
+        store_text: bool = False,
+        store_meta: bool = False,
+        row_group_size: int = 8192,
+        dtype: str = "float32",
+        store_rows: int = 1 << 20,
+        store_chunk_rows: int = 1 << 16,
+        postprocess: Optional[Dict[str, Any]] = None,
+    ):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.format = fmt
-        self._manifest = []
+        if self.format not in {"npy", "npz", "parquet", "arrow", "memmap"}:
+            raise ValueError(f"Unsupported writer format: {self.format}")
+        if dtype not in {"float16", "float32"}:
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        self.dtype = np.dtype(dtype)
+        self.row_group_size = row_group_size
+        self.store_rows = store_rows
+        self.store_chunk_rows = store_chunk_rows
+        self.postprocess = postprocess  # recorded on every manifest entry
+        self.column_names = ["uid"] + (["text"] if store_text else []) + (["meta"] if store_meta else [])
+        self.manifest = Manifest(str(self.output_dir))
+        self.logger = get_logger()
+        self._pending: Dict[str, _ShardBuffer] = {}
+        self._sinks: Dict[str, Dict[str, ColumnarShardWriter]] = {}
+        self._stores: Dict[str, EmbeddingStoreWriter] = {}
+
+    def write_batch(self, embeddings: Dict[str, np.ndarray], samples: Optional[Sequence[Sample]] = None) -> None:
+        """Buffer a batch of embeddings under the shard each row came from."""
+        if samples is None:
+            rows = len(next(iter(embeddings.values()))) if embeddings else 0
+            samples = [Sample(uid="", image=None, text=None, meta={}) for _ in range(rows)]
+        shards = [s.meta.get("shard", "") for s in samples]
+        if len(set(shards)) <= 1:
+            groups = {shards[0] if shards else "": np.arange(len(samples))}
+        else:
+            order: Dict[str, List[int]] = {}
+            for idx, shard in enumerate(shards):
+                order.setdefault(shard, []).append(idx)
+            groups = {shard: np.asarray(rows) for shard, rows in order.items()}
+
+        arrays = {kind: self._cast(array) for kind, array in embeddings.items()}
+        for shard, rows in groups.items():
+            columns = {name: [_column_value(samples[i], name) for i in rows] for name in self.column_names}
+            if self.format in {"parquet", "arrow"}:
+                sinks = self._sinks.setdefault(shard, {})
+                for kind, array in arrays.items():
+                    sink = sinks.get(kind)
+                    if sink is None:
+                        path = self.output_dir / f"{shard_stem(shard)}.{kind}.{self.format}"
+                        sink = sinks[kind] = ColumnarShardWriter(path, self.format, self.row_group_size)
+                    sink.append(array if len(rows) == len(array) else array[rows], columns)
+                continue
+            pending = self._pending.setdefault(shard, _ShardBuffer())
+            for kind, array in arrays.items():
+                pending.embeddings.setdefault(kind, []).append(array if len(rows) == len(array) else array[rows])
+            for name, values in columns.items():
+                pending.columns.setdefault(name, []).extend(values)
+
+    def commit_shard(self, shard: str, failed: int = 0, duplicates: int = 0) -> None:
+        """Atomically write a shard's buffered rows and record it in the manifest."""
+        stem = shard_stem(shard)
+        files: Dict[str, str] = {}
+        count = 0
+        if self.format in {"parquet", "arrow"}:
+            for kind, sink in self._sinks.pop(shard, {}).items():
+                sink.commit()
+                count = sink.rows
+                files[kind] = sink.path.name
+            self._append_manifest(shard, stem, count, failed, files, self.column_names, duplicates)
+            return
+
+        pending = self._pending.pop(shard, _ShardBuffer())
+        if self.format == "memmap":
+            segments: Dict[str, Any] = {}
+            for kind, parts in pending.embeddings.items():
+                array = np.concatenate(parts, axis=0)
+                count = len(array)
+                store = self._stores.get(kind)
+                if store is None:
+                    store = self._stores[kind] = EmbeddingStoreWriter(
+                        self.output_dir, kind, capacity=self.store_rows, chunk_rows=self.store_chunk_rows
+                    )
+                segments[kind] = store.append(array, pending.columns)
+            self._append_manifest(shard, stem, count, failed, segments, list(pending.columns), duplicates)
+            return
+
+        columns = {name: np.asarray(values, dtype=str) for name, values in pending.columns.items()}
+        for kind, parts in pending.embeddings.items():
+            array = np.concatenate(parts, axis=0)
+            count = len(array)
+            path = self.output_dir / f"{stem}.{kind}.{self.format}"
+            if self.format == "npy" and kind in columns:
+                # "text" embeddings next to a stored "text" column; readers go by the manifest path.
+                path = self.output_dir / f"{stem}.{kind}_embedding.npy"
+            # npy holds a single array, so the columns go to shared per-shard sidecars below.
+            self._write_atomic(path, array, {} if self.format == "npy" else columns)
+            files[kind] = path.name
+        if self.format == "npy":
+            for name, values in columns.items():
+                self._write_atomic(self.output_dir / f"{stem}.{name}.npy", values, {})
+        self._append_manifest(shard, stem, count, failed, files, list(columns), duplicates)
+
+    def discard_shard(self, shard: str) -> None:
+        """Drop a shard's buffered rows and partial files without recording it."""
+        self._pending.pop(shard, None)
+        for sink in self._sinks.pop(shard, {}).values():
+            sink.abort()
 
-    def write_batch(self, embeddings: Dict[str, np.ndarray]) -> None:
-        """Persist embeddings to disk."""
-        for kind, array in embeddings.items():
-            filename = self._next_filename(kind)
+    def _append_manifest(
+        self,
+        shard: str,
+        stem: str,
+        count: int,
+        failed: int,
+        files: Dict[str, Any],
+        columns: List[str],
+        duplicates: int = 0,
+    ) -> None:
+        entry = {
+            "shard": shard,
+            "stem": stem,
+            "format": self.format,
+            "dtype": self.dtype.name,
+            "count": count,
+            "failed": failed,
+            "files": files,
+            "columns": columns,
+        }
+        if self.postprocess:
+            entry["postprocess"] = self.postprocess
+        if duplicates:
+            # Near-duplicates found by the dedup stage, listed in <stem>.duplicates.jsonl.
+            entry["duplicates"] = duplicates
+        self.manifest.append(entry)
+
+    def _cast(self, array: np.ndarray) -> np.ndarray:
+        array = np.asarray(array)
+        if np.issubdtype(array.dtype, np.floating) and array.dtype != self.dtype:
+            return array.astype(self.dtype)
+        return array
+
+    def _write_atomic(self, path: Path, array: np.ndarray, columns: Dict[str, np.ndarray]) -> None:
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
             if self.format == "npy":
-                np.save(filename, array)
-            elif self.format == "npz":
-                np.savez_compressed(filename, data=array)
-            elif self.format in {"parquet", "arrow"}:
-                try:
-                    import pyarrow as pa
-                    import pyarrow.parquet as pq
-                except Exception as exc:
-                    raise RuntimeError("pyarrow is required for parquet/arrow output") from exc
-                table = pa.Table.from_pydict({"embedding": [array.tolist()]})
-                pq.write_table(table, filename)
+                np.save(f, array)
             else:
-                raise ValueError(f"Unsupported writer format: {self.format}")
-            self._manifest.append({"kind": kind, "path": str(filename)})
-
-    def _next_filename(self, kind: str) -> Path:
-        idx = len(self._manifest)
-        suffix = self.format if self.format != "arrow" else "arrow"
-        return self.output_dir / f"{kind}_{idx}.{suffix}"
+                np.savez_compressed(f, embedding=array, **columns)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
 
     def close(self) -> None:
-        manifest_path = self.output_dir / "manifest.json"
-        manifest_path.write_text(json.dumps(self._manifest))
+        uncommitted = sorted(set(self._pending) | set(self._sinks))
+        if uncommitted:
+            # Uncommitted shards are incomplete; leave them for the next run to redo.
+            self.logger.warning(f"Discarding {len(uncommitted)} uncommitted shard(s): {uncommitted}")
+        for sinks in self._sinks.values():
+            for sink in sinks.values():
+                sink.abort()
+        self._sinks.clear()
+        self._pending.clear()
+        for store in self._stores.values():
+            store.close()
+        self._stores.clear()
+
+
+def _column_value(sample: Sample, name: str) -> str:
+    if name == "uid":
+        return sample.uid
+    if name == "text":
+        return sample.text or ""
+    meta = {k: v for k, v in sample.meta.items() if k != "shard"}
+    return json.dumps(meta, default=str)
+
+
+def load_shard(
+    output_dir: str, entry: Dict[str, Any], kind: str, dequantize_int8: bool = True
+) -> Dict[str, np.ndarray]:
+    """Load one committed shard of ``kind`` as ``{"embedding": ..., "uid": ..., ...}``.
+
+    int8-quantized embeddings come back as float32 unless ``dequantize_int8`` is False.
+    """
+    out = _load_kind(output_dir, entry, kind)
+    scale_kind = kind + SCALE_SUFFIX
+    if dequantize_int8 and entry.get("postprocess", {}).get("quantize") == "int8" and scale_kind in entry["files"]:
+        scale = _load_kind(output_dir, entry, scale_kind)["embedding"]
+        out["embedding"] = dequantize(np.asarray(out["embedding"]), np.asarray(scale, dtype=np.float32))
+    return out
+
+
+def _load_kind(output_dir: str, entry: Dict[str, Any], kind: str) -> Dict[str, np.ndarray]:
+    base = Path(output_dir) / entry.get("dir", "")
+    if entry.get("format") == "memmap":
+        return read_segments(base, entry["files"][kind], entry.get("columns", []))
+    path = base / entry["files"][kind]
+    fmt = entry.get("format", path.suffix.lstrip("."))
+    if fmt == "npy":
+        out = {"embedding": np.load(path)}
+        for name in entry.get("columns", []):
+            out[name] = np.load(base / f"{entry['stem']}.{name}.npy")
+        return out
+    if fmt == "npz":
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    return read_columnar(path, fmt)
+
+
+def iter_outputs(
+    output_dir: str, kind: str = "image", entries: Optional[List[Dict[str, Any]]] = None
+) -> Iterator[Tuple[Dict[str, Any], Dict[str, np.ndarray]]]:
+    """Yield ``(manifest entry, columns)`` for every committed shard of ``kind``, one shard at a time.
+
+    Without ``entries``, retried samples (``retry/``) follow the main outputs.
+    """
+    if entries is None:
+        entries = load_outputs(output_dir)
+    for entry in entries:
+        if kind in entry.get("files", {}):
+            yield entry, load_shard(output_dir, entry, kind)
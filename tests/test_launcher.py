@@ -0,0 +1,26 @@
+import multiprocessing
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from flash_embed.core.pipeline.launcher import start_rank  # noqa: E402
+
+
+def _report_threads(results) -> None:
+    results.put((sorted(os.sched_getaffinity(0)), torch.get_num_threads()))
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_getaffinity"), reason="needs CPU affinity")
+def test_rank_thread_pool_matches_pinned_cores():
+    available = sorted(os.sched_getaffinity(0))
+    cores = available[:1]
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    proc = start_rank(ctx, _report_threads, (results,), name="test-rank", cores=cores)
+    affinity, threads = results.get(timeout=120)
+    proc.join(timeout=30)
+    assert proc.exitcode == 0
+    assert affinity == cores
+    assert threads == len(cores)
@@ -0,0 +1,73 @@
+import copy
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+
+from flash_embed import cli  # noqa: E402
+from flash_embed.config import load_config  # noqa: E402
+from flash_embed.core.pipeline import ShardOrchestrator  # noqa: E402
+
+
+def _run_workers(cfg, count):
+    errors = []
+
+    def worker(worker_id):
+        worker_cfg = copy.deepcopy(cfg)
+        worker_cfg.orchestrator.worker_id = worker_id
+        try:
+            cli.run_orchestrated(worker_cfg)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def _config(tmp_path):
+    cfg = load_config(
+        overrides={
+            "output": {"out_dir": str(tmp_path / "out")},
+            "orchestrator": {"db_path": str(tmp_path / "queue.db")},
+            "postprocess": {"reduce": "pca", "dim": 4},
+        }
+    )
+    orchestrator = ShardOrchestrator(cfg.orchestrator.db_path)
+    orchestrator.add_shards([str(tmp_path / f"data-{i:04d}.tar") for i in range(4)])
+    orchestrator.close()
+    return cfg
+
+
+def test_workers_refuse_to_fit_pca_concurrently(tmp_path, monkeypatch):
+    cfg = _config(tmp_path)
+    started = []
+    monkeypatch.setattr(cli, "run_worker", lambda worker_cfg, *args: started.append(worker_cfg))
+
+    errors = _run_workers(cfg, 2)
+
+    assert len(errors) == 2 and all(isinstance(exc, ValueError) for exc in errors)
+    assert not started
+    assert not (tmp_path / "out" / "projection.npz").exists()
+    orchestrator = ShardOrchestrator(cfg.orchestrator.db_path)
+    assert orchestrator.counts()["pending"] == 4
+    orchestrator.close()
+
+
+def test_workers_share_fitted_projection(tmp_path, monkeypatch):
+    cfg = _config(tmp_path)
+    projection = tmp_path / "out" / "projection.npz"
+    projection.parent.mkdir()
+    np.savez(projection, components=np.eye(8, 4, dtype=np.float32), mean=np.zeros(8, dtype=np.float32))
+    started = []
+    monkeypatch.setattr(cli, "run_worker", lambda worker_cfg, *args: started.append(worker_cfg))
+
+    assert _run_workers(cfg, 2) == []
+
+    assert {worker_cfg.postprocess.projection_path for worker_cfg in started} == {str(projection)}
+    assert len({worker_cfg.output.out_dir for worker_cfg in started}) == 2
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from flash_embed.core.io.reader import Sample
+from flash_embed.core.writer import Writer, iter_outputs, shard_stem
+
+
+def _samples(shard, uids):
+    return [Sample(uid=uid, image=None, text=None, meta={"shard": shard}) for uid in uids]
+
+
+@pytest.mark.parametrize("fmt", ["npy", "npz", "memmap"])
+def test_same_named_shards_from_two_directories_keep_their_outputs(tmp_path, fmt):
+    shards = ["a/data-0000.tar", "b/data-0000.tar"]
+    assert shard_stem(shards[0]) != shard_stem(shards[1])
+
+    writer = Writer(str(tmp_path), fmt=fmt)
+    for value, shard in enumerate(shards):
+        embeddings = np.full((2, 4), value, dtype=np.float32)
+        writer.write_batch({"image": embeddings}, _samples(shard, [f"{shard}-0", f"{shard}-1"]))
+        writer.commit_shard(shard)
+    writer.close()
+
+    outputs = {entry["shard"]: columns for entry, columns in iter_outputs(str(tmp_path))}
+    assert sorted(outputs) == shards
+    for value, shard in enumerate(shards):
+        assert list(outputs[shard]["uid"]) == [f"{shard}-0", f"{shard}-1"]
+        np.testing.assert_array_equal(outputs[shard]["embedding"], np.full((2, 4), value, dtype=np.float32))